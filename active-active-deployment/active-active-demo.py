@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
-import os, uuid, random
-from datetime import datetime, timedelta
-import psycopg2
-from psycopg2.extras import execute_values
-from collections import defaultdict
-
-TABLES = [("rooms", "id"), ("room_members", "room_id"), ("messages", "room_id")]
-
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.batching import AdaptiveBatcher, format_batch_stats
+from citus_sharding.bootstrap import ClusterSpec, bootstrap
+from citus_sharding.catalog import TABLES
+from citus_sharding.copy_loader import format_rates
+from citus_sharding.datagen import fixed
+from citus_sharding.federation import Federation
+from citus_sharding.ids import IdAllocator
+from citus_sharding.metadata import MetadataCache
+from citus_sharding.migrate import load_pins
+from citus_sharding.metrics import (
+    METRICS,
+    format_phases,
+    statement_deltas,
+    statement_snapshot,
+)
+from citus_sharding.multi_cluster import format_report, run_clusters
+from citus_sharding.pipeline import copy_chunks, room_chunks, split_streams
+from citus_sharding.pool import all_stats, close_all, get_pool
+from citus_sharding.shard_stats import ShardStats
+from citus_sharding.tenant_router import TenantRouter
 
 # Two coordinators (Cluster A + Cluster B)
 DSN_A = os.getenv(
@@ -17,250 +32,216 @@ DSN_B = os.getenv(
     "CITUS_DSN_B",
     "dbname=postgres user=postgres password=mypass host=localhost port=6432",
 )
+# Any number of clusters: CITUS_DSNS="dsn1;dsn2;dsn3" (append new clusters at the end)
+DSNS = [d.strip() for d in os.getenv("CITUS_DSNS", "").split(";") if d.strip()] or [
+    DSN_A,
+    DSN_B,
+]
 
 ROOMS_TOTAL = 10_000
 MEMBERS_PER_ROOM = 2
 MSGS_PER_ROOM = 1
+# Rooms generated per chunk; COPY batch sizes adapt per table unless CITUS_ADAPTIVE_BATCH=0
 BATCH = 5_000
+ADAPTIVE_BATCH = os.getenv("CITUS_ADAPTIVE_BATCH", "1") != "0"
+# COPY encoding used by the loader: "text" or "binary"
+COPY_FORMAT = os.getenv("CITUS_COPY_FORMAT", "text")
+# How many clusters to load at the same time (0 = all of them)
+INGEST_CONCURRENCY = int(os.getenv("CITUS_INGEST_CONCURRENCY", "0"))
+# Chunks buffered per cluster between row generation and COPY
+QUEUE_DEPTH = 4
+# Row counts in the shard report: "exact" (count(*) per shard) or "estimate" (reltuples)
+STATS_MODE = os.getenv("CITUS_STATS_MODE", "exact")
+# How many of the latest messages the federated read merges across clusters
+FEDERATED_LIMIT = int(os.getenv("CITUS_FEDERATED_LIMIT", "10"))
+# "1": member/message ids from a Snowflake-style allocator instead of 1..n per room;
+# give every loader process its own CITUS_ID_CLUSTER / CITUS_ID_WORKER slot
+SNOWFLAKE_IDS = os.getenv("CITUS_SNOWFLAKE_IDS") == "1"
+ID_CLUSTER = int(os.getenv("CITUS_ID_CLUSTER", "0"))
+ID_WORKER = int(os.getenv("CITUS_ID_WORKER", "0"))
+# Metrics export paths (JSON / Prometheus text); unset = don't write
+METRICS_JSON = os.getenv("CITUS_METRICS_JSON")
+METRICS_PROM = os.getenv("CITUS_METRICS_PROM")
+# "1": diff pg_stat_statements around each cluster's load (needs it preloaded)
+STATEMENT_STATS = os.getenv("CITUS_PG_STAT_STATEMENTS") == "1"
+
+
+# Tables come from init.sql and workers from the setup_* containers; bootstrap
+# fills in whatever is missing (extension, tables, distribution, colocation)
+SPEC = ClusterSpec(shard_count=3, replication_factor=2)
+
+
+def prepare_cluster(cur, metrics=METRICS):
+    # One catalog query on a ready cluster; missing nodes first, tables once workers are up
+    bootstrap(cur, SPEC, timeout=20, metrics=metrics)
 
 
-def chunked(xs, n):
-    for i in range(0, len(xs), n):
-        yield xs[i : i + n]
+def truncate_cluster(cur):
+    cur.execute("TRUNCATE TABLE messages, room_members, rooms;")
 
 
-def prepare_cluster(cur):
-    # Ensure Citus is available on the coordinator session
-    cur.execute("CREATE EXTENSION IF NOT EXISTS citus;")
+def show_cluster(cur, label, cache, stats):
+    ascii_shard_tables(cur, label, cache, stats)
 
-    # Session-level safety (your ALTER SYSTEM in citus-config.sql sets cluster defaults)
-    cur.execute("SET citus.shard_count = 3;")
-    cur.execute("SET citus.shard_replication_factor = 2;")
 
-    # Distribute & colocate existing tables created by init.sql
-    cur.execute(
-        """
-    DO $$
-    BEGIN
-      IF NOT EXISTS (SELECT 1 FROM pg_dist_partition
-                     WHERE logicalrelid = 'rooms'::regclass) THEN
-        PERFORM create_distributed_table('rooms', 'id');
-      END IF;
+def make_ids():
+    return IdAllocator(ID_CLUSTER, ID_WORKER) if SNOWFLAKE_IDS else None
 
-      IF NOT EXISTS (SELECT 1 FROM pg_dist_partition
-                     WHERE logicalrelid = 'room_members'::regclass) THEN
-        PERFORM create_distributed_table('room_members', 'room_id', colocate_with => 'rooms');
-      END IF;
 
-      IF NOT EXISTS (SELECT 1 FROM pg_dist_partition
-                     WHERE logicalrelid = 'messages'::regclass) THEN
-        PERFORM create_distributed_table('messages', 'room_id', colocate_with => 'rooms');
-      END IF;
-    END$$;
-    """
+def show_federated(fed):
+    # One query per cluster, sent at once; counts merged from partial aggregates.
+    # A cluster that stops answering is skipped and reported, not fatal
+    failed = {}
+    totals = fed.aggregate(
+        "SELECT 'rooms', count(*) FROM rooms UNION ALL "
+        "SELECT 'room_members', count(*) FROM room_members UNION ALL "
+        "SELECT 'messages', count(*) FROM messages;",
+        kinds=("count",),
+        group_by=1,
+        failed=failed,
     )
+    print("\nFederated row counts: " + ", ".join(
+        f"{t}={v[0]:,}" for (t,), v in sorted(totals.items())
+    ))
+    # Latest messages across every cluster: each sends its top N, merged client-side
+    latest = fed.merge(
+        "SELECT created_at, room_id, id FROM messages ORDER BY created_at DESC LIMIT %s;",
+        (FEDERATED_LIMIT,),
+        key=lambda r: r[0],
+        reverse=True,
+        limit=FEDERATED_LIMIT,
+        failed=failed,
+    )
+    print(f"Latest {FEDERATED_LIMIT} messages across clusters:")
+    for created_at, room_id, msg_id in latest:
+        print(f"  {created_at:%Y-%m-%d %H:%M:%S}  room={room_id}  message={msg_id}")
+    for name, error in failed.items():
+        print(f"  (partial: {name} skipped - {error})")
 
 
-def truncate_cluster(cur):
-    cur.execute("TRUNCATE TABLE messages, room_members, rooms;")
-
-
-def make_rows(n_rooms, seed):
-    random.seed(seed)
-    now = datetime.now()
-
-    room_ids = []
-    rooms_rows = []
-    members_rows = []
-    messages_rows = []
-
-    for i in range(n_rooms):
-        rid = (uuid.uuid4().int % 1_000_000_000_000) + 1
-        room_ids.append(rid)
-        rooms_rows.append((rid, random.choice([1, 2, 3]), now, now))
-
-        # two members per room
-        for local_member_id in (1, 2):
-            members_rows.append(
-                (
-                    local_member_id,
-                    rid,
-                    random.randint(1000, 9999),
-                    False,
-                    False,
-                    random.choice([True, False]),
-                    False,
-                    False,
-                    now,
-                    now,
-                )
-            )
-
-        # one message per room
-        ts = now - timedelta(minutes=random.randint(0, 60 * 24 * 7))
-        messages_rows.append(
-            (
-                1,
-                rid,
-                random.choice([1, 2, 3]),
-                f"Hello from room {rid}",
-                random.choice([True, False]),
-                ts,
-                ts,
-                random.choice([1, 2, 3]),
-                False,
-                None,
-                None,
-                ts,
-                ts,
-            )
-        )
-
-    return rooms_rows, members_rows, messages_rows
-
-
-def bulk_insert(cur, rooms_rows, members_rows, messages_rows):
-    for batch in chunked(rooms_rows, BATCH):
-        execute_values(
-            cur,
-            "INSERT INTO rooms (id, room_type, created_at, updated_at) VALUES %s",
-            batch,
-        )
-    for batch in chunked(members_rows, BATCH):
-        execute_values(
-            cur,
-            """
-          INSERT INTO room_members
-          (id, room_id, member_id, is_pinned, is_deleted, is_muted, is_archived, is_locked,
-           created_at, updated_at) VALUES %s
-        """,
-            batch,
-        )
-    for batch in chunked(messages_rows, BATCH):
-        execute_values(
-            cur,
-            """
-          INSERT INTO messages
-          (id, room_id, message_type, text, is_by_partner, local_timestamp,
-           server_timestamp, status, is_deleted, action, parent_message_id,
-           created_at, updated_at) VALUES %s
-        """,
-            batch,
-        )
+def load_cluster(chunks, batcher=None, metrics=METRICS):
+    """Job for run_clusters(): prepare, truncate and COPY one cluster's chunk stream."""
 
+    def job(cur):
+        before = statement_snapshot(cur, create=True) if STATEMENT_STATS else None
+        with metrics.phase("prepare"):
+            prepare_cluster(cur, metrics)
+        with metrics.phase("truncate"):
+            truncate_cluster(cur)
+        with metrics.phase("commit"):
+            cur.connection.commit()
+        with metrics.phase("load"):
+            stats = copy_chunks(cur, chunks, fmt=COPY_FORMAT, batcher=batcher, metrics=metrics)
+        if before is not None:
+            metrics.add_statements(statement_deltas(before, statement_snapshot(cur)))
+        return stats
 
-def show_cluster(cur, label):
-    ascii_shard_tables(cur, label)
+    return job
 
 
 def main():
-    # Split exactly half of the rooms/messages to each cluster
-    rooms_a = ROOMS_TOTAL // 2
-    rooms_b = ROOMS_TOTAL - rooms_a
-
-    conn_a = psycopg2.connect(DSN_A)
-    cur_a = conn_a.cursor()
-    conn_b = psycopg2.connect(DSN_B)
-    cur_b = conn_b.cursor()
-
-    # Prepare (tables, distribution) on both clusters
-    prepare_cluster(cur_a)
-    prepare_cluster(cur_b)
-    truncate_cluster(cur_a)
-    truncate_cluster(cur_b)
-    conn_a.commit()
-    conn_b.commit()
-
-    # Generate rows
-    rooms_rows_a, members_rows_a, messages_rows_a = make_rows(rooms_a, seed=123)
-    rooms_rows_b, members_rows_b, messages_rows_b = make_rows(rooms_b, seed=456)
-
-    # Insert into Cluster A
-    bulk_insert(cur_a, rooms_rows_a, members_rows_a, messages_rows_a)
-    conn_a.commit()
-    print(
-        f"Cluster A inserted: rooms={len(rooms_rows_a)}, members={len(members_rows_a)}, messages={len(messages_rows_a)}"
+    # Every room goes to exactly one cluster, chosen by the tenant router
+    router = TenantRouter(DSNS)
+    # Rooms moved by citus_sharding.migrate stay on their new cluster
+    pinned = load_pins(router)
+    if pinned:
+        print(f"Applied {pinned} tenant migration(s): {len(router.overrides()):,} pinned rooms")
+
+    # Generate rows in bounded chunks. When every cluster loads at once, one producer
+    # feeds a queue per cluster; with a lower CITUS_INGEST_CONCURRENCY clusters load
+    # one after another, so each gets its own producer (a shared one would deadlock)
+    ids = make_ids()  # one allocator for every producer, so ids never repeat
+    streams = split_streams(
+        lambda: METRICS.timed_iter(
+            "generate",
+            room_chunks(
+                ROOMS_TOTAL,
+                seed=123,
+                chunk_rooms=BATCH,
+                members=fixed(MEMBERS_PER_ROOM),
+                messages=fixed(MSGS_PER_ROOM),
+                ids=ids,
+            ),
+        ),
+        router.route,
+        len(router),
+        concurrent=not INGEST_CONCURRENCY or INGEST_CONCURRENCY >= len(router),
+        depth=QUEUE_DEPTH,
     )
 
-    # Insert into Cluster B
-    bulk_insert(cur_b, rooms_rows_b, members_rows_b, messages_rows_b)
-    conn_b.commit()
-    print(
-        f"Cluster B inserted: rooms={len(rooms_rows_b)}, members={len(members_rows_b)}, messages={len(messages_rows_b)}"
-    )
-
-    # Show placements
-    show_cluster(cur_a, "Cluster A")
-    show_cluster(cur_b, "Cluster B")
-
-    cur_a.close()
-    conn_a.close()
-    cur_b.close()
-    conn_b.close()
-    print(
-        "\n✅ Done. (Total rooms=10k, members=20k, messages=10k across two clusters.)"
+    # Load all clusters at once; each one commits (or fails) on its own
+    batchers = [AdaptiveBatcher() if ADAPTIVE_BATCH else None for _ in router.dsns]
+    jobs = [
+        (
+            label,
+            router.dsns[idx],
+            load_cluster(streams[idx], batchers[idx], METRICS.bind(cluster=label)),
+            # closed if the job fails before reading it, so the others keep loading
+            streams[idx],
+        )
+        for idx, label in enumerate(router.names)
+    ]
+    results, wall = run_clusters(
+        jobs, concurrency=INGEST_CONCURRENCY or None, metrics=METRICS
     )
+    for idx, r in enumerate(results):
+        if r["ok"]:
+            print(f"{r['cluster']} inserted: {format_rates(r['stats'])}")
+            if batchers[idx] is not None:
+                print(format_batch_stats(batchers[idx].stats()))
+    print(format_report(results, wall))
+    print("Phases:\n" + format_phases(METRICS))
+    METRICS.export(METRICS_JSON, METRICS_PROM)
+
+    # Show placements; one metadata cache and stats engine per cluster, reused
+    # across reports (ShardStats keeps its last snapshot for incremental modes)
+    caches = {dsn: MetadataCache() for dsn in router.dsns}
+    shard_stats = {dsn: ShardStats() for dsn in router.dsns}
+    for idx, r in enumerate(results):
+        if not r["ok"]:
+            continue
+        # reuses the connection the load returned to this cluster's pool
+        with get_pool(router.dsns[idx]).connection() as conn:
+            with conn.cursor() as cur:
+                dsn = router.dsns[idx]
+                show_cluster(cur, r["cluster"], caches[dsn], shard_stats[dsn])
+
+    # Federated reads only over the clusters that loaded; never fatal, so the
+    # pool stats and the failure summary below always print
+    ok = [idx for idx, r in enumerate(results) if r["ok"]]
+    if ok:
+        try:
+            show_federated(
+                Federation([router.dsns[i] for i in ok], [router.names[i] for i in ok])
+            )
+        except Exception as e:
+            print(f"\nFederated read failed: {type(e).__name__}: {e}")
 
-
-def fetch_counts(cur):
-    counts = {}
-    for table, key in TABLES:
-        cur.execute(
-            f"""
-            SELECT get_shard_id_for_distribution_column('{table}', {key}) AS shardid,
-                   COUNT(*) AS rows
-            FROM {table}
-            GROUP BY 1
-            ORDER BY 1;
-        """
+    for dsn, st in all_stats().items():
+        label = router.names[router.dsns.index(dsn)] if dsn in router.dsns else dsn
+        print(
+            f"Pool {label}: {st['created']} connections for {st['checkouts']} checkouts, "
+            f"{st['waits']} waits ({st['wait_seconds']:.2f}s), {st['evicted_broken']} evicted"
         )
-        for sid, rows in cur.fetchall():
-            counts[(table, int(sid))] = int(rows)
-    return counts
-
-
-def fetch_placements(cur):
-    placements = defaultdict(list)
-    cur.execute(
-        """
-        SELECT s.logicalrelid::text AS tbl, s.shardid, n.nodename, n.nodeport
-        FROM pg_dist_shard s
-        JOIN pg_dist_placement p USING (shardid)
-        JOIN pg_dist_node n ON p.groupid = n.groupid
-        WHERE s.logicalrelid IN ('rooms'::regclass,'room_members'::regclass,'messages'::regclass)
-        ORDER BY tbl, shardid, n.nodename, n.nodeport;
-    """
-    )
-    for tbl, sid, node, port in cur.fetchall():
-        placements[(tbl, int(sid))].append((node, int(port)))
-    return dict(placements)
-
-
-def fetch_ranges(cur):
-    ranges = {}
-    cur.execute(
-        """
-        SELECT s.logicalrelid::text AS tbl, s.shardid, s.shardminvalue::text, s.shardmaxvalue::text
-        FROM pg_dist_shard s
-        WHERE s.logicalrelid IN ('rooms'::regclass,'room_members'::regclass,'messages'::regclass)
-        ORDER BY tbl, shardid;
-    """
+    close_all()
+
+    failed = [r["cluster"] for r in results if not r["ok"]]
+    if failed:
+        print(f"\n⚠️  Failed clusters (others were committed): {', '.join(failed)}")
+    totals = {
+        t: sum(r["stats"].get(t, {}).get("rows", 0) for r in results if r["ok"])
+        for t in ("rooms", "room_members", "messages")
+    }
+    print(
+        f"\n✅ Done. (Total rooms={totals['rooms']:,}, members={totals['room_members']:,}, "
+        f"messages={totals['messages']:,} across {len(router)} clusters.)"
     )
-    for tbl, sid, mn, mx in cur.fetchall():
-        ranges[(tbl, int(sid))] = (mn, mx)
-    return ranges
 
 
-def grouped_colocation(ranges):
-    by_range = defaultdict(dict)
-    for (tbl, sid), rng in ranges.items():
-        by_range[rng][tbl] = sid
-    ordered = []
-    for idx, (rng, mapping) in enumerate(sorted(by_range.items(), key=lambda x: x[0])):
-        ordered.append(
-            (idx + 1, mapping)
-        )  # e.g. (1, {'rooms':102008,'room_members':102012,'messages':102016})
-    return ordered
+def fetch_counts(cur, stats, placements=None):
+    # Per-shard row counts from the cluster's stats engine (no scan of the distributed tables)
+    snapshot = stats.collect(cur, STATS_MODE, placements)
+    return {key: s["rows"] for key, s in snapshot["shards"].items()}
 
 
 def compute_display_roles(groups, placements):
@@ -288,11 +269,13 @@ def compute_display_roles(groups, placements):
     return shard_role, group_primary
 
 
-def ascii_shard_tables(cur, cluster_label):
-    counts = fetch_counts(cur)
-    placements = fetch_placements(cur)
-    ranges = fetch_ranges(cur)
-    groups = grouped_colocation(ranges)
+def ascii_shard_tables(cur, cluster_label, cache, stats):
+    # Shards, placements and colocation groups in one metadata round-trip
+    # (only a fingerprint check while the cluster's cached topology is current)
+    topo = cache.get(cur)
+    placements = topo.placements
+    groups = topo.groups
+    counts = fetch_counts(cur, stats, placements)
     shard_role, _ = compute_display_roles(groups, placements)
 
     print(
@@ -1,235 +1,216 @@
 #!/usr/bin/env python3
-import os, uuid, random, time
-from datetime import datetime, timedelta
-import psycopg2
-from psycopg2.extras import execute_values
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.batching import AdaptiveBatcher, format_batch_stats
+from citus_sharding.bootstrap import ClusterSpec, bootstrap, connect, format_bootstrap
+from citus_sharding.datagen import ChatDataGen
+from citus_sharding.ids import IdAllocator
+from citus_sharding.metadata import MetadataCache, parse_node_map
+from citus_sharding.metrics import (
+    METRICS,
+    format_phases,
+    statement_deltas,
+    statement_snapshot,
+)
+from citus_sharding.pipeline import copy_chunks, prefetch, room_chunks
+from citus_sharding.read_write import ReadWriteRouter
+from citus_sharding.room_cache import RoomCache
+from citus_sharding.resumable import ResumableLoader, clear_checkpoint, read_checkpoint
+from citus_sharding.shard_writer import ShardWriter
 
 # Connect through HAProxy so you always hit the Patroni leader
 DSN = os.getenv(
     "CITUS_DSN",
     "dbname=postgres user=postgres password=mypass host=localhost port=5000",
 )
+# HAProxy read endpoint (standbys within the lag limit); set empty to read from the leader only
+READ_DSN = os.getenv(
+    "CITUS_READ_DSN",
+    "dbname=postgres user=postgres password=mypass host=localhost port=5001",
+)
 
 ROOMS = 10_000
+SEED = 42
+# Rooms generated per chunk; COPY batch sizes adapt per table unless CITUS_ADAPTIVE_BATCH=0
 BATCH = 5_000
+ADAPTIVE_BATCH = os.getenv("CITUS_ADAPTIVE_BATCH", "1") != "0"
+# COPY encoding used by load(): "text" or "binary"
+COPY_FORMAT = os.getenv("CITUS_COPY_FORMAT", "text")
+# Chunks buffered between row generation and COPY
+QUEUE_DEPTH = 4
+# >0: load with that many parallel connections, one lane per set of shard groups
+WRITER_CONNECTIONS = int(os.getenv("CITUS_WRITER_CONNECTIONS", "0"))
+# "1": with WRITER_CONNECTIONS, COPY straight into worker shard tables (bypass coordinator)
+DIRECT_TO_SHARDS = os.getenv("CITUS_DIRECT_TO_SHARDS") == "1"
+# Where the direct COPYs reach each worker: pg_dist_node name -> address from this host
+# (docker-compose publishes worker1..3 on 5442..5444)
+NODE_MAP = os.getenv(
+    "CITUS_NODE_MAP",
+    "worker1:5432=localhost:5442,worker2:5432=localhost:5443,worker3:5432=localhost:5444",
+)
+# "1": commit per chunk with a checkpoint and survive Patroni failovers (resume by CITUS_LOAD_ID)
+RESUMABLE = os.getenv("CITUS_RESUMABLE") == "1"
+LOAD_ID = os.getenv("CITUS_LOAD_ID", "demo")
+# "1": member/message ids from a Snowflake-style allocator instead of 1..n per room
+# (ignored with CITUS_RESUMABLE, whose replayed chunks must be identical);
+# give every loader process its own CITUS_ID_CLUSTER / CITUS_ID_WORKER slot
+SNOWFLAKE_IDS = os.getenv("CITUS_SNOWFLAKE_IDS") == "1"
+ID_CLUSTER = int(os.getenv("CITUS_ID_CLUSTER", "0"))
+ID_WORKER = int(os.getenv("CITUS_ID_WORKER", "0"))
+# Metrics export paths (JSON / Prometheus text); unset = don't write
+METRICS_JSON = os.getenv("CITUS_METRICS_JSON")
+METRICS_PROM = os.getenv("CITUS_METRICS_PROM")
+# "1": diff pg_stat_statements around the load (preloaded by patroni.yml)
+STATEMENT_STATS = os.getenv("CITUS_PG_STAT_STATEMENTS") == "1"
+
+# Patroni REST endpoints (published by docker-compose); readiness is taken from them
+# before connecting through HAProxy. Set empty to just retry the connection.
+PATRONI_URLS = [
+    u.strip()
+    for u in os.getenv("CITUS_PATRONI_URLS", "http://localhost:8008,http://localhost:8009").split(",")
+    if u.strip()
+]
+
+# Workers, tables, 3 shards, RF=2 (so at least 2 active workers)
+SPEC = ClusterSpec(
+    workers=(("worker1", 5432), ("worker2", 5432), ("worker3", 5432)),
+    shard_count=3,
+    replication_factor=2,
+)
 
-# RF=2 => need at least 2 active workers
-REQUIRED_WORKERS = 2
-DEFAULT_NODES = (("worker1", 5432), ("worker2", 5432), ("worker3", 5432))
-
-
-def chunked(xs, n):
-    for i in range(0, len(xs), n):
-        yield xs[i : i + n]
-
-
-def ensure_workers(cur, nodes=DEFAULT_NODES, wait_s=20):
-    """Make sure Citus is installed, workers are registered, and active."""
-    cur.execute("CREATE EXTENSION IF NOT EXISTS citus;")
-
-    # Handle both column name variants across Citus versions
-    cur.execute("SELECT * FROM citus_get_active_worker_nodes();")
-    cols = [d.name.lower() for d in cur.description]
-
-    def idx(options):
-        for name in options:
-            if name in cols:
-                return cols.index(name)
-        raise RuntimeError(f"Expected one of {options} in {cols}")
-
-    i_name = idx(["node_name", "nodename"])
-    i_port = idx(["node_port", "nodeport"])
 
-    have = {(row[i_name], int(row[i_port])) for row in cur.fetchall()}
+def prepare(cur):
+    # One catalog query; missing nodes are added first, tables only once workers are active
+    report = bootstrap(cur, SPEC, timeout=20, metrics=METRICS)
+    print(format_bootstrap(report))
 
-    # Add any missing workers
-    for n, p in nodes:
-        if (n, p) not in have:
-            cur.execute("SELECT citus_add_node(%s,%s);", (n, p))
-            print(f"Added worker: {n}:{p}")
 
-    # Wait for enough active workers
-    deadline = time.time() + wait_s
-    last = -1
-    while True:
-        cur.execute("SELECT count(*) FROM citus_get_active_worker_nodes();")
-        cnt = cur.fetchone()[0]
-        if cnt != last:
-            print(f"Active workers: {cnt}")
-            last = cnt
-        if cnt >= REQUIRED_WORKERS:
-            break
-        if time.time() > deadline:
-            raise RuntimeError(
-                f"Only {cnt} worker(s) active; need >= {REQUIRED_WORKERS} for RF=2"
-            )
-        time.sleep(1)
+def make_ids():
+    return IdAllocator(ID_CLUSTER, ID_WORKER) if SNOWFLAKE_IDS else None
 
 
-def prepare(cur):
-    # Ensure workers first (so RF checks won't fail during distribution)
-    ensure_workers(cur)
-
-    # Session GUCs used when creating shards
-    cur.execute("SET citus.shard_count = 3;")
-    cur.execute("SET citus.shard_replication_factor = 2;")
-
-    # Tables (per your schema; no FKs)
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS rooms (
-      id BIGINT PRIMARY KEY,
-      room_type SMALLINT NOT NULL,
-      created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-      updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE TABLE IF NOT EXISTS room_members (
-      id BIGINT,
-      room_id BIGINT NOT NULL,
-      member_id BIGINT NOT NULL,
-      is_pinned BOOLEAN DEFAULT FALSE,
-      is_deleted BOOLEAN DEFAULT FALSE,
-      is_muted BOOLEAN DEFAULT FALSE,
-      is_archived BOOLEAN DEFAULT FALSE,
-      is_locked BOOLEAN DEFAULT FALSE,
-      created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-      updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-      PRIMARY KEY (id, room_id)
-    );
-    CREATE TABLE IF NOT EXISTS messages (
-      id BIGINT,
-      room_id BIGINT NOT NULL,
-      message_type SMALLINT NOT NULL,
-      text TEXT,
-      is_by_partner BOOLEAN DEFAULT FALSE,
-      local_timestamp TIMESTAMPTZ,
-      server_timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-      status SMALLINT,
-      is_deleted BOOLEAN DEFAULT FALSE,
-      action SMALLINT,
-      parent_message_id BIGINT,
-      created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-      updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-      PRIMARY KEY (id, room_id)
-    );
-    """
+def load(cur):
+    # Rooms plus their members (2 per room) and messages (1 per room), generated
+    # in BATCH-room chunks on a background thread while the previous chunk is COPYed
+    chunks = prefetch(
+        METRICS.timed_iter(
+            "generate", room_chunks(ROOMS, seed=SEED, chunk_rooms=BATCH, ids=make_ids())
+        ),
+        depth=QUEUE_DEPTH,
     )
-
-    # Distribute & colocate by room_id (only if not already distributed)
-    cur.execute(
-        """
-    DO $$
-    BEGIN
-      IF NOT EXISTS (SELECT 1 FROM pg_dist_partition WHERE logicalrelid='rooms'::regclass) THEN
-        PERFORM create_distributed_table('rooms', 'id');
-      END IF;
-      IF NOT EXISTS (SELECT 1 FROM pg_dist_partition WHERE logicalrelid='room_members'::regclass) THEN
-        PERFORM create_distributed_table('room_members', 'room_id', colocate_with => 'rooms');
-      END IF;
-      IF NOT EXISTS (SELECT 1 FROM pg_dist_partition WHERE logicalrelid='messages'::regclass) THEN
-        PERFORM create_distributed_table('messages', 'room_id', colocate_with => 'rooms');
-      END IF;
-    END$$;
-    """
+    batcher = AdaptiveBatcher() if ADAPTIVE_BATCH else None
+    stats = copy_chunks(cur, chunks, COPY_FORMAT, batcher, METRICS)
+    for table, st in stats.items():
+        print(f"Inserted {table}: {st['rows']:,} ({st['rows_per_s']:,.0f} rows/s)")
+    if batcher is not None:
+        print("Adaptive batch sizes:\n" + format_batch_stats(batcher.stats()))
+    return stats
+
+
+def load_parallel(cur):
+    # Route rows to shard groups client-side and load each group on its own connection
+    router = MetadataCache().get(cur).router()
+    writer = ShardWriter(
+        DSN,
+        router,
+        connections=WRITER_CONNECTIONS,
+        fmt=COPY_FORMAT,
+        direct=DIRECT_TO_SHARDS,
+        node_dsns=parse_node_map(NODE_MAP, DSN),
+        depth=QUEUE_DEPTH,
+        metrics=METRICS,
     )
-
-
-def load(cur):
-    random.seed(42)
-    now = datetime.now()
-
-    # Rooms
-    room_ids, rooms_rows = [], []
-    for _ in range(ROOMS):
-        rid = (uuid.uuid4().int % 1_000_000_000_000) + 1
-        room_ids.append(rid)
-        rooms_rows.append((rid, random.choice([1, 2, 3]), now, now))
-    for batch in chunked(rooms_rows, BATCH):
-        execute_values(
-            cur,
-            "INSERT INTO rooms (id, room_type, created_at, updated_at) VALUES %s",
-            batch,
-        )
-    print(f"Inserted rooms: {len(rooms_rows):,}")
-
-    # Room members (2 per room)
-    members_rows = []
-    for rid in room_ids:
-        for local_member_id in (1, 2):
-            members_rows.append(
-                (
-                    local_member_id,
-                    rid,
-                    random.randint(1000, 9999),
-                    False,
-                    False,
-                    random.choice([True, False]),
-                    False,
-                    False,
-                    now,
-                    now,
-                )
-            )
-    for batch in chunked(members_rows, BATCH):
-        execute_values(
-            cur,
-            """
-          INSERT INTO room_members
-          (id, room_id, member_id, is_pinned, is_deleted, is_muted, is_archived, is_locked,
-           created_at, updated_at) VALUES %s
-        """,
-            batch,
-        )
-    print(f"Inserted room_members: {len(members_rows):,}")
-
-    # Messages (1 per room)
-    messages_rows = []
-    for rid in room_ids:
-        ts = now - timedelta(minutes=random.randint(0, 10080))
-        messages_rows.append(
-            (
-                1,
-                rid,
-                random.choice([1, 2, 3]),
-                f"Hello from room {rid}",
-                random.choice([True, False]),
-                ts,
-                ts,
-                random.choice([1, 2, 3]),
-                False,
-                None,
-                None,
-                ts,
-                ts,
-            )
-        )
-    for batch in chunked(messages_rows, BATCH):
-        execute_values(
-            cur,
-            """
-          INSERT INTO messages
-          (id, room_id, message_type, text, is_by_partner, local_timestamp,
-           server_timestamp, status, is_deleted, action, parent_message_id,
-           created_at, updated_at) VALUES %s
-        """,
-            batch,
+    result = writer.write(
+        METRICS.timed_iter(
+            "generate", room_chunks(ROOMS, seed=SEED, chunk_rooms=BATCH, ids=make_ids())
         )
-    print(f"Inserted messages: {len(messages_rows):,}")
+    )
+    for table, st in result["tables"].items():
+        print(f"Inserted {table}: {st['rows']:,} ({st['rows_per_s']:,.0f} rows/s)")
+    failed = [r for r in result["lanes"] if not r["ok"]]
+    for r in failed:
+        print(f"Writer lane {r['lane']} failed: {r['error']}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(result['lanes'])} writer lanes failed")
+    return result["tables"]
+
+
+def load_resumable():
+    # Idempotent per-chunk commits + checkpoint; reconnects through HAProxy on failover
+    loader = ResumableLoader(DSN, LOAD_ID, fmt=COPY_FORMAT, metrics=METRICS)
+    result = loader.run(
+        lambda: METRICS.timed_iter("generate", room_chunks(ROOMS, seed=SEED, chunk_rooms=BATCH))
+    )
+    if result["already_complete"]:
+        print("Set a new CITUS_LOAD_ID to load again from scratch")
+        return result
+    for table, rows in result["tables"].items():
+        print(f"Inserted {table}: {rows:,}")
+    print(
+        f"Load {LOAD_ID!r}: {result['batches']} batches from batch {result['resumed_from']}, "
+        f"{result['reconnects']} reconnects"
+    )
+    return result
+
+
+def dashboard(session):
+    rooms, members, messages = session.execute(
+        "SELECT (SELECT count(*) FROM rooms), (SELECT count(*) FROM room_members), "
+        "(SELECT count(*) FROM messages);"
+    )[0]
+    print(f"\nDashboard: rooms={rooms:,}, members={members:,}, messages={messages:,}")
+    # hot-room lookups (membership, last messages) go through the read-through cache
+    cache = RoomCache.for_session(session)
+    room_id = ChatDataGen(SEED).room_ids(1)[0]
+    for _ in range(3):
+        members = cache.members(room_id)
+        latest = cache.recent_messages(room_id, 5)
+    print(f"Room {room_id} members: {list(members)}, {len(latest)} recent message(s)")
+    print(f"Read routing: {session.router.stats()}")
+    print(f"Room cache: {cache.stats()}")
 
 
 def main():
-    conn = psycopg2.connect(DSN)
+    # Waits (with backoff) for a Patroni leader, then for HAProxy to route to it
+    conn = connect(DSN, timeout=60, patroni_urls=PATRONI_URLS, metrics=METRICS)
     cur = conn.cursor()
 
-    prepare(cur)
+    before = statement_snapshot(cur, create=True) if STATEMENT_STATS else None
     conn.commit()
-
-    # Optional: start fresh each run
-    cur.execute("TRUNCATE TABLE messages, room_members, rooms;")
-    conn.commit()
-
-    load(cur)
+    with METRICS.phase("prepare"):
+        prepare(cur)
+        conn.commit()
+
+    # Optional: start fresh each run (a resumable load keeps what it already committed)
+    with METRICS.phase("truncate"):
+        if not (RESUMABLE and read_checkpoint(cur, LOAD_ID)):
+            cur.execute("TRUNCATE TABLE messages, room_members, rooms;")
+            # the rows every checkpoint counted are gone with it
+            clear_checkpoint(cur)
+        conn.commit()
+
+    with METRICS.phase("load"):
+        if RESUMABLE:
+            load_resumable()
+        elif WRITER_CONNECTIONS:
+            load_parallel(cur)
+        else:
+            load(cur)
+            with METRICS.phase("commit"):
+                conn.commit()
+
+    if before is not None:
+        METRICS.add_statements(statement_deltas(before, statement_snapshot(cur)))
+        conn.commit()
+    print("Phases:\n" + format_phases(METRICS))
+    METRICS.export(METRICS_JSON, METRICS_PROM)
+
+    # Dashboard reads go to the standbys, but not before they have our load
+    session = ReadWriteRouter(DSN, READ_DSN or None).session()
+    session.observe_write(cur)
     conn.commit()
+    dashboard(session)
 
     cur.close()
     conn.close()
@@ -0,0 +1 @@
+"""Shared helpers for the active-active and active-passive Citus demos."""
@@ -0,0 +1,112 @@
+"""Adaptive batch sizing for the COPY write path.
+
+AdaptiveBatcher picks a batch size per table: it starts small, measures each
+batch's latency and bytes, grows toward `target_seconds` (never past
+`max_bytes` per batch) and cuts the size multiplicatively when a batch runs
+well over target, e.g. while Patroni fails over or autovacuum competes for
+I/O. stats() reports the chosen size and observed throughput per table.
+"""
+import threading
+
+
+class AdaptiveBatcher:
+    def __init__(
+        self,
+        initial=1_000,
+        min_size=100,
+        max_size=200_000,
+        target_seconds=0.5,
+        max_bytes=32 << 20,
+        growth=2.0,
+        backoff=0.5,
+        smoothing=0.3,
+    ):
+        self.initial = initial
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.growth = growth
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _state(self, table):
+        st = self._tables.get(table)
+        if st is None:
+            st = self._tables[table] = {
+                "size": self.initial,
+                "batches": 0,
+                "rows": 0,
+                "bytes": 0,
+                "seconds": 0.0,
+                "backoffs": 0,
+                "sec_per_row": None,
+                "bytes_per_row": None,
+                "last_seconds": 0.0,
+            }
+        return st
+
+    def next_size(self, table):
+        with self._lock:
+            return self._state(table)["size"]
+
+    def observe(self, table, rows, nbytes, seconds):
+        """Record one finished batch and adjust the table's next size."""
+        if rows <= 0:
+            return
+        with self._lock:
+            st = self._state(table)
+            st["batches"] += 1
+            st["rows"] += rows
+            st["bytes"] += nbytes
+            st["seconds"] += seconds
+            st["last_seconds"] = seconds
+
+            # exponentially weighted per-row cost
+            a = self.smoothing
+            spr, bpr = seconds / rows, nbytes / rows
+            if st["sec_per_row"] is not None:
+                spr = a * spr + (1 - a) * st["sec_per_row"]
+                bpr = a * bpr + (1 - a) * st["bytes_per_row"]
+            st["sec_per_row"], st["bytes_per_row"] = spr, bpr
+
+            if seconds > 2 * self.target_seconds:
+                # statement got slow (failover, vacuum, lock waits): back off now
+                size = st["size"] * self.backoff
+                st["backoffs"] += 1
+            else:
+                ideal = self.target_seconds / spr if spr > 0 else self.max_size
+                size = min(ideal, st["size"] * self.growth)
+            if bpr:
+                size = min(size, self.max_bytes / bpr)
+            st["size"] = int(max(self.min_size, min(self.max_size, size)))
+
+    def stats(self):
+        """{table: {size, batches, rows, bytes, seconds, rows_per_s, bytes_per_s, ...}}"""
+        with self._lock:
+            out = {}
+            for table, st in self._tables.items():
+                s = st["seconds"]
+                out[table] = {
+                    "size": st["size"],
+                    "batches": st["batches"],
+                    "rows": st["rows"],
+                    "bytes": st["bytes"],
+                    "seconds": s,
+                    "backoffs": st["backoffs"],
+                    "last_seconds": st["last_seconds"],
+                    "rows_per_s": st["rows"] / s if s > 0 else 0.0,
+                    "bytes_per_s": st["bytes"] / s if s > 0 else 0.0,
+                }
+            return out
+
+
+def format_batch_stats(stats):
+    return "\n".join(
+        f"  {table}: batch={s['size']:,} rows after {s['batches']} batches, "
+        f"{s['rows_per_s']:,.0f} rows/s, {s['bytes_per_s'] / 1e6:,.1f} MB/s, "
+        f"{s['backoffs']} backoffs"
+        for table, s in stats.items()
+    )
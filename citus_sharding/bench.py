@@ -0,0 +1,684 @@
+"""Open-loop chat workload benchmark for both deployments.
+
+The workload model mixes the chat operations the application runs:
+
+    post_message     INSERT one message into a room
+    recent_messages  newest `recent` messages of a room (read)
+    join_room        INSERT a room_members row
+    leave_room       DELETE a member this worker joined earlier
+    update_member    toggle is_muted / is_pinned on such a member
+
+Rooms are the ones the demos load (ChatDataGen room ids for `seed`: 42 for
+the active-passive loader, 123 for the active-active demo), picked uniformly
+or zipf-skewed (`skew` > 0). Message and member ids come from an
+ids.IdAllocator slot per process, so processes never collide.
+
+Requests arrive open-loop: each of `processes` worker processes draws
+Poisson arrivals at rate/processes and hands them to `threads` threads.
+Latency is measured from the scheduled arrival time, not from when a thread
+got to it, so a slow backend shows up as queueing delay instead of silently
+lowering the offered load (coordinated omission). Latencies go into
+LatencyHistogram, a log-linear histogram in the HdrHistogram style (bounded
+relative error, mergeable across processes).
+
+Targets (all run the same statements):
+
+    active-active  rooms routed over the clusters' coordinators (TenantRouter)
+    haproxy        Patroni leader on :5000, reads on :5001 (read_write.Session)
+    local          in-process stand-in with simulated service times, to test
+                   the harness itself without a cluster
+
+Results are JSON (per-operation counts, errors, percentiles and the full
+histogram); --compare prints several result files side by side.
+
+Usage:
+    python -m citus_sharding.bench --target local --rate 500 --duration 10
+    python -m citus_sharding.bench --target active-active --seed 123 \\
+        --dsn "host=localhost port=5432 ..." --dsn "host=localhost port=6432 ..." --out aa.json
+    python -m citus_sharding.bench --target haproxy --dsn "host=localhost port=5000 ..." \\
+        --read-dsn "host=localhost port=5001 ..." --out ap.json
+    python -m citus_sharding.bench --compare aa.json ap.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import accumulate
+
+from citus_sharding.copy_loader import COLUMNS
+from citus_sharding.datagen import ChatDataGen
+from citus_sharding.ids import MAX_CLUSTER, MAX_WORKER, IdAllocator
+from citus_sharding.migrate import PinWatcher
+from citus_sharding.pool import close_all, get_pool
+from citus_sharding.read_write import ReadWriteRouter
+from citus_sharding.tenant_router import TenantRouter
+
+MIX = {
+    "post_message": 0.30,
+    "recent_messages": 0.50,
+    "join_room": 0.07,
+    "leave_room": 0.05,
+    "update_member": 0.08,
+}
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+MESSAGE_COLUMNS = COLUMNS["messages"]
+MEMBER_COLUMNS = COLUMNS["room_members"]
+
+INSERT_MESSAGE = (
+    f"INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(MESSAGE_COLUMNS))});"
+)
+INSERT_MEMBER = (
+    f"INSERT INTO room_members ({', '.join(MEMBER_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(MEMBER_COLUMNS))});"
+)
+RECENT_MESSAGES = (
+    f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages WHERE room_id = %s "
+    "ORDER BY created_at DESC, id DESC LIMIT %s;"
+)
+DELETE_MEMBER = "DELETE FROM room_members WHERE room_id = %s AND id = %s;"
+UPDATE_MEMBER = (
+    "UPDATE room_members SET is_muted = %s, is_pinned = %s, updated_at = now() "
+    "WHERE room_id = %s AND id = %s;"
+)
+
+
+# ---------- latency histogram ----------
+
+
+class LatencyHistogram:
+    """Log-linear histogram of integer microseconds, HdrHistogram style.
+
+    Values below 2**sub_bucket_bits are exact; above that every power of two
+    is split into 2**(sub_bucket_bits - 1) buckets, so the relative error is
+    below 2**-(sub_bucket_bits - 1) (under 1% with the default 8 bits).
+    """
+
+    def __init__(self, sub_bucket_bits=8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = {}  # bucket lower bound (us) -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _bucket(self, value):
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return (value >> shift) << shift, shift
+
+    def record(self, value, n=1):
+        value = max(0, int(value))
+        low, _ = self._bucket(value)
+        self.counts[low] = self.counts.get(low, 0) + n
+        self.count += n
+        self.total += value * n
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def record_seconds(self, seconds):
+        self.record(seconds * 1_000_000)
+
+    def merge(self, other):
+        for low, n in other.counts.items():
+            self.counts[low] = self.counts.get(low, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        """Highest value equivalent to the p-th percentile (us), like HdrHistogram."""
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for low in sorted(self.counts):
+            seen += self.counts[low]
+            if seen >= rank:
+                _, shift = self._bucket(low)
+                return min(low + (1 << shift) - 1, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            "sub_bucket_bits": self.sub_bucket_bits,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "counts": sorted(self.counts.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d["sub_bucket_bits"])
+        h.counts = {int(low): n for low, n in d["counts"]}
+        h.count, h.total, h.min, h.max = d["count"], d["total"], d["min"], d["max"]
+        return h
+
+
+# ---------- backends ----------
+
+
+class LocalBackend:
+    """In-process stand-in for a cluster: dict storage plus simulated service times.
+
+    Service times are exponential with the given means (ms); `servers` caps
+    how many requests are served at once, so overload builds a queue like a
+    saturated connection pool would.
+    """
+
+    kind = "local"
+
+    def __init__(self, read_ms=0.5, write_ms=1.5, servers=8, seed=None):
+        self.read_ms = read_ms
+        self.write_ms = write_ms
+        self._slots = threading.BoundedSemaphore(servers)
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._messages = {}  # room_id -> [row, ...] oldest first
+        self._members = {}  # (room_id, id) -> row
+
+    def _serve(self, mean_ms):
+        with self._lock:
+            delay = self._rng.expovariate(1000.0 / mean_ms) if mean_ms > 0 else 0.0
+        with self._slots:
+            time.sleep(delay)
+
+    def read(self, room_id, sql, params):
+        self._serve(self.read_ms)
+        if sql != RECENT_MESSAGES:
+            raise ValueError("LocalBackend only runs the workload's statements")
+        limit = params[1]
+        with self._lock:
+            rows = self._messages.get(room_id, ())
+            return [tuple(r) for r in reversed(rows[-limit:])]
+
+    def write(self, room_id, sql, params):
+        self._serve(self.write_ms)
+        with self._lock:
+            if sql == INSERT_MESSAGE:
+                self._messages.setdefault(room_id, []).append(params)
+                return 1
+            if sql == INSERT_MEMBER:
+                self._members[(room_id, params[0])] = list(params)
+                return 1
+            if sql == DELETE_MEMBER:
+                return 1 if self._members.pop((room_id, params[1]), None) else 0
+            if sql == UPDATE_MEMBER:
+                row = self._members.get((room_id, params[3]))
+                if row is None:
+                    return 0
+                row[3], row[5] = params[1], params[0]
+                return 1
+        raise ValueError("LocalBackend only runs the workload's statements")
+
+    def close(self):
+        pass
+
+
+class ActiveActiveBackend:
+    """Rooms routed over the clusters' coordinators, honouring tenant migration pins."""
+
+    kind = "active-active"
+
+    def __init__(self, dsns, connect_timeout=5):
+        self.router = TenantRouter(dsns)
+        self.connect_timeout = connect_timeout
+        # keeps following migrations that flip rooms while the benchmark runs
+        self.pins = PinWatcher(self.router).start()
+
+    def _run(self, room_id, sql, params, fetch):
+        pool = get_pool(self.router.dsn_for(room_id), min_size=0, connect_timeout=self.connect_timeout)
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                out = cur.fetchall() if fetch else cur.rowcount
+            conn.commit()
+        return out
+
+    def read(self, room_id, sql, params):
+        return self._run(room_id, sql, params, True)
+
+    def write(self, room_id, sql, params):
+        return self._run(room_id, sql, params, False)
+
+    def close(self):
+        self.pins.stop()
+        close_all()
+
+
+class HAProxyBackend:
+    """Writes to the Patroni leader, reads to the standbys (read_write.Session per thread)."""
+
+    kind = "haproxy"
+
+    def __init__(self, write_dsn, read_dsn=None, connect_timeout=5):
+        self.router = ReadWriteRouter(write_dsn, read_dsn, connect_timeout=connect_timeout)
+        self._local = threading.local()
+
+    def _session(self):
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = self.router.session()
+        return s
+
+    def read(self, room_id, sql, params):
+        with self._session().read() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def write(self, room_id, sql, params):
+        with self._session().write() as cur:
+            cur.execute(sql, params)
+            return cur.rowcount
+
+    def close(self):
+        close_all()
+
+
+def make_backend(target, seed=None):
+    """Backend for a target spec: {"kind": ..., "dsns": [...], "read_dsn": ...}."""
+    kind = target["kind"]
+    if kind == "local":
+        return LocalBackend(
+            read_ms=target.get("read_ms", 0.5),
+            write_ms=target.get("write_ms", 1.5),
+            servers=target.get("servers", 8),
+            seed=seed,
+        )
+    if kind == "active-active":
+        return ActiveActiveBackend(target["dsns"])
+    if kind == "haproxy":
+        return HAProxyBackend(target["dsns"][0], target.get("read_dsn"))
+    raise ValueError(f"unknown target {kind!r}")
+
+
+# ---------- workload ----------
+
+
+class ChatWorkload:
+    """Picks operations and rooms and runs them against a backend.
+
+    Members joined by this process are remembered (up to `max_joined`), so
+    leave_room and update_member always hit a real row; with none joined
+    yet they run as join_room.
+    """
+
+    def __init__(self, room_ids, ids, rng, mix=None, skew=0.0, recent=20, max_joined=10_000):
+        mix = mix or MIX
+        self.ops = list(mix)
+        self.op_weights = list(accumulate(mix[o] for o in self.ops))
+        self.room_ids = room_ids
+        self.room_weights = (
+            list(accumulate(1.0 / (i + 1) ** skew for i in range(len(room_ids))))
+            if skew > 0 else None
+        )
+        self.ids = ids
+        self.rng = rng
+        self.recent = recent
+        self.max_joined = max_joined
+        self._joined = []  # [(room_id, member row id)]
+        self._lock = threading.Lock()
+
+    def next_request(self):
+        """(operation, room_id); called from the scheduler thread only."""
+        rng = self.rng
+        op = rng.choices(self.ops, cum_weights=self.op_weights)[0]
+        room = rng.choices(self.room_ids, cum_weights=self.room_weights)[0]
+        return op, room
+
+    def _take_joined(self, remove):
+        with self._lock:
+            if not self._joined:
+                return None
+            i = random.randrange(len(self._joined))
+            if not remove:
+                return self._joined[i]
+            self._joined[i], self._joined[-1] = self._joined[-1], self._joined[i]
+            return self._joined.pop()
+
+    def run(self, backend, op, room_id):
+        """Run one operation; returns the operation actually executed."""
+        if op in ("leave_room", "update_member"):
+            member = self._take_joined(remove=op == "leave_room")
+            if member is None:
+                op = "join_room"
+            else:
+                room_id, row_id = member
+        now = datetime.now(timezone.utc)
+        if op == "post_message":
+            backend.write(room_id, INSERT_MESSAGE, (
+                self.ids.next_id(), room_id, 1, f"bench message in room {room_id}",
+                False, now, now, 1, False, None, None, now, now,
+            ))
+        elif op == "recent_messages":
+            backend.read(room_id, RECENT_MESSAGES, (room_id, self.recent))
+        elif op == "join_room":
+            row_id = self.ids.next_id()
+            backend.write(room_id, INSERT_MEMBER, (
+                row_id, room_id, random.randrange(1000, 10_000),
+                False, False, False, False, False, now, now,
+            ))
+            with self._lock:
+                if len(self._joined) < self.max_joined:
+                    self._joined.append((room_id, row_id))
+        elif op == "leave_room":
+            backend.write(room_id, DELETE_MEMBER, (room_id, row_id))
+        elif op == "update_member":
+            backend.write(room_id, UPDATE_MEMBER, (
+                random.random() < 0.5, random.random() < 0.5, room_id, row_id,
+            ))
+        else:
+            raise ValueError(f"unknown operation {op!r}")
+        return op
+
+
+# ---------- open-loop driver ----------
+
+
+def _run_process(spec):
+    """One worker process: Poisson arrivals at spec["rate"] for spec["duration"] s."""
+    index = spec["index"]
+    rng = random.Random(spec["seed"] * 1000 + index)
+    room_ids = ChatDataGen(spec["seed"]).room_ids(spec["rooms"])
+    workload = ChatWorkload(
+        room_ids,
+        IdAllocator(spec["id_cluster"], index),
+        rng,
+        mix=spec["mix"],
+        skew=spec["skew"],
+        recent=spec["recent"],
+    )
+    backend = make_backend(spec["target"], seed=rng.randrange(1 << 30))
+    hists = {op: LatencyHistogram() for op in workload.ops}
+    errors = {}
+    lock = threading.Lock()
+    state = {"in_flight": 0, "max_in_flight": 0, "max_start_lag": 0.0}
+
+    start = spec["start_at"]
+    measure_from = start + spec["warmup"]
+    end = measure_from + spec["duration"]
+
+    def execute(op, room_id, scheduled):
+        began = time.time()
+        error = None
+        try:
+            op = workload.run(backend, op, room_id)
+        except Exception as e:
+            error = type(e).__name__
+        done = time.time()
+        with lock:
+            state["in_flight"] -= 1
+            if scheduled < measure_from:
+                return
+            state["max_start_lag"] = max(state["max_start_lag"], began - scheduled)
+            if error is None:
+                hists[op].record_seconds(done - scheduled)
+            else:
+                errors.setdefault(op, {}).setdefault(error, 0)
+                errors[op][error] += 1
+
+    scheduled = start
+    sent = 0
+    with ThreadPoolExecutor(max_workers=spec["threads"], thread_name_prefix="bench") as ex:
+        while True:
+            scheduled += rng.expovariate(spec["rate"])
+            if scheduled >= end:
+                break
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            op, room_id = workload.next_request()
+            with lock:
+                state["in_flight"] += 1
+                state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            ex.submit(execute, op, room_id, scheduled)
+            if scheduled >= measure_from:
+                sent += 1
+    backend.close()
+    return {
+        "sent": sent,
+        "histograms": {op: h.to_dict() for op, h in hists.items()},
+        "errors": errors,
+        "max_in_flight": state["max_in_flight"],
+        "max_start_lag": state["max_start_lag"],
+    }
+
+
+def summarize(hist):
+    """{count, mean, min, max, p50, ...} in milliseconds."""
+    out = {
+        "count": hist.count,
+        "mean_ms": hist.mean() / 1000.0,
+        "min_ms": (hist.min or 0) / 1000.0,
+        "max_ms": hist.max / 1000.0,
+    }
+    for p in PERCENTILES:
+        out[f"p{p:g}_ms"] = hist.percentile(p) / 1000.0
+    return out
+
+
+def run_benchmark(
+    target,
+    rate,
+    duration,
+    processes=4,
+    threads=16,
+    warmup=2.0,
+    rooms=10_000,
+    seed=42,
+    mix=None,
+    skew=0.0,
+    recent=20,
+    id_cluster=0,
+    label=None,
+):
+    """Run the open-loop workload against `target`; returns the result dict.
+
+    processes=0 runs a single worker in this process (no process pool).
+    Every process takes its own IdAllocator worker slot, so at most
+    MAX_WORKER + 1 processes.
+    """
+    if not 0 <= processes <= MAX_WORKER + 1:
+        raise ValueError(f"processes must be in 0..{MAX_WORKER + 1} (one id worker slot each)")
+    mix = dict(mix or MIX)
+    n = max(1, processes)
+    start_at = time.time() + (1.0 if processes else 0.1)  # let every process get going
+    specs = [
+        {
+            "index": i,
+            "target": target,
+            "rate": rate / n,
+            "duration": duration,
+            "warmup": warmup,
+            "start_at": start_at,
+            "threads": threads,
+            "rooms": rooms,
+            "seed": seed,
+            "mix": mix,
+            "skew": skew,
+            "recent": recent,
+            "id_cluster": id_cluster,
+        }
+        for i in range(n)
+    ]
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes) as ex:
+            parts = list(ex.map(_run_process, specs))
+    else:
+        parts = [_run_process(specs[0])]
+
+    hists = {op: LatencyHistogram() for op in mix}
+    errors = {}
+    for part in parts:
+        for op, d in part["histograms"].items():
+            hists[op].merge(LatencyHistogram.from_dict(d))
+        for op, kinds in part["errors"].items():
+            for kind, count in kinds.items():
+                errors.setdefault(op, {}).setdefault(kind, 0)
+                errors[op][kind] += count
+    total = LatencyHistogram()
+    for h in hists.values():
+        total.merge(h)
+    completed = total.count
+    failed = sum(sum(k.values()) for k in errors.values())
+    return {
+        "label": label or target["kind"],
+        "target": target["kind"],
+        "started_at": datetime.fromtimestamp(start_at, timezone.utc).isoformat(),
+        "config": {
+            "rate": rate,
+            "duration": duration,
+            "warmup": warmup,
+            "processes": processes,
+            "threads": threads,
+            "rooms": rooms,
+            "seed": seed,
+            "skew": skew,
+            "recent": recent,
+            "mix": mix,
+        },
+        "sent": sum(p["sent"] for p in parts),
+        "completed": completed,
+        "failed": failed,
+        "achieved_rate": completed / duration if duration else 0.0,
+        "max_in_flight": max(p["max_in_flight"] for p in parts),
+        "max_start_lag_ms": max(p["max_start_lag"] for p in parts) * 1000.0,
+        "all": summarize(total),
+        "operations": {
+            op: {
+                **summarize(h),
+                "errors": errors.get(op, {}),
+                "histogram": h.to_dict(),
+            }
+            for op, h in hists.items()
+        },
+    }
+
+
+def format_results(results):
+    """Side-by-side table of one or more run_benchmark() results."""
+    cols = [("count", "{:>9,}"), ("p50_ms", "{:>9.2f}"), ("p99_ms", "{:>9.2f}"),
+            ("p99.9_ms", "{:>9.2f}"), ("max_ms", "{:>9.2f}")]
+    lines = []
+    for r in results:
+        c = r["config"]
+        lines.append(
+            f"{r['label']} ({r['target']}): offered {c['rate']:,.0f}/s, "
+            f"achieved {r['achieved_rate']:,.1f}/s, {r['failed']:,} failed, "
+            f"max start lag {r['max_start_lag_ms']:.1f} ms"
+        )
+    lines.append(
+        f"  {'operation':<16} {'run':<14}" + "".join(f"{name:>10}" for name, _ in cols)
+    )
+    ops = sorted({op for r in results for op in r["operations"]}) + ["all"]
+    for op in ops:
+        for r in results:
+            s = r["all"] if op == "all" else r["operations"].get(op)
+            if s is None:
+                continue
+            lines.append(
+                f"  {op:<16} {r['label'][:14]:<14}"
+                + "".join(" " + fmt.format(s[name]) for name, fmt in cols)
+            )
+    return "\n".join(lines)
+
+
+def main(argv):
+    p = argparse.ArgumentParser(
+        prog="python -m citus_sharding.bench",
+        description="Open-loop chat workload benchmark (active-active, HAProxy or local).",
+    )
+    p.add_argument("--target", choices=("active-active", "haproxy", "local"), default="local")
+    p.add_argument("--dsn", action="append", default=[],
+                   help="coordinator DSN (repeat per cluster) or HAProxy write DSN")
+    p.add_argument("--read-dsn", help="HAProxy read DSN (haproxy target)")
+    p.add_argument("--rate", type=float, default=200.0, help="requests per second (total)")
+    p.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    p.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds first")
+    p.add_argument(
+        "--processes",
+        type=int,
+        default=4,
+        help=f"worker processes (0 = in-process, at most {MAX_WORKER + 1})",
+    )
+    p.add_argument("--threads", type=int, default=16, help="request threads per process")
+    p.add_argument("--rooms", type=int, default=10_000)
+    p.add_argument("--seed", type=int, default=42, help="room id seed (123 for the active-active demo)")
+    p.add_argument("--skew", type=float, default=0.0, help="zipf exponent for room popularity")
+    p.add_argument("--mix", help="operation weights, e.g. post_message=1,recent_messages=4")
+    p.add_argument("--id-cluster", type=int, default=0, help="IdAllocator cluster slot")
+    p.add_argument("--label", help="name for this run in the results")
+    p.add_argument("--out", help="write the JSON result here")
+    p.add_argument("--compare", nargs="+", metavar="RESULT", help="print saved results side by side")
+    args = p.parse_args(argv)
+
+    if args.compare:
+        results = []
+        for path in args.compare:
+            with open(path) as f:
+                results.append(json.load(f))
+        print(format_results(results))
+        return 0
+
+    if not 0 <= args.processes <= MAX_WORKER + 1:
+        p.error(f"--processes must be in 0..{MAX_WORKER + 1} (one id worker slot each)")
+    if not 0 <= args.id_cluster <= MAX_CLUSTER:
+        p.error(f"--id-cluster must be in 0..{MAX_CLUSTER}")
+    if args.target == "local":
+        target = {"kind": "local"}
+    elif not args.dsn:
+        p.error(f"--dsn is required for --target {args.target}")
+    else:
+        target = {"kind": args.target, "dsns": args.dsn, "read_dsn": args.read_dsn}
+    mix = None
+    if args.mix:
+        mix = {}
+        for part in args.mix.split(","):
+            op, _, weight = part.partition("=")
+            if op not in MIX:
+                p.error(f"unknown operation {op!r} (one of {', '.join(MIX)})")
+            try:
+                mix[op] = float(weight or 1)
+            except ValueError:
+                p.error(f"weight of {op} must be a number, got {weight!r}")
+            if mix[op] < 0:
+                p.error(f"weight of {op} must not be negative, got {weight!r}")
+
+    result = run_benchmark(
+        target,
+        args.rate,
+        args.duration,
+        processes=args.processes,
+        threads=args.threads,
+        warmup=args.warmup,
+        rooms=args.rooms,
+        seed=args.seed,
+        mix=mix,
+        skew=args.skew,
+        id_cluster=args.id_cluster,
+        label=args.label,
+    )
+    print(format_results([result]))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results: {os.path.abspath(args.out)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
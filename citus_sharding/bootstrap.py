@@ -0,0 +1,449 @@
+"""Declarative cluster bootstrap: diff the wanted layout against the catalog, apply the gap.
+
+A ClusterSpec describes the wanted state: worker nodes, the tables with their
+distribution columns (colocated with the first one), shard count and
+replication factor. bootstrap() reads everything it needs from the
+coordinator's catalog in one query (CATALOG_SQL), plans only the missing
+steps and runs them under an advisory lock, so concurrent bootstrappers
+don't race, in two transactions: first the extension and the nodes
+(citus_add_node / citus_activate_node, each retried with backoff until the
+worker accepts it), then, once enough workers are active for the
+replication factor, CREATE TABLE and create_distributed_table. A warm
+cluster costs two round trips (catalog, active workers). What can't be
+fixed in place (a table distributed by another column, with another shard
+count, not colocated) is reported as drift rather than rewritten.
+
+Readiness waits use jittered exponential backoff instead of fixed sleeps:
+
+* wait_for_leader() polls Patroni's REST API (GET /primary) until a leader
+  answers, before connecting through HAProxy;
+* connect() retries the connection itself;
+* wait_for_workers() waits until enough workers are active (before any
+  table is distributed);
+* wait_for_bootstrap() LISTENs on NOTIFY_CHANNEL, which bootstrap() notifies
+  when it commits, so other jobs wake up as soon as the cluster is ready.
+
+Each step's duration is in the returned report (format_bootstrap()).
+
+Usage:
+    python -m citus_sharding.bootstrap --dsn "<coordinator dsn>" --worker worker1:5432 ...
+    python -m citus_sharding.bootstrap --dsn "<coordinator dsn>" --wait
+"""
+import argparse
+import os
+import random
+import select
+import sys
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+import psycopg2
+
+from citus_sharding.catalog import TABLES
+
+NOTIFY_CHANNEL = "citus_bootstrap"
+# pg_advisory_xact_lock key shared by every bootstrapper
+LOCK_KEY = 0x43_69_74_75_73  # "Citus"
+
+SCHEMA = {
+    "rooms": """
+    CREATE TABLE IF NOT EXISTS rooms (
+      id BIGINT PRIMARY KEY,
+      room_type SMALLINT NOT NULL,
+      created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+      updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+    );""",
+    "room_members": """
+    CREATE TABLE IF NOT EXISTS room_members (
+      id BIGINT,
+      room_id BIGINT NOT NULL,
+      member_id BIGINT NOT NULL,
+      is_pinned BOOLEAN DEFAULT FALSE,
+      is_deleted BOOLEAN DEFAULT FALSE,
+      is_muted BOOLEAN DEFAULT FALSE,
+      is_archived BOOLEAN DEFAULT FALSE,
+      is_locked BOOLEAN DEFAULT FALSE,
+      created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+      updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (id, room_id)
+    );""",
+    "messages": """
+    CREATE TABLE IF NOT EXISTS messages (
+      id BIGINT,
+      room_id BIGINT NOT NULL,
+      message_type SMALLINT NOT NULL,
+      text TEXT,
+      is_by_partner BOOLEAN DEFAULT FALSE,
+      local_timestamp TIMESTAMPTZ,
+      server_timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+      status SMALLINT,
+      is_deleted BOOLEAN DEFAULT FALSE,
+      action SMALLINT,
+      parent_message_id BIGINT,
+      created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+      updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (id, room_id)
+    );""",
+}
+
+# Without the citus extension the pg_dist_* catalogs don't exist yet
+_BASE_FIELDS = """
+  'in_recovery', pg_is_in_recovery(),
+  'citus', (SELECT extversion FROM pg_extension WHERE extname = 'citus'),
+  'tables', (SELECT coalesce(json_agg(c.relname), '[]') FROM pg_class c
+             WHERE c.relname = ANY(%(tables)s) AND c.relkind IN ('r', 'p')
+               AND pg_table_is_visible(c.oid))"""
+
+BASE_SQL = f"SELECT json_build_object({_BASE_FIELDS});"
+
+CATALOG_SQL = f"""
+SELECT json_build_object({_BASE_FIELDS},
+  'workers', (SELECT coalesce(json_agg(json_build_array(nodename, nodeport, isactive)), '[]')
+              FROM pg_dist_node WHERE groupid <> 0 AND noderole = 'primary'),
+  'distributed', (
+    SELECT coalesce(json_agg(json_build_object(
+      'table', p.logicalrelid::text,
+      'column', column_to_column_name(p.logicalrelid, p.partkey),
+      'colocation', p.colocationid,
+      'shards', (SELECT count(*) FROM pg_dist_shard s WHERE s.logicalrelid = p.logicalrelid),
+      'replicas', (SELECT min(n) FROM (
+                     SELECT count(*) AS n FROM pg_dist_shard s
+                     JOIN pg_dist_placement pl USING (shardid)
+                     WHERE s.logicalrelid = p.logicalrelid GROUP BY shardid) r)
+    )), '[]')
+    FROM pg_dist_partition p WHERE p.logicalrelid::text = ANY(%(tables)s))
+);
+"""
+
+
+class BootstrapError(RuntimeError):
+    pass
+
+
+class ClusterSpec:
+    """Wanted layout. `workers` may be empty when nodes are registered elsewhere."""
+
+    def __init__(
+        self,
+        workers=(),
+        tables=None,
+        shard_count=3,
+        replication_factor=2,
+        min_workers=None,
+        schema=None,
+    ):
+        self.workers = [(n, int(p)) for n, p in workers]
+        self.tables = list(TABLES if tables is None else tables)
+        self.shard_count = shard_count
+        self.replication_factor = replication_factor
+        # RF=2 => shards need at least 2 active workers
+        self.min_workers = replication_factor if min_workers is None else min_workers
+        self.schema = SCHEMA if schema is None else schema
+
+
+def backoff(timeout, initial=0.05, maximum=1.0):
+    """Yield until `timeout` s have passed, sleeping a jittered 50 ms, 100 ms, ... between."""
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        yield
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(left, delay * random.uniform(0.5, 1.0)))
+        delay = min(maximum, delay * 2)
+
+
+def inspect(cur, spec):
+    """Catalog state relevant to `spec` (one query once Citus is installed)."""
+    params = {"tables": [t for t, _ in spec.tables]}
+    try:
+        cur.execute("SAVEPOINT bootstrap_inspect;" + CATALOG_SQL, params)
+    except psycopg2.ProgrammingError:
+        # no pg_dist_* yet: Citus isn't installed on this coordinator
+        cur.execute("ROLLBACK TO SAVEPOINT bootstrap_inspect;" + BASE_SQL, params)
+        state = cur.fetchone()[0]
+        state.update(workers=[], distributed=[])
+        return state
+    return cur.fetchone()[0]
+
+
+def plan(spec, state):
+    """(steps, drift): [(name, sql, params)] that bring the catalog to `spec`, and what can't."""
+    steps, drift = [], []
+    if state["citus"] is None:
+        steps.append(("create_extension", "CREATE EXTENSION IF NOT EXISTS citus;", None))
+
+    have = {(n, int(p)): active for n, p, active in state["workers"]}
+    for node, port in spec.workers:
+        active = have.get((node, port))
+        if active is None:
+            steps.append((f"add_node {node}:{port}", "SELECT citus_add_node(%s, %s);", (node, port)))
+        elif not active:
+            steps.append(
+                (f"activate_node {node}:{port}", "SELECT citus_activate_node(%s, %s);", (node, port))
+            )
+
+    existing = set(state["tables"])
+    for table, _ in spec.tables:
+        if table not in existing:
+            steps.append((f"create_table {table}", spec.schema[table], None))
+
+    dist = {d["table"]: d for d in state["distributed"]}
+    anchor = spec.tables[0][0]
+    if any(t not in dist for t, _ in spec.tables):
+        steps.append((
+            "shard_settings",
+            f"SET LOCAL citus.shard_count = {int(spec.shard_count)}; "
+            f"SET LOCAL citus.shard_replication_factor = {int(spec.replication_factor)};",
+            None,
+        ))
+    for table, column in spec.tables:
+        d = dist.get(table)
+        if d is None:
+            steps.append((
+                f"distribute {table}",
+                "SELECT create_distributed_table(%s, %s, colocate_with => %s);",
+                (table, column, "default" if table == anchor else anchor),
+            ))
+            continue
+        if d["column"] != column:
+            drift.append(f"{table} is distributed by {d['column']}, not {column}")
+        if d["shards"] != spec.shard_count:
+            drift.append(f"{table} has {d['shards']} shards, not {spec.shard_count}")
+        if d["replicas"] is not None and d["replicas"] < spec.replication_factor:
+            drift.append(f"{table} has {d['replicas']} placement(s) per shard, not {spec.replication_factor}")
+        if table != anchor and anchor in dist and d["colocation"] != dist[anchor]["colocation"]:
+            drift.append(f"{table} is not colocated with {anchor}")
+    return steps, drift
+
+
+@contextmanager
+def _timed(report, name, metrics=None):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        report["steps"].append((name, seconds))
+        if metrics is not None:
+            metrics.observe("phase_seconds", seconds, phase="bootstrap", step=name)
+
+
+def active_workers(cur):
+    cur.execute("SELECT count(*) FROM citus_get_active_worker_nodes();")
+    return cur.fetchone()[0]
+
+
+def wait_for_workers(cur, min_workers, timeout=20):
+    """Block (with backoff) until at least `min_workers` workers are active."""
+    cnt = 0
+    for _ in backoff(timeout):
+        cnt = active_workers(cur)
+        if cnt >= min_workers:
+            return cnt
+    raise BootstrapError(f"only {cnt} worker(s) active after {timeout}s; need >= {min_workers}")
+
+
+def _node_step(name):
+    return name == "create_extension" or name.startswith(("add_node ", "activate_node "))
+
+
+def _retry_step(cur, name, sql, params, timeout):
+    """Run a node step, retried inside a savepoint until the worker accepts it."""
+    error = None
+    for _ in backoff(timeout):
+        cur.execute("SAVEPOINT bootstrap_step;")
+        try:
+            cur.execute(sql, params)
+        except psycopg2.Error as e:
+            if cur.connection.closed:
+                raise
+            cur.execute("ROLLBACK TO SAVEPOINT bootstrap_step;")
+            error = e
+            continue
+        cur.execute("RELEASE SAVEPOINT bootstrap_step;")
+        return
+    raise BootstrapError(f"{name} still failing after {timeout}s: {error}")
+
+
+def _apply(cur, spec, stage, report, log, metrics, timeout):
+    """Run the `stage` ("nodes" or "tables") steps of a fresh plan in one locked transaction."""
+    with _timed(report, f"lock_{stage}", metrics):
+        # re-plan under the lock: a concurrent bootstrapper may have done it all
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (LOCK_KEY,))
+        steps, drift = plan(spec, inspect(cur, spec))
+    for name, sql, params in steps:
+        if _node_step(name) != (stage == "nodes"):
+            continue
+        with _timed(report, name, metrics):
+            if stage == "nodes" and name != "create_extension":
+                _retry_step(cur, name, sql, params, timeout)
+            else:
+                cur.execute(sql, params)
+        report["applied"].append(name)
+        log(f"bootstrap: {name}")
+    with _timed(report, f"commit_{stage}", metrics):
+        cur.execute(f"NOTIFY {NOTIFY_CHANNEL};")
+        cur.connection.commit()
+    return drift
+
+
+def bootstrap(cur, spec, timeout=20, log=print, metrics=None):
+    """Bring the coordinator behind `cur` to `spec`; returns the report (steps, drift).
+
+    Nodes are added / activated and committed first; tables are created and
+    distributed only once spec.min_workers workers are active, so the
+    replication factor can be met. Each stage commits when it applied something.
+    """
+    report = {"steps": [], "applied": [], "drift": []}
+    with _timed(report, "inspect", metrics):
+        state = inspect(cur, spec)
+    if state["in_recovery"]:
+        raise BootstrapError("connected to a standby; bootstrap needs the primary")
+    steps, drift = plan(spec, state)
+
+    if any(_node_step(name) for name, _, _ in steps):
+        _apply(cur, spec, "nodes", report, log, metrics, timeout)
+    with _timed(report, "wait_workers", metrics):
+        report["workers"] = wait_for_workers(cur, spec.min_workers, timeout)
+        cur.connection.commit()
+    if any(not _node_step(name) for name, _, _ in steps):
+        drift = _apply(cur, spec, "tables", report, log, metrics, timeout)
+
+    report["drift"] = drift
+    for d in drift:
+        log(f"bootstrap drift: {d}")
+    return report
+
+
+def format_bootstrap(report):
+    total = sum(s for _, s in report["steps"])
+    lines = [
+        f"Bootstrap: {len(report['applied'])} step(s) applied, "
+        f"{report['workers']} active worker(s), {total * 1000:.1f} ms"
+    ]
+    for name, seconds in report["steps"]:
+        lines.append(f"  {name}: {seconds * 1000:.1f} ms")
+    for d in report["drift"]:
+        lines.append(f"  drift: {d}")
+    return "\n".join(lines)
+
+
+# ---------- readiness ----------
+
+
+def wait_for_leader(patroni_urls, timeout=60):
+    """Poll Patroni's REST API until one node answers GET /primary with 200; returns its URL."""
+    for _ in backoff(timeout):
+        for url in patroni_urls:
+            try:
+                with urllib.request.urlopen(url.rstrip("/") + "/primary", timeout=2) as r:
+                    if r.status == 200:
+                        return url
+            except (urllib.error.URLError, OSError):
+                pass  # 503 from a replica, or the node isn't up yet
+    raise BootstrapError(f"no Patroni leader among {', '.join(patroni_urls)} after {timeout}s")
+
+
+def connect(dsn, timeout=60, patroni_urls=None, metrics=None, **kwargs):
+    """psycopg2 connection, retried with backoff; waits for a Patroni leader first if given.
+
+    Every failed attempt counts as a retries_total{op="connect"} in `metrics`.
+    """
+    t0 = time.monotonic()
+    kwargs.setdefault("connect_timeout", 5)
+    if patroni_urls:
+        wait_for_leader(patroni_urls, timeout)
+    error = None
+    for _ in backoff(max(0.0, timeout - (time.monotonic() - t0))):
+        if error is not None and metrics is not None:
+            metrics.inc("retries_total", op="connect")
+        try:
+            return psycopg2.connect(dsn, **kwargs)
+        except psycopg2.OperationalError as e:
+            error = e
+    raise BootstrapError(f"could not connect within {timeout}s: {error}")
+
+
+def wait_for_bootstrap(conn, spec, timeout=60):
+    """Block until the catalog matches `spec` and enough workers are active.
+
+    Sleeps on LISTEN NOTIFY_CHANNEL between checks (backoff as the upper
+    bound), so it returns right after a bootstrap() elsewhere commits.
+    """
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
+        conn.autocommit = False
+        state = inspect(cur, spec)
+        steps, _ = plan(spec, state)
+        ready = not steps and active_workers(cur) >= spec.min_workers
+        conn.rollback()
+        conn.autocommit = True
+        if ready:
+            return
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise BootstrapError(f"cluster not bootstrapped after {timeout}s")
+        if select.select([conn], [], [], min(left, delay))[0]:
+            conn.poll()
+            del conn.notifies[:]
+        delay = min(1.0, delay * 2)
+
+
+def _worker_arg(text):
+    """argparse type for --worker: "host:port" -> (host, port)."""
+    host, _, port = text.rpartition(":")
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise argparse.ArgumentTypeError(f"expected host:port, got {text!r}")
+    return host, int(port)
+
+
+def main(argv):
+    p = argparse.ArgumentParser(
+        prog="python -m citus_sharding.bootstrap",
+        description="Bring a Citus coordinator to the chat schema layout, or wait for it.",
+    )
+    p.add_argument("--dsn", default=os.getenv("CITUS_DSN"), help="coordinator DSN")
+    p.add_argument(
+        "--worker", type=_worker_arg, action="append", default=[], help="host:port (repeatable)"
+    )
+    p.add_argument("--shard-count", type=int, default=3)
+    p.add_argument("--replication-factor", type=int, default=2)
+    p.add_argument("--min-workers", type=int)
+    p.add_argument("--patroni", action="append", default=[], help="Patroni REST URL (repeatable)")
+    p.add_argument("--timeout", type=float, default=60.0)
+    p.add_argument("--wait", action="store_true", help="only wait until another job bootstrapped")
+    args = p.parse_args(argv)
+    if not args.dsn:
+        p.error("--dsn or CITUS_DSN is required")
+
+    spec = ClusterSpec(
+        args.worker,
+        shard_count=args.shard_count,
+        replication_factor=args.replication_factor,
+        min_workers=args.min_workers,
+    )
+    t0 = time.perf_counter()
+    conn = connect(args.dsn, args.timeout, args.patroni)
+    try:
+        if args.wait:
+            wait_for_bootstrap(conn, spec, args.timeout)
+            print(f"Cluster ready after {time.perf_counter() - t0:.2f}s")
+        else:
+            report = bootstrap(conn.cursor(), spec, args.timeout)
+            conn.commit()
+            print(format_bootstrap(report))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
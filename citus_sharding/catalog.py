@@ -0,0 +1,48 @@
+"""Queries against the Citus metadata tables (pg_dist_shard / _placement / _node)."""
+from collections import defaultdict
+
+TABLES = [("rooms", "id"), ("room_members", "room_id"), ("messages", "room_id")]
+
+
+def fetch_placements(cur):
+    placements = defaultdict(list)
+    cur.execute(
+        """
+        SELECT s.logicalrelid::text AS tbl, s.shardid, n.nodename, n.nodeport
+        FROM pg_dist_shard s
+        JOIN pg_dist_placement p USING (shardid)
+        JOIN pg_dist_node n ON p.groupid = n.groupid
+        WHERE s.logicalrelid IN ('rooms'::regclass,'room_members'::regclass,'messages'::regclass)
+        ORDER BY tbl, shardid, n.nodename, n.nodeport;
+    """
+    )
+    for tbl, sid, node, port in cur.fetchall():
+        placements[(tbl, int(sid))].append((node, int(port)))
+    return dict(placements)
+
+
+def fetch_ranges(cur):
+    ranges = {}
+    cur.execute(
+        """
+        SELECT s.logicalrelid::text AS tbl, s.shardid, s.shardminvalue::text, s.shardmaxvalue::text
+        FROM pg_dist_shard s
+        WHERE s.logicalrelid IN ('rooms'::regclass,'room_members'::regclass,'messages'::regclass)
+        ORDER BY tbl, shardid;
+    """
+    )
+    for tbl, sid, mn, mx in cur.fetchall():
+        ranges[(tbl, int(sid))] = (mn, mx)
+    return ranges
+
+
+def grouped_colocation(ranges):
+    by_range = defaultdict(dict)
+    for (tbl, sid), rng in ranges.items():
+        by_range[rng][tbl] = sid
+    ordered = []
+    for idx, (rng, mapping) in enumerate(sorted(by_range.items(), key=lambda x: x[0])):
+        ordered.append(
+            (idx + 1, mapping)
+        )  # e.g. (1, {'rooms':102008,'room_members':102012,'messages':102016})
+    return ordered
@@ -0,0 +1,245 @@
+"""Stream rooms / room_members / messages into Citus with COPY ... FROM STDIN.
+
+Rows are encoded chunk by chunk into one reusable buffer that psycopg2 reads
+from, so a whole table goes through a single COPY statement without building
+SQL strings on the client or parsing them on the coordinator.
+"""
+import struct
+import time
+from datetime import datetime, timezone
+
+BATCH = 5_000
+
+# Same column lists the execute_values INSERTs used
+COLUMNS = {
+    "rooms": ("id", "room_type", "created_at", "updated_at"),
+    "room_members": (
+        "id", "room_id", "member_id", "is_pinned", "is_deleted", "is_muted",
+        "is_archived", "is_locked", "created_at", "updated_at",
+    ),
+    "messages": (
+        "id", "room_id", "message_type", "text", "is_by_partner", "local_timestamp",
+        "server_timestamp", "status", "is_deleted", "action", "parent_message_id",
+        "created_at", "updated_at",
+    ),
+}
+
+# Postgres types per column (needed for the binary encoding)
+TYPES = {
+    "rooms": ("int8", "int2", "timestamptz", "timestamptz"),
+    "room_members": (
+        "int8", "int8", "int8", "bool", "bool", "bool",
+        "bool", "bool", "timestamptz", "timestamptz",
+    ),
+    "messages": (
+        "int8", "int8", "int2", "text", "bool", "timestamptz",
+        "timestamptz", "int2", "bool", "int2", "int8",
+        "timestamptz", "timestamptz",
+    ),
+}
+
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+BINARY_TRAILER = struct.pack("!h", -1)
+
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+_TEXT_ESCAPES = str.maketrans(
+    {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+)
+
+
+# ---------- text format ----------
+
+
+def _text_str(v):
+    return v.translate(_TEXT_ESCAPES)
+
+
+def _text_bool(v):
+    return "t" if v else "f"
+
+
+def _text_ts(v):
+    # naive datetimes are UTC (not the session TimeZone), same as _bin_ts
+    return v.isoformat() + ("+00:00" if v.tzinfo is None else "")
+
+
+_TEXT_ENCODERS = {
+    "int8": str,
+    "int2": str,
+    "bool": _text_bool,
+    "text": _text_str,
+    "timestamptz": _text_ts,
+}
+
+
+# ---------- binary format ----------
+
+_I8 = struct.Struct("!iq")
+_I2 = struct.Struct("!ih")
+_BOOL_T = struct.pack("!ib", 1, 1)
+_BOOL_F = struct.pack("!ib", 1, 0)
+_NULL = struct.pack("!i", -1)
+_LEN = struct.Struct("!i")
+
+
+def _bin_ts(v):
+    if v.tzinfo is None:
+        # naive datetimes are UTC, same as _text_ts
+        v = v.replace(tzinfo=timezone.utc)
+    d = v - PG_EPOCH
+    return _I8.pack(8, (d.days * 86_400 + d.seconds) * 1_000_000 + d.microseconds)
+
+
+def _bin_text(v):
+    b = v.encode()
+    return _LEN.pack(len(b)) + b
+
+
+_BINARY_ENCODERS = {
+    "int8": lambda v: _I8.pack(8, v),
+    "int2": lambda v: _I2.pack(2, v),
+    "bool": lambda v: _BOOL_T if v else _BOOL_F,
+    "text": _bin_text,
+    "timestamptz": _bin_ts,
+}
+
+
+# ---------- streaming ----------
+
+
+class CopyStream:
+    """File-like object psycopg2's copy_expert() reads COPY data from.
+
+    `blocks` yields encoded COPY data a few thousand rows at a time; each
+    block is appended to the same bytearray, which is compacted rather than
+    reallocated as psycopg2 reads it, so about one block is held at a time.
+    """
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._buf = bytearray()
+        self._pos = 0
+        self._done = False
+        self.bytes = 0
+
+    def _fill(self):
+        del self._buf[: self._pos]
+        self._pos = 0
+        try:
+            self._buf += next(self._blocks)
+        except StopIteration:
+            self._done = True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self._done:
+                self._fill()
+            size = len(self._buf) - self._pos
+        while len(self._buf) - self._pos < size and not self._done:
+            self._fill()
+        out = bytes(self._buf[self._pos : self._pos + size])
+        self._pos += len(out)
+        self.bytes += len(out)
+        return out
+
+
+def copy_sql(table, fmt="text", target=None):
+    """COPY statement for `table`'s columns; `target` overrides the relation (e.g. rooms_102008)."""
+    cols = ", ".join(COLUMNS[table])
+    opts = " WITH (FORMAT binary)" if fmt == "binary" else ""
+    return f"COPY {target or table} ({cols}) FROM STDIN{opts}"
+
+
+# ---------- column batches ----------
+
+
+def _encode_column(encode, values, null, cache):
+    # Columns with few distinct values (flags, enums, shared timestamps) are
+    # encoded once per distinct value instead of once per row.
+    if cache is None:
+        return [null if v is None else encode(v) for v in values]
+    out = []
+    append = out.append
+    for v in values:
+        try:
+            append(cache[v])
+        except KeyError:
+            e = cache[v] = encode(v)
+            append(e)
+    return out
+
+
+_MEMO_TYPES = {"int2", "bool", "timestamptz"}
+
+
+def encode_blocks(table, columns, fmt="text", block_rows=BATCH):
+    """Yield a {column: [values]} batch (all lists the same length) as COPY data.
+
+    Each block covers `block_rows` rows. Fields are laid out row-major by
+    strided slice assignment into one list per block, so no per-row tuples
+    are built. Binary output includes BINARY_HEADER and BINARY_TRAILER.
+    """
+    names, types = COLUMNS[table], TYPES[table]
+    if fmt == "text":
+        encoders, null = _TEXT_ENCODERS, "\\N"
+    elif fmt == "binary":
+        encoders, null = _BINARY_ENCODERS, _NULL
+    else:
+        raise ValueError(f"Unknown COPY format: {fmt!r} (expected 'text' or 'binary')")
+    caches = [{None: null} if t in _MEMO_TYPES else None for t in types]
+    n = len(columns[names[0]])
+    width = len(names)
+    if fmt == "binary":
+        yield BINARY_HEADER
+        field_count = struct.pack("!h", width)
+    for start in range(0, n, block_rows):
+        stop = min(n, start + block_rows)
+        k = stop - start
+        if fmt == "text":
+            # field1 \t field2 ... fieldN \n per row: 2 slots per field
+            out = [None] * (2 * width * k)
+            for j, (name, t) in enumerate(zip(names, types)):
+                col = _encode_column(encoders[t], columns[name][start:stop], null, caches[j])
+                out[2 * j :: 2 * width] = col
+                out[2 * j + 1 :: 2 * width] = ["\t" if j < width - 1 else "\n"] * k
+            yield "".join(out).encode()
+        else:
+            # field count, then one slot per field
+            out = [field_count] * ((width + 1) * k)
+            for j, (name, t) in enumerate(zip(names, types)):
+                col = _encode_column(encoders[t], columns[name][start:stop], null, caches[j])
+                out[j + 1 :: width + 1] = col
+            yield b"".join(out)
+    if fmt == "binary":
+        yield BINARY_TRAILER
+
+
+def column_rows(columns, table):
+    """Number of rows in a {column: [values]} batch."""
+    return len(columns[COLUMNS[table][0]])
+
+
+def copy_columns(cur, table, columns, fmt="text", target=None):
+    """COPY one column batch ({column: [values]}) into `table`.
+
+    Returns {"rows", "bytes", "seconds", "rows_per_s"}.
+    """
+    stream = CopyStream(encode_blocks(table, columns, fmt))
+    t0 = time.perf_counter()
+    cur.copy_expert(copy_sql(table, fmt, target), stream, size=1 << 16)
+    elapsed = time.perf_counter() - t0
+    rows = column_rows(columns, table)
+    return {
+        "rows": rows,
+        "bytes": stream.bytes,
+        "seconds": elapsed,
+        "rows_per_s": rows / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def format_rates(stats):
+    return ", ".join(
+        f"{table}={s['rows']:,} ({s['rows_per_s']:,.0f} rows/s)"
+        for table, s in stats.items()
+    )
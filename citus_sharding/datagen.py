@@ -0,0 +1,171 @@
+"""Reproducible, column-oriented synthetic data for rooms / room_members / messages.
+
+Everything comes from one seeded random.Random and is produced a whole column
+at a time (Random.choices over a population instead of one choice()/randint()
+call per field), so the same seed always yields the same dataset. Room ids
+are a seeded affine permutation of a counter, so they never collide.
+
+Batches are {table: {column: [values]}} dicts that copy_loader.copy_columns()
+and pipeline.copy_chunks() load directly, without per-row tuples.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, chain, repeat
+
+from citus_sharding.copy_loader import BATCH
+
+# Largest prime below 10**12: room ids stay in [1, 10**12) like before
+ID_SPACE = 999_999_999_989
+
+WEEK_MINUTES = 60 * 24 * 7
+
+
+# ---------- per-room count distributions ----------
+# Each returns sample(rng, k) -> [count for each of k rooms].
+
+
+def fixed(n):
+    def sample(rng, k):
+        return [n] * k
+
+    return sample
+
+
+def uniform(lo, hi):
+    """Counts uniformly in [lo, hi]."""
+    population = range(lo, hi + 1)
+
+    def sample(rng, k):
+        return rng.choices(population, k=k)
+
+    return sample
+
+
+def zipf(alpha, max_n, min_n=1):
+    """Heavy-tailed counts in [min_n, max_n], P(n) ~ 1 / n**alpha."""
+    population = range(min_n, max_n + 1)
+    cum = list(accumulate(1.0 / (n ** alpha) for n in population))
+
+    def sample(rng, k):
+        return rng.choices(population, cum_weights=cum, k=k)
+
+    return sample
+
+
+def hot_rooms(base, hot_fraction=0.01, hot_count=1_000):
+    """`base` for most rooms; a `hot_fraction` of rooms get `hot_count` instead."""
+
+    def sample(rng, k):
+        counts = base(rng, k)
+        weights = (hot_fraction, 1 - hot_fraction)
+        for i, hot in enumerate(rng.choices((True, False), weights, k=k)):
+            if hot:
+                counts[i] = hot_count
+        return counts
+
+    return sample
+
+
+# ---------- generator ----------
+
+
+class ChatDataGen:
+    """Seeded column generator for the chat schema.
+
+    members / messages are count distributions (fixed(2) / fixed(1) match the
+    original demo). Message timestamps fall in the `window_minutes` before
+    `now` at minute granularity, and share one datetime object per minute.
+
+    Member and message ids count 1, 2, ... within each room, unless `ids` (an
+    ids.IdAllocator) is given: then they are globally unique, time-ordered
+    ids taken in bulk per batch (no longer reproducible from the seed).
+    """
+
+    def __init__(
+        self,
+        seed,
+        members=fixed(2),
+        messages=fixed(1),
+        now=None,
+        window_minutes=WEEK_MINUTES,
+        first_room=0,
+        ids=None,
+    ):
+        self.rng = random.Random(seed)
+        self.ids = ids
+        self.members = members
+        self.messages = messages
+        self.now = now or datetime.now(timezone.utc)
+        # id = (counter * mul + add) mod prime is a bijection, so ids never repeat
+        self._id_mul = self.rng.randrange(1, ID_SPACE)
+        self._id_add = self.rng.randrange(ID_SPACE)
+        self._next_room = first_room
+        self._minutes = range(window_minutes + 1)
+        self._ts = [self.now - timedelta(minutes=m) for m in self._minutes]
+
+    def room_ids(self, k):
+        """Next k unique room ids (bijective counter -> [1, ID_SPACE])."""
+        start = self._next_room
+        if start + k > ID_SPACE:
+            raise OverflowError("room id space exhausted")
+        self._next_room = start + k
+        mul, add = self._id_mul, self._id_add
+        return [(c * mul + add) % ID_SPACE + 1 for c in range(start, start + k)]
+
+    def _row_ids(self, counts, n):
+        if self.ids is not None:
+            return self.ids.take(n)
+        return list(chain.from_iterable(range(1, c + 1) for c in counts))
+
+    def batch(self, k):
+        """Columns for the next k rooms plus their members and messages."""
+        rng, now = self.rng, self.now
+        rids = self.room_ids(k)
+
+        rooms = {
+            "id": rids,
+            "room_type": rng.choices((1, 2, 3), k=k),
+            "created_at": [now] * k,
+            "updated_at": [now] * k,
+        }
+
+        m_counts = self.members(rng, k)
+        n = sum(m_counts)
+        members = {
+            "id": self._row_ids(m_counts, n),
+            "room_id": list(chain.from_iterable(map(repeat, rids, m_counts))),
+            "member_id": rng.choices(range(1000, 10_000), k=n),
+            "is_pinned": [False] * n,
+            "is_deleted": [False] * n,
+            "is_muted": rng.choices((True, False), k=n),
+            "is_archived": [False] * n,
+            "is_locked": [False] * n,
+            "created_at": [now] * n,
+            "updated_at": [now] * n,
+        }
+
+        g_counts = self.messages(rng, k)
+        n = sum(g_counts)
+        room_col = list(chain.from_iterable(map(repeat, rids, g_counts)))
+        ts = list(map(self._ts.__getitem__, rng.choices(self._minutes, k=n)))
+        messages = {
+            "id": self._row_ids(g_counts, n),
+            "room_id": room_col,
+            "message_type": rng.choices((1, 2, 3), k=n),
+            "text": [f"Hello from room {rid}" for rid in room_col],
+            "is_by_partner": rng.choices((True, False), k=n),
+            "local_timestamp": ts,
+            "server_timestamp": ts,
+            "status": rng.choices((1, 2, 3), k=n),
+            "is_deleted": [False] * n,
+            "action": [None] * n,
+            "parent_message_id": [None] * n,
+            "created_at": ts,
+            "updated_at": ts,
+        }
+        return {"rooms": rooms, "room_members": members, "messages": messages}
+
+    def chunks(self, n_rooms, chunk_rooms=BATCH):
+        """Yield batch() dicts covering n_rooms rooms, chunk_rooms at a time."""
+        for start in range(0, n_rooms, chunk_rooms):
+            yield self.batch(min(chunk_rooms, n_rooms - start))
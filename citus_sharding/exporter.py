@@ -0,0 +1,291 @@
+"""Parallel per-shard export for the analytics / ETL path.
+
+ShardExporter reads the shard layout from the coordinator (metadata
+Topology), picks one placement per shard on an active node (spreading shards
+across workers), and streams every shard with COPY (SELECT ...) TO STDOUT
+straight from the worker holding it; `concurrency` shards run at once. The
+coordinator only serves the metadata query, so an export does not compete
+with OLTP traffic there.
+
+Each shard is written as gzip CSV parts of at most `chunk_rows` rows:
+
+    <out>/<run_id>/<table>/<shardid>/part-00000.csv.gz
+
+plus <out>/<run_id>/manifest.json with per-shard row counts and files, and
+the column names and Postgres types of every table (enough for DuckDB,
+Spark or a Parquet conversion to read the parts without guessing).
+
+Every run is bounded by the coordinator's now() at start (the watermark):
+a full run exports rows with updated_at before it, plus rows whose
+updated_at is NULL; incremental=True only those in [previous watermark,
+watermark), so rows with a NULL updated_at are skipped by incremental runs.
+<out>/state.json keeps the watermark per table (full runs advance it too),
+so no row is exported twice or skipped between runs. updated_at is set by
+the writer, so a transaction still open at the watermark can commit rows
+behind it; use full exports to reconcile.
+Every shard is read in its own snapshot, so a full export is consistent per
+shard, not across shards.
+
+Usage:
+    python -m citus_sharding.exporter --dsn "<coordinator dsn>" --out ./export [--incremental]
+        [--node-dsn worker1:5432=localhost:5442 ...]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from psycopg2.extensions import make_dsn
+
+from citus_sharding.catalog import TABLES
+from citus_sharding.copy_loader import COLUMNS, TYPES
+from citus_sharding.metadata import MetadataCache, parse_node_map
+from citus_sharding.pool import get_pool
+
+
+class _PartWriter:
+    """File-like sink for COPY TO: rolls to a new gzip part every `chunk_rows` rows.
+
+    libpq hands COPY OUT data over one row per write() call.
+    """
+
+    def __init__(self, directory, header, chunk_rows, compresslevel):
+        self.directory = directory
+        self.header = header
+        self.chunk_rows = chunk_rows
+        self.compresslevel = compresslevel
+        self.files = []
+        self.rows = 0
+        self._f = None
+        self._part_rows = 0
+
+    def _roll(self):
+        self.close()
+        path = os.path.join(self.directory, f"part-{len(self.files):05d}.csv.gz")
+        self._f = gzip.open(path, "wb", compresslevel=self.compresslevel)
+        self._f.write(self.header)
+        self.files.append({"path": path, "rows": 0})
+        self._part_rows = 0
+
+    def write(self, data):
+        if self._f is None or self._part_rows >= self.chunk_rows:
+            self._roll()
+        self._f.write(data)
+        self._part_rows += 1
+        self.files[-1]["rows"] += 1
+        self.rows += 1
+        return len(data)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self.files[-1]["bytes"] = os.path.getsize(self.files[-1]["path"])
+            self._f = None
+
+
+class ShardExporter:
+    def __init__(
+        self,
+        dsn,
+        out_dir,
+        tables=None,
+        concurrency=4,
+        chunk_rows=1_000_000,
+        node_dsns=None,
+        compresslevel=6,
+        log=print,
+    ):
+        self.dsn = dsn
+        self.out_dir = out_dir
+        self.tables = [t for t, _ in TABLES] if tables is None else list(tables)
+        self.concurrency = concurrency
+        self.chunk_rows = chunk_rows
+        self.node_dsns = dict(node_dsns or {})
+        self.compresslevel = compresslevel
+        self.log = log
+        self._log_lock = threading.Lock()
+
+    def _node_dsn(self, node, port):
+        dsn = self.node_dsns.get((node, port))
+        return dsn or make_dsn(self.dsn, host=node, port=port)
+
+    def _state_path(self):
+        return os.path.join(self.out_dir, "state.json")
+
+    def _load_state(self):
+        try:
+            with open(self._state_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def plan(self, topology):
+        """[(table, shardid, (node, port))], one active placement per shard, spread over nodes."""
+        load = Counter()
+        tasks = []
+        for (table, sid), places in sorted(topology.active_placements.items()):
+            if table not in self.tables:
+                continue
+            node = min(places, key=lambda p: (load[p], p))
+            load[node] += 1
+            tasks.append((table, sid, node))
+        missing = [
+            key for key in topology.ranges
+            if key[0] in self.tables and not topology.active_placements.get(key)
+        ]
+        if missing:
+            raise LookupError(f"no active placement for shards {sorted(missing)}")
+        return tasks
+
+    def _export_shard(self, run_dir, table, sid, node, since, until):
+        cols = COLUMNS[table]
+        directory = os.path.join(run_dir, table, str(sid))
+        os.makedirs(directory, exist_ok=True)
+        sink = _PartWriter(
+            directory, (",".join(cols) + "\n").encode(), self.chunk_rows, self.compresslevel
+        )
+        if since is None:
+            # full run: rows never stamped with updated_at are exported too
+            where, params = " WHERE (updated_at < %s OR updated_at IS NULL)", [until]
+        else:
+            where, params = " WHERE updated_at >= %s AND updated_at < %s", [since, until]
+        t0 = time.perf_counter()
+        with get_pool(self._node_dsn(*node)).connection() as conn:
+            with conn.cursor() as cur:
+                sql = cur.mogrify(
+                    f"COPY (SELECT {', '.join(cols)} FROM {table}_{sid}{where}) "
+                    "TO STDOUT (FORMAT csv)",
+                    params,
+                ).decode()
+                try:
+                    cur.copy_expert(sql, sink)
+                finally:
+                    sink.close()
+            conn.rollback()
+        seconds = time.perf_counter() - t0
+        with self._log_lock:
+            self.log(f"{table}_{sid} from {node[0]}:{node[1]}: {sink.rows:,} rows in {seconds:.2f}s")
+        return {
+            "shardid": sid,
+            "placement": f"{node[0]}:{node[1]}",
+            "rows": sink.rows,
+            "seconds": seconds,
+            "files": [
+                {**f, "path": os.path.relpath(f["path"], run_dir)} for f in sink.files
+            ],
+        }
+
+    def run(self, incremental=False, run_id=None):
+        """Export every shard once; returns the manifest (also written to disk).
+
+        Refuses to write into an existing <out>/<run_id> directory.
+        """
+        conn_pool = get_pool(self.dsn)
+        with conn_pool.connection() as conn:
+            with conn.cursor() as cur:
+                topology = MetadataCache(tables=self.tables).get(cur)
+                cur.execute("SELECT now();")
+                until = cur.fetchone()[0]
+            conn.rollback()
+        state = self._load_state()
+        run_id = run_id or until.strftime("%Y%m%dT%H%M%S_%f")
+        run_dir = os.path.join(self.out_dir, run_id)
+        if os.path.exists(run_dir):
+            raise FileExistsError(f"export run directory {run_dir} already exists")
+        os.makedirs(run_dir)
+
+        tasks = self.plan(topology)
+        started = datetime.now().isoformat()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="export") as ex:
+            futures = [
+                (
+                    table,
+                    ex.submit(
+                        self._export_shard,
+                        run_dir,
+                        table,
+                        sid,
+                        node,
+                        state.get(table) if incremental else None,
+                        until,
+                    ),
+                )
+                for table, sid, node in tasks
+            ]
+            results = [(table, f.result()) for table, f in futures]
+
+        manifest = {
+            "run_id": run_id,
+            "mode": "incremental" if incremental else "full",
+            "started_at": started,
+            "finished_at": datetime.now().isoformat(),
+            "watermark": until.isoformat(),
+            "tables": {},
+        }
+        for table in self.tables:
+            shards = [r for t, r in results if t == table]
+            manifest["tables"][table] = {
+                "since": state.get(table) if incremental else None,
+                "columns": list(COLUMNS[table]),
+                "types": list(TYPES[table]),
+                "rows": sum(s["rows"] for s in shards),
+                "shards": shards,
+            }
+        with open(os.path.join(run_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        # rows up to `until` are exported: the next incremental run starts there
+        state.update((t, until.isoformat()) for t in self.tables)
+        with open(self._state_path(), "w") as f:
+            json.dump(state, f, indent=2)
+        return manifest
+
+
+def main(argv):
+    p = argparse.ArgumentParser(
+        prog="python -m citus_sharding.exporter",
+        description="Export every shard in parallel straight from the workers.",
+    )
+    p.add_argument("--dsn", default=os.getenv("CITUS_DSN"), help="coordinator DSN")
+    p.add_argument("--out", required=True, help="output directory")
+    p.add_argument("--incremental", action="store_true", help="only rows changed since last run")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--chunk-rows", type=int, default=1_000_000)
+    p.add_argument("--table", action="append", help="table to export (repeatable; default all)")
+    p.add_argument(
+        "--node-dsn",
+        action="append",
+        default=[],
+        metavar="NODE:PORT=HOST:PORT",
+        help="reach a pg_dist_node worker at another address (repeatable; default CITUS_NODE_MAP)",
+    )
+    args = p.parse_args(argv)
+    if not args.dsn:
+        p.error("--dsn or CITUS_DSN is required")
+    try:
+        node_dsns = parse_node_map(",".join(args.node_dsn) or os.getenv("CITUS_NODE_MAP"), args.dsn)
+    except ValueError as e:
+        p.error(str(e))
+
+    exporter = ShardExporter(
+        args.dsn,
+        args.out,
+        tables=args.table,
+        concurrency=args.concurrency,
+        chunk_rows=args.chunk_rows,
+        node_dsns=node_dsns,
+    )
+    manifest = exporter.run(incremental=args.incremental)
+    for table, t in manifest["tables"].items():
+        print(f"{table}: {t['rows']:,} rows in {len(t['shards'])} shards")
+    print(f"Manifest: {os.path.join(args.out, manifest['run_id'], 'manifest.json')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,187 @@
+"""Scatter-gather reads across active-active clusters.
+
+Federation sends the same query to every cluster at once and merges the
+answers on the client:
+
+* merge(): a streaming k-way merge (heapq.merge) of per-cluster results that
+  are already sorted, e.g. ``ORDER BY created_at DESC LIMIT 50`` for the
+  latest messages across all rooms. Put the LIMIT in the SQL as well so each
+  cluster only sends its own top rows.
+* aggregate(): merges partial aggregates (count / sum / min / max, optionally
+  grouped by the leading columns). avg is sum and count merged separately.
+
+Rows are read through server-side (named) cursors in batches of `itersize`
+and handed over by one prefetch thread per cluster with a bounded queue, so
+clusters are read in parallel (latency tracks the slowest cluster) and client
+memory stays at about clusters x depth x itersize rows, whatever the result
+size. Connections come from the per-DSN pools.
+
+By default an unreachable or failing cluster fails the whole call. Pass a
+dict as `failed` to gather() / aggregate() / merge() to get a partial answer
+instead: clusters that fail are skipped and recorded there as
+{name: "ErrorType: message"} (merge() keeps whatever rows a cluster sent
+before it failed).
+"""
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from string import ascii_uppercase
+
+from citus_sharding.pipeline import prefetch
+from citus_sharding.pool import get_pool
+
+AGGREGATES = ("count", "sum", "min", "max")
+
+
+def _merge_value(kind, a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if kind in ("count", "sum"):
+        return a + b
+    if kind == "min":
+        return min(a, b)
+    if kind == "max":
+        return max(a, b)
+    raise ValueError(f"unknown aggregate {kind!r}, expected one of {AGGREGATES}")
+
+
+def merge_partials(rows, kinds, group_by=0):
+    """Combine partial aggregate rows from several clusters.
+
+    Each row is `group_by` key columns followed by one column per entry in
+    `kinds`. Returns {key tuple: [values]} (key is () without grouping).
+    """
+    merged = {}
+    for row in rows:
+        key, values = tuple(row[:group_by]), row[group_by:]
+        if len(values) != len(kinds):
+            raise ValueError(f"expected {len(kinds)} aggregate columns, got {len(values)}")
+        acc = merged.get(key)
+        if acc is None:
+            merged[key] = list(values)
+        else:
+            for i, kind in enumerate(kinds):
+                acc[i] = _merge_value(kind, acc[i], values[i])
+    return merged
+
+
+def _describe(e):
+    return f"{type(e).__name__}: {e}".strip()
+
+
+def _guarded(name, batches, failed):
+    """Yield `batches` until they fail; then record the error and stop."""
+    try:
+        yield from batches
+    except Exception as e:
+        failed[name] = _describe(e)
+
+
+class Federation:
+    def __init__(self, dsns, names=None, itersize=2_000, depth=4, timeout=30.0):
+        self.dsns = list(dsns)
+        if names is None:
+            names = [
+                f"Cluster {ascii_uppercase[i]}" if i < 26 else f"Cluster {i + 1}"
+                for i in range(len(self.dsns))
+            ]
+        self.names = list(names)
+        self.itersize = itersize
+        self.depth = depth
+        self.timeout = timeout
+
+    @classmethod
+    def from_router(cls, router, **kwargs):
+        """Federation over the clusters of a tenant_router.TenantRouter."""
+        return cls(router.dsns, router.names, **kwargs)
+
+    def _batches(self, dsn, sql, params, itersize):
+        with get_pool(dsn).connection(self.timeout) as conn:
+            # named cursor = server-side: rows arrive itersize at a time
+            with conn.cursor(name="federated_read") as cur:
+                cur.itersize = itersize
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows:
+                        break
+                    yield rows
+            conn.rollback()
+
+    def _streams(self, sql, params, itersize):
+        return [
+            prefetch(self._batches(dsn, sql, params, itersize), self.depth)
+            for dsn in self.dsns
+        ]
+
+    def stream(self, sql, params=None):
+        """All rows from all clusters, cluster by cluster (no ordering)."""
+        streams = self._streams(sql, params, self.itersize)
+        try:
+            for s in streams:
+                for rows in s:
+                    yield from rows
+        finally:
+            for s in streams:
+                s.close()
+
+    def merge(self, sql, params=None, key=None, reverse=False, limit=None, failed=None):
+        """k-way merge of per-cluster results that are sorted by `key`.
+
+        `reverse=True` for DESC ordering. Stops (and releases every cluster's
+        cursor) after `limit` rows. With a `failed` dict, failing clusters are
+        left out of the merge and recorded there.
+        """
+        itersize = min(self.itersize, limit) if limit else self.itersize
+        streams = self._streams(sql, params, itersize)
+        sources = streams
+        if failed is not None:
+            sources = [_guarded(name, s, failed) for name, s in zip(self.names, streams)]
+        try:
+            rows = heapq.merge(
+                *(itertools.chain.from_iterable(s) for s in sources),
+                key=key,
+                reverse=reverse,
+            )
+            yield from itertools.islice(rows, limit)
+        finally:
+            for s in streams:
+                s.close()
+
+    def gather(self, sql, params=None, failed=None):
+        """Run a small query on every cluster at once; returns [(name, rows)].
+
+        With a `failed` dict, clusters that fail are left out of the result
+        and recorded there instead of raising.
+        """
+
+        def one(dsn):
+            with get_pool(dsn).connection(self.timeout) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    rows = cur.fetchall()
+                conn.rollback()
+            return rows
+
+        with ThreadPoolExecutor(max_workers=len(self.dsns), thread_name_prefix="gather") as ex:
+            futures = [ex.submit(one, dsn) for dsn in self.dsns]
+            results = []
+            for name, f in zip(self.names, futures):
+                if failed is None:
+                    results.append((name, f.result()))
+                    continue
+                try:
+                    results.append((name, f.result()))
+                except Exception as e:
+                    failed[name] = _describe(e)
+        return results
+
+    def aggregate(self, sql, kinds, params=None, group_by=0, failed=None):
+        """Run a partial-aggregate query everywhere and merge (see merge_partials).
+
+        With a `failed` dict the totals cover only the clusters that answered.
+        """
+        rows = [row for _, part in self.gather(sql, params, failed) for row in part]
+        return merge_partials(rows, kinds, group_by)
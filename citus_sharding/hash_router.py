@@ -0,0 +1,180 @@
+"""Client-side Citus routing: room_id -> hash -> shard -> placements.
+
+Citus hashes a bigint distribution column with PostgreSQL's hashint8() and
+picks the shard whose [shardminvalue, shardmaxvalue] range contains the
+(signed int32) hash. Reproducing that here lets writers pre-partition rows by
+shard group and lets tooling answer "where does this room live" without a
+get_shard_id_for_distribution_column() round-trip.
+
+Usage:
+    python -m citus_sharding.hash_router "<dsn>" 42 1001 ...
+"""
+import sys
+from bisect import bisect_right
+from collections import defaultdict
+
+from citus_sharding.catalog import TABLES, fetch_placements, fetch_ranges
+
+_M32 = 0xFFFFFFFF
+# hash_uint32() seed: 0x9e3779b9 + sizeof(uint32) + 3923095
+_SEED = (0x9E3779B9 + 4 + 3923095) & _M32
+
+
+def hash_int8(value):
+    """PostgreSQL hashint8(value) as a signed int32 (what Citus compares)."""
+    lo = value & _M32
+    hi = (value >> 32) & _M32
+    lo ^= hi if value >= 0 else hi ^ _M32
+
+    # hash_uint32(): a = b = c = seed; a += k; final(a, b, c)
+    b = c = _SEED
+    a = (_SEED + lo) & _M32
+    c ^= b
+    c = (c - ((b << 14) | (b >> 18))) & _M32
+    a ^= c
+    a = (a - ((c << 11) | (c >> 21))) & _M32
+    b ^= a
+    b = (b - ((a << 25) | (a >> 7))) & _M32
+    c ^= b
+    c = (c - ((b << 16) | (b >> 16))) & _M32
+    a ^= c
+    a = (a - ((c << 4) | (c >> 28))) & _M32
+    b ^= a
+    b = (b - ((a << 14) | (a >> 18))) & _M32
+    c ^= b
+    c = (c - ((b << 24) | (b >> 8))) & _M32
+    return c - 0x100000000 if c & 0x80000000 else c
+
+
+class ShardRouter:
+    """Sorted-array index over one colocation group's hash ranges.
+
+    `ranges` and `placements` are the dicts returned by fetch_ranges() and
+    fetch_placements(). All tables in the group must share the same shard
+    boundaries (they do when colocated with 'rooms'); shard *index* i is the
+    shard group, and shard_ids[table][i] is that table's shard in the group.
+    """
+
+    def __init__(self, ranges, placements, tables=None):
+        if tables is None:
+            tables = sorted({tbl for tbl, _ in ranges})
+        per_table = {}
+        for table in tables:
+            per_table[table] = sorted(
+                (int(mn), int(mx), sid)
+                for (tbl, sid), (mn, mx) in ranges.items()
+                if tbl == table
+            )
+        if not per_table or not any(per_table.values()):
+            raise ValueError("No shard ranges for the requested tables")
+
+        first = next(iter(per_table.values()))
+        bounds = [(mn, mx) for mn, mx, _ in first]
+        for table, rows in per_table.items():
+            if [(mn, mx) for mn, mx, _ in rows] != bounds:
+                raise ValueError(f"{table} is not colocated with {tables[0]}")
+
+        self.tables = tuple(tables)
+        self._mins = [mn for mn, _ in bounds]
+        self._maxs = [mx for _, mx in bounds]
+        self.shard_ids = {t: [sid for _, _, sid in rows] for t, rows in per_table.items()}
+        self._placements = {
+            t: [tuple(placements.get((t, sid), ())) for sid in sids]
+            for t, sids in self.shard_ids.items()
+        }
+
+    @classmethod
+    def from_cursor(cls, cur, tables=None):
+        if tables is None:
+            tables = [t for t, _ in TABLES]
+        return cls(fetch_ranges(cur), fetch_placements(cur), tables)
+
+    def __len__(self):
+        return len(self._mins)
+
+    # ---------- single key ----------
+
+    def group_index(self, key):
+        """Shard group (0-based index into the sorted ranges) owning `key`."""
+        h = hash_int8(key)
+        i = bisect_right(self._mins, h) - 1
+        if i < 0 or h > self._maxs[i]:
+            raise LookupError(f"hash {h} of {key} is not covered by any shard")
+        return i
+
+    def shard_for(self, key, table="rooms"):
+        return self.shard_ids[table][self.group_index(key)]
+
+    def placements_for(self, key, table="rooms"):
+        return self._placements[table][self.group_index(key)]
+
+    # ---------- batches ----------
+
+    def group_indexes(self, keys):
+        """group_index() for every key, in order."""
+        mins, maxs = self._mins, self._maxs
+        out = []
+        append = out.append
+        for key in keys:
+            h = hash_int8(key)
+            i = bisect_right(mins, h) - 1
+            if i < 0 or h > maxs[i]:
+                raise LookupError(f"hash {h} of {key} is not covered by any shard")
+            append(i)
+        return out
+
+    def shards_for(self, keys, table="rooms"):
+        sids = self.shard_ids[table]
+        return [sids[i] for i in self.group_indexes(keys)]
+
+    def bucket(self, keys, table="rooms"):
+        """{shardid: [keys...]} for `table`, preserving input order per shard."""
+        sids = self.shard_ids[table]
+        buckets = defaultdict(list)
+        for key, i in zip(keys, self.group_indexes(keys)):
+            buckets[sids[i]].append(key)
+        return dict(buckets)
+
+    def bucket_rows(self, rows, key_index, table="rooms"):
+        """Split row tuples by the shard of row[key_index] -> {shardid: [rows]}."""
+        rows = rows if isinstance(rows, list) else list(rows)
+        sids = self.shard_ids[table]
+        idx = self.group_indexes([r[key_index] for r in rows])
+        buckets = defaultdict(list)
+        for row, i in zip(rows, idx):
+            buckets[sids[i]].append(row)
+        return dict(buckets)
+
+    def group_for_shard(self, shardid):
+        for sids in self.shard_ids.values():
+            if shardid in sids:
+                return sids.index(shardid)
+        raise KeyError(shardid)
+
+    def placements_of_group(self, index, table="rooms"):
+        return self._placements[table][index]
+
+
+def main(argv):
+    import psycopg2
+
+    if len(argv) < 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 2
+    conn = psycopg2.connect(argv[0])
+    try:
+        with conn.cursor() as cur:
+            router = ShardRouter.from_cursor(cur)
+    finally:
+        conn.close()
+    for raw in argv[1:]:
+        key = int(raw)
+        i = router.group_index(key)
+        places = ", ".join(f"{n}:{p}" for n, p in router.placements_of_group(i))
+        shards = ", ".join(f"{t}={router.shard_ids[t][i]}" for t in router.tables)
+        print(f"room {key}: hash={hash_int8(key)} group={i + 1} {shards} -> {places}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
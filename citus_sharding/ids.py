@@ -0,0 +1,136 @@
+"""Coordinator-free, k-sortable 64-bit ids (Snowflake layout).
+
+    | 1 unused | 41 bits ms since EPOCH | 4 bits cluster | 6 bits worker | 12 bits sequence |
+
+Each process allocates locally from its own (cluster_id, worker_id) slot, so
+ids never collide across the active-active clusters and need no sequence or
+max(id)+1 round-trip. Ids grow with time, so index inserts on messages land
+at the right edge of the btree instead of at random pages.
+
+Clock regression: the allocator never goes back in time. If the wall clock
+steps back by up to `max_backwards_ms` it keeps issuing from the last
+millisecond it used (moving to the next one when the 4096-id sequence is
+used up); a larger step raises ClockRegressionError. Bulk take()/allocate()
+may run ahead of the clock ("borrow" future milliseconds) by at most
+`max_ahead_ms`, after which it waits for the clock to catch up.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import chain
+
+# 2024-01-01T00:00:00Z; 41 bits of milliseconds last ~69 years from here
+EPOCH_MS = 1_704_067_200_000
+
+TIMESTAMP_BITS = 41
+CLUSTER_BITS = 4
+WORKER_BITS = 6
+SEQUENCE_BITS = 12
+
+MAX_CLUSTER = (1 << CLUSTER_BITS) - 1
+MAX_WORKER = (1 << WORKER_BITS) - 1
+SEQUENCE_SIZE = 1 << SEQUENCE_BITS
+
+WORKER_SHIFT = SEQUENCE_BITS
+CLUSTER_SHIFT = SEQUENCE_BITS + WORKER_BITS
+TIMESTAMP_SHIFT = SEQUENCE_BITS + WORKER_BITS + CLUSTER_BITS
+
+
+class ClockRegressionError(RuntimeError):
+    pass
+
+
+def _now_ms():
+    return time.time_ns() // 1_000_000
+
+
+class IdAllocator:
+    def __init__(
+        self,
+        cluster_id,
+        worker_id,
+        epoch_ms=EPOCH_MS,
+        max_backwards_ms=5_000,
+        max_ahead_ms=1_000,
+        clock=_now_ms,
+    ):
+        if not 0 <= cluster_id <= MAX_CLUSTER:
+            raise ValueError(f"cluster_id must be in 0..{MAX_CLUSTER}")
+        if not 0 <= worker_id <= MAX_WORKER:
+            raise ValueError(f"worker_id must be in 0..{MAX_WORKER}")
+        self.cluster_id = cluster_id
+        self.worker_id = worker_id
+        self.epoch_ms = epoch_ms
+        self.max_backwards_ms = max_backwards_ms
+        self.max_ahead_ms = max_ahead_ms
+        self._clock = clock
+        self._node = (cluster_id << CLUSTER_SHIFT) | (worker_id << WORKER_SHIFT)
+        self._wall_ms = -1  # latest wall-clock reading
+        self._last_ms = -1  # millisecond being allocated from (may run ahead)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.regressions = 0
+
+    def _tick(self):
+        """Wall-clock ms since the epoch, ignoring (bounded) steps backwards."""
+        now = self._clock() - self.epoch_ms
+        if now < self._wall_ms:
+            behind = self._wall_ms - now
+            if behind > self.max_backwards_ms:
+                raise ClockRegressionError(
+                    f"clock moved back {behind} ms (limit {self.max_backwards_ms} ms)"
+                )
+            self.regressions += 1
+            now = self._wall_ms
+        self._wall_ms = now
+        if now > self._last_ms:
+            self._last_ms, self._seq = now, 0
+        return now
+
+    def allocate(self, n):
+        """Reserve `n` ids; returns a list of contiguous ranges in increasing order."""
+        if n <= 0:
+            return []
+        with self._lock:
+            now = self._tick()
+            ms, seq = self._last_ms, self._seq
+            if ms >= 1 << TIMESTAMP_BITS:
+                raise OverflowError("timestamp bits exhausted; move the epoch")
+            ranges = []
+            while n:
+                take = min(n, SEQUENCE_SIZE - seq)
+                base = (ms << TIMESTAMP_SHIFT) | self._node
+                ranges.append(range(base + seq, base + seq + take))
+                n -= take
+                seq += take
+                if seq == SEQUENCE_SIZE:
+                    ms, seq = ms + 1, 0
+            self._last_ms, self._seq = ms, seq
+            ahead = ms - now - self.max_ahead_ms
+            if ahead > 0:
+                # borrowed too far into the future: let the clock catch up
+                time.sleep(ahead / 1000.0)
+            return ranges
+
+    def take(self, n):
+        """`n` ids as a list (bulk allocation for batch loads)."""
+        return list(chain.from_iterable(self.allocate(n)))
+
+    def next_id(self):
+        return self.allocate(1)[0][0]
+
+
+def parse_id(value, epoch_ms=EPOCH_MS):
+    """{"timestamp", "cluster", "worker", "sequence"} encoded in an id."""
+    ms = (value >> TIMESTAMP_SHIFT) + epoch_ms
+    return {
+        "timestamp": datetime.fromtimestamp(ms / 1000.0, timezone.utc),
+        "cluster": (value >> CLUSTER_SHIFT) & MAX_CLUSTER,
+        "worker": (value >> WORKER_SHIFT) & MAX_WORKER,
+        "sequence": value & (SEQUENCE_SIZE - 1),
+    }
+
+
+def min_id_at(when, epoch_ms=EPOCH_MS):
+    """Smallest id allocated at or after datetime `when` (for id range scans)."""
+    return max(0, int(when.timestamp() * 1000) - epoch_ms) << TIMESTAMP_SHIFT
@@ -0,0 +1,191 @@
+"""In-process cache of the Citus topology (shards, placements, nodes, colocation).
+
+The whole topology is read in one query and indexed in memory. Later
+refresh() calls only run a cheap fingerprint query (md5 over pg_dist_node,
+pg_dist_placement and pg_dist_shard) and reload when it changed, e.g. after
+citus_disable_node(), a shard move or a rebalance. Checks are rate-limited by
+`check_interval`, so routers and loaders can call refresh() before every batch.
+
+Works against a coordinator DSN or the HAProxy endpoint: a dropped connection
+(Patroni failover) is reopened on the next refresh().
+"""
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+from citus_sharding.catalog import TABLES, grouped_colocation
+from citus_sharding.hash_router import ShardRouter
+
+FINGERPRINT_SQL = """
+SELECT md5(
+  coalesce((SELECT string_agg(concat_ws('/', nodeid, groupid, nodename, nodeport,
+                                        isactive, noderole), ',' ORDER BY nodeid)
+            FROM pg_dist_node), '') || '|' ||
+  coalesce((SELECT string_agg(concat_ws('/', placementid, shardid, groupid, shardstate),
+                              ',' ORDER BY placementid)
+            FROM pg_dist_placement), '') || '|' ||
+  coalesce((SELECT string_agg(concat_ws('/', shardid, shardminvalue, shardmaxvalue),
+                              ',' ORDER BY shardid)
+            FROM pg_dist_shard), ''))
+"""
+
+TOPOLOGY_SQL = f"""
+SELECT ({FINGERPRINT_SQL}) AS fingerprint,
+       s.logicalrelid::text, s.shardid, s.shardminvalue::text, s.shardmaxvalue::text,
+       d.colocationid, n.nodename, n.nodeport, n.groupid, n.isactive
+FROM pg_dist_shard s
+JOIN pg_dist_partition d ON d.logicalrelid = s.logicalrelid
+LEFT JOIN pg_dist_placement p ON p.shardid = s.shardid
+LEFT JOIN pg_dist_node n ON n.groupid = p.groupid
+WHERE s.logicalrelid::text = ANY(%s)
+ORDER BY 2, 3, 7, 8;
+"""
+
+
+def _host_port(text):
+    host, sep, port = text.strip().rpartition(":")
+    if not sep or not host or not port.isdigit():
+        raise ValueError(f"expected host:port, got {text.strip()!r}")
+    return host, int(port)
+
+
+def parse_node_map(spec, dsn):
+    """{(nodename, nodeport): dsn} from "node:port=host:port,..." for node_dsns.
+
+    Worker names in pg_dist_node (worker1:5432) usually only resolve inside
+    the cluster network; map each to an address reachable from here. The
+    DSNs are `dsn` with host/port replaced.
+    """
+    out = {}
+    for item in (spec or "").replace(";", ",").split(","):
+        if not item.strip():
+            continue
+        node, sep, addr = item.partition("=")
+        if not sep:
+            raise ValueError(f"expected node:port=host:port, got {item.strip()!r}")
+        host, port = _host_port(addr)
+        out[_host_port(node)] = make_dsn(dsn, host=host, port=port)
+    return out
+
+
+class Topology:
+    """Indexed, read-only view of one metadata load."""
+
+    def __init__(self, fingerprint, rows):
+        self.fingerprint = fingerprint
+        self.ranges = {}
+        placements = defaultdict(list)
+        active = defaultdict(list)
+        shards_by_node = defaultdict(list)
+        colocation = defaultdict(set)
+        self.nodes = {}
+        for _, tbl, sid, mn, mx, coloc, node, port, group, isactive in rows:
+            key = (tbl, int(sid))
+            self.ranges[key] = (mn, mx)
+            colocation[coloc].add(tbl)
+            if node is None:
+                continue
+            place = (node, int(port))
+            placements[key].append(place)
+            if isactive:
+                active[key].append(place)
+            shards_by_node[place].append(key)
+            self.nodes[place] = {"groupid": group, "isactive": bool(isactive)}
+        # same shapes as catalog.fetch_placements() / fetch_ranges()
+        self.placements = dict(placements)
+        self.active_placements = dict(active)
+        self.shards_by_node = dict(shards_by_node)
+        self.colocation = {c: sorted(t) for c, t in colocation.items()}
+        self.groups = grouped_colocation(self.ranges)
+        self._routers = {}
+
+    def router(self, tables=None):
+        """hash_router.ShardRouter over this topology (built once per table set)."""
+        key = tuple(tables or [t for t, _ in TABLES])
+        r = self._routers.get(key)
+        if r is None:
+            r = self._routers[key] = ShardRouter(self.ranges, self.placements, list(key))
+        return r
+
+
+class MetadataCache:
+    """Keeps the latest Topology for one cluster.
+
+    Pass a cursor to refresh() to use the caller's connection, or give the
+    cache a `dsn` and it manages its own connection.
+    """
+
+    def __init__(self, dsn=None, tables=None, check_interval=1.0):
+        self.dsn = dsn
+        self.tables = [t for t, _ in TABLES] if tables is None else list(tables)
+        self.check_interval = check_interval
+        self.topology = None
+        self.version = 0
+        self.reloads = 0
+        self.checks = 0
+        self._checked_at = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _cursor(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn)
+            self._conn.autocommit = True
+        return self._conn.cursor()
+
+    def _load(self, cur):
+        cur.execute(TOPOLOGY_SQL, (self.tables,))
+        rows = cur.fetchall()
+        if rows:
+            fingerprint = rows[0][0]
+        else:
+            cur.execute(FINGERPRINT_SQL)
+            fingerprint = cur.fetchone()[0]
+        self.topology = Topology(fingerprint, rows)
+        self.version += 1
+        self.reloads += 1
+
+    def _refresh(self, cur, force):
+        now = time.monotonic()
+        if self.topology is None or force:
+            self._load(cur)
+            self._checked_at = now
+            return True
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        self.checks += 1
+        cur.execute(FINGERPRINT_SQL)
+        if cur.fetchone()[0] == self.topology.fingerprint:
+            return False
+        self._load(cur)
+        return True
+
+    def refresh(self, cur=None, force=False):
+        """Reload if the metadata changed; returns True when a new Topology was loaded."""
+        with self._lock:
+            if cur is not None:
+                return self._refresh(cur, force)
+            try:
+                with self._cursor() as own:
+                    return self._refresh(own, force)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # leader changed under HAProxy: reconnect once and reload
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = None
+                with self._cursor() as own:
+                    return self._refresh(own, True)
+
+    def get(self, cur=None):
+        """Current Topology, refreshed if needed."""
+        self.refresh(cur)
+        return self.topology
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
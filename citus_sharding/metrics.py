@@ -0,0 +1,280 @@
+"""In-process metrics for the loaders and cluster tooling.
+
+Metrics keeps counters and latency histograms keyed by name and labels
+(table, cluster, phase, ...):
+
+* phase(name) times a block (prepare, bootstrap, truncate, commit, ...),
+  timed_iter(name, it) times every next() of an iterator (row generation);
+* observe_batch() records one COPY/INSERT batch: latency histogram plus
+  rows, bytes and seconds counters per table, from which rates are derived;
+* inc() covers everything else (retries, reconnects, failed clusters).
+
+bind(**labels) returns a view that adds default labels, so a per-cluster job
+records under cluster="Cluster A" without passing labels around. Export with
+to_json() or to_prometheus() (text exposition format, e.g. for the
+node_exporter textfile collector), or export() to files.
+
+statement_snapshot() / statement_deltas() diff pg_stat_statements around a
+run, so server-side execution time can be set against the client timings.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "citus"
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "phase_seconds": "Wall time of named phases and generator steps",
+    "batch_seconds": "Latency of one COPY/INSERT batch",
+    "rows_total": "Rows written",
+    "bytes_total": "Payload bytes sent",
+    "write_seconds_total": "Time spent inside COPY/INSERT statements",
+    "retries_total": "Retried operations",
+    "reconnects_total": "Reconnects after a lost connection (failover)",
+    "failures_total": "Failed jobs",
+    "server_calls_total": "pg_stat_statements calls during the run",
+    "server_exec_seconds_total": "pg_stat_statements execution time during the run",
+    "server_rows_total": "pg_stat_statements rows during the run",
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    def __init__(self, prefix=PREFIX, buckets=BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels key) -> value
+        self._hists = {}  # (name, labels key) -> [count per bucket..., +Inf count, sum]
+        self._statements = []
+        self._defaults = {}
+        self._started = time.time()
+
+    def bind(self, **labels):
+        """A view on the same storage that adds `labels` to everything it records."""
+        view = object.__new__(Metrics)
+        view.__dict__.update(self.__dict__)
+        view._defaults = {**self._defaults, **labels}
+        return view
+
+    def _key(self, name, labels):
+        return name, _labels_key({**self._defaults, **labels})
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    h[i] += 1
+                    break
+            else:
+                h[len(self.buckets)] += 1
+            h[-1] += value
+
+    @contextmanager
+    def phase(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("phase_seconds", time.perf_counter() - t0, phase=name, **labels)
+
+    def timed_iter(self, name, iterable, **labels):
+        """Yield from `iterable`, timing each step as phase `name`."""
+        it = iter(iterable)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                self.observe("phase_seconds", time.perf_counter() - t0, phase=name, **labels)
+                yield item
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+
+    def observe_batch(self, table, rows, nbytes, seconds, **labels):
+        self.observe("batch_seconds", seconds, table=table, **labels)
+        self.inc("rows_total", rows, table=table, **labels)
+        self.inc("bytes_total", nbytes, table=table, **labels)
+        self.inc("write_seconds_total", seconds, table=table, **labels)
+
+    def add_statements(self, deltas, **labels):
+        """Record statement_deltas() output (per queryid counters + query text for JSON)."""
+        for d in deltas:
+            q = {"queryid": d["queryid"], **labels}
+            self.inc("server_calls_total", d["calls"], **q)
+            self.inc("server_exec_seconds_total", d["exec_seconds"], **q)
+            self.inc("server_rows_total", d["rows"], **q)
+        with self._lock:
+            self._statements.append({**self._defaults, **labels, "statements": list(deltas)})
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {k: list(v) for k, v in self._hists.items()}
+            statements = list(self._statements)
+        rates = []
+        for (name, key), rows in counters.items():
+            if name != "rows_total":
+                continue
+            seconds = counters.get(("write_seconds_total", key), 0.0)
+            nbytes = counters.get(("bytes_total", key), 0)
+            rates.append({
+                **dict(key),
+                "rows_per_s": rows / seconds if seconds > 0 else 0.0,
+                "bytes_per_s": nbytes / seconds if seconds > 0 else 0.0,
+            })
+        histograms = []
+        for (name, key), h in hists.items():
+            count = sum(h[:-1])
+            histograms.append({
+                "name": name,
+                "labels": dict(key),
+                "count": count,
+                "sum": h[-1],
+                "mean": h[-1] / count if count else 0.0,
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], h[:-1])),
+            })
+        return {
+            "started_at": self._started,
+            "counters": [
+                {"name": name, "labels": dict(key), "value": v}
+                for (name, key), v in sorted(counters.items())
+            ],
+            "histograms": sorted(histograms, key=lambda h: (h["name"], sorted(h["labels"].items()))),
+            "rates": rates,
+            "statements": statements,
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent, default=str)
+
+    def to_prometheus(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            hists = sorted((k, list(v)) for k, v in self._hists.items())
+        lines, typed = [], set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {self.prefix}_{name} {HELP[name]}")
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for (name, key), value in counters:
+            header(name, "counter")
+            lines.append(f"{self.prefix}_{name}{_prom_labels(key)} {value}")
+        for (name, key), h in hists:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip([repr(b) for b in self.buckets] + ["+Inf"], h[:-1]):
+                cumulative += n
+                lines.append(
+                    f"{self.prefix}_{name}_bucket{_prom_labels(key, [('le', bound)])} {cumulative}"
+                )
+            lines.append(f"{self.prefix}_{name}_sum{_prom_labels(key)} {h[-1]}")
+            lines.append(f"{self.prefix}_{name}_count{_prom_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, json_path=None, prom_path=None):
+        """Write to_json() / to_prometheus() to the given paths (None = skip)."""
+        if json_path:
+            with open(json_path, "w") as f:
+                f.write(self.to_json())
+        if prom_path:
+            with open(prom_path, "w") as f:
+                f.write(self.to_prometheus())
+
+
+def format_phases(metrics):
+    lines = []
+    for h in metrics.snapshot()["histograms"]:
+        if h["name"] != "phase_seconds":
+            continue
+        labels = dict(h["labels"])
+        phase = labels.pop("phase")
+        where = ", ".join(f"{k}={v}" for k, v in labels.items())
+        lines.append(
+            f"  {phase}{f' ({where})' if where else ''}: {h['sum']:.3f}s"
+            f" over {h['count']} step(s)"
+        )
+    return "\n".join(lines)
+
+
+# Process-wide default registry
+METRICS = Metrics()
+
+STATEMENTS_SQL = """
+SELECT queryid, sum(calls), sum(total_exec_time), sum(rows), min(left(query, 200))
+FROM pg_stat_statements
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+GROUP BY queryid;
+"""
+
+
+def statement_snapshot(cur, create=False):
+    """{queryid: (calls, exec_ms, rows, query)} from pg_stat_statements, or None.
+
+    pg_stat_statements keeps one entry per (userid, dbid, queryid, toplevel);
+    the entries of the current database are summed per queryid.
+    The library is preloaded on the coordinators, but the view only exists
+    after CREATE EXTENSION; pass create=True to run it (needs superuser).
+    """
+    if create:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements;")
+    cur.execute("SELECT to_regclass('pg_stat_statements') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute(STATEMENTS_SQL)
+    return {
+        qid: (int(calls), float(ms), int(rows), q)
+        for qid, calls, ms, rows, q in cur.fetchall()
+    }
+
+
+def statement_deltas(before, after, top=10):
+    """Per-statement calls / exec seconds / rows between two snapshots, slowest first."""
+    if before is None or after is None:
+        return []
+    out = []
+    for qid, (calls, ms, rows, query) in after.items():
+        c0, ms0, r0, _ = before.get(qid, (0, 0.0, 0, None))
+        if calls > c0:
+            out.append({
+                "queryid": qid,
+                "query": query,
+                "calls": calls - c0,
+                "exec_seconds": (ms - ms0) / 1000.0,
+                "rows": rows - r0,
+            })
+    out.sort(key=lambda d: d["exec_seconds"], reverse=True)
+    return out[:top]
@@ -0,0 +1,586 @@
+"""Online tenant (room) migration between active-active clusters.
+
+TenantMigration moves one room, a list of rooms, or every room in a hashint8
+range from a source cluster to a target cluster while both keep serving:
+
+1. copy      rooms / room_members / messages stream source -> target through
+             COPY ... TO STDOUT piped into COPY ... FROM STDIN (binary, an
+             os.pipe between two connections; no temp files), upserted via a
+             temp staging table so a re-run never duplicates rows;
+2. catch_up  re-copy rows whose updated_at moved since the previous pass,
+             until a pass is small (writes made during the copy);
+3. flipped   record the flip in tenant_migrations and pin the rooms in this
+             process's TenantRouter; running writers pick it up through
+             PinWatcher (load_pins() every PIN_POLL_SECONDS), so wait
+             settle_seconds for them and their in-flight writes, then diff
+             every row's updated_at by (room_id, id), in keyset-paginated
+             batches, and copy what the target lacks or holds older,
+             until a pass finds nothing; verify per-table row counts;
+4. verified  delete, in small batches, only the source rows the target holds
+             at the same or a newer updated_at; anything left (a writer that
+             had not seen the flip) is diffed over again and retried;
+5. done.
+
+Progress is stored per migration_id in tenant_migrations on the target
+cluster, so an interrupted run picks up at its last phase. Copy speed is
+capped by `max_bytes_per_s` and source deletes by `delete_rows_per_s`.
+
+Catch-up passes use updated_at watermarks taken from the source's now(), so
+a transaction that commits late with an earlier updated_at can slip past
+them; they only shrink the work left for the final diff, which compares
+every row and does not depend on commit order. Writers must bump updated_at
+(soft deletes via is_deleted included); hard deletes on either side before
+the migration is done are not reconciled.
+
+Usage:
+    python -m citus_sharding.migrate --from "Cluster A" --to "Cluster B" --room 42
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+from citus_sharding.copy_loader import COLUMNS
+from citus_sharding.pipeline import KEY_COLUMN, TABLE_ORDER
+from citus_sharding.pool import get_pool
+
+PRIMARY_KEYS = {"rooms": ("id",), "room_members": ("id", "room_id"), "messages": ("id", "room_id")}
+
+PHASES = ("copy", "catch_up", "flipped", "verified", "done")
+
+# How often PinWatcher re-reads the pins; settle_seconds must be longer
+PIN_POLL_SECONDS = 1.0
+
+MIGRATION_DDL = """
+CREATE TABLE IF NOT EXISTS tenant_migrations (
+  migration_id TEXT PRIMARY KEY,
+  room_ids BIGINT[] NOT NULL,
+  source TEXT NOT NULL,
+  target TEXT NOT NULL,
+  phase TEXT NOT NULL,
+  watermark TIMESTAMPTZ,
+  rows_copied BIGINT NOT NULL DEFAULT 0,
+  flipped_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+def rooms_in_hash_range(cur, lo, hi):
+    """Room ids whose hashint8(id) (the value Citus shards on) is in [lo, hi]."""
+    cur.execute("SELECT id FROM rooms WHERE hashint8(id) BETWEEN %s AND %s ORDER BY id;", (lo, hi))
+    return [r for r, in cur.fetchall()]
+
+
+def load_pins(router):
+    """Re-apply every flipped migration recorded on the router's clusters; returns the count."""
+    pins = []
+    for dsn in router.dsns:
+        with get_pool(dsn).connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('tenant_migrations') IS NOT NULL;")
+                if cur.fetchone()[0]:
+                    cur.execute(
+                        "SELECT flipped_at, room_ids, target FROM tenant_migrations "
+                        "WHERE phase IN ('flipped', 'verified', 'done');"
+                    )
+                    pins.extend(cur.fetchall())
+            conn.rollback()
+    # later flips win when a room moved more than once
+    current = router.overrides()
+    for _, room_ids, target in sorted(pins, key=lambda p: p[0]):
+        idx = router._index(target)
+        for rid in room_ids:
+            if current.get(rid) != idx:
+                router.pin(rid, idx)
+                current[rid] = idx
+    return len(pins)
+
+
+class PinWatcher:
+    """Re-applies load_pins(router) every `interval` seconds on a daemon thread.
+
+    Long-running writers need it: a migration flips its rooms while they
+    run, and it only waits settle_seconds for them to notice.
+    """
+
+    def __init__(self, router, interval=PIN_POLL_SECONDS, log=print):
+        self.router = router
+        self.interval = interval
+        self.log = log
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        load_pins(self.router)
+        self._thread = threading.Thread(target=self._loop, name="pin-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                load_pins(self.router)
+            except Exception as e:  # keep routing on the last known pins
+                self.log(f"pin refresh failed: {type(e).__name__}: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _newer(ts, other):
+    """True if a row stamped `ts` is newer than a copy stamped `other`."""
+    return ts is not None and (other is None or ts > other)
+
+
+class _Throttled:
+    """File wrapper that sleeps to keep writes under `rate` bytes/s."""
+
+    def __init__(self, f, rate):
+        self.f = f
+        self.rate = rate
+        self.sent = 0
+        self.t0 = time.monotonic()
+
+    def write(self, data):
+        n = self.f.write(data)
+        self.sent += len(data)
+        ahead = self.sent / self.rate - (time.monotonic() - self.t0)
+        if ahead > 0:
+            time.sleep(ahead)
+        return n
+
+
+def pipe_copy(src_cur, dst_cur, select_sql, params, dst_sql, max_bytes_per_s=None):
+    """Stream COPY (select_sql) TO STDOUT on src into dst_sql (COPY ... FROM STDIN).
+
+    The source side runs on a helper thread writing into an os.pipe; the
+    target reads the other end. Returns the number of bytes moved.
+    """
+    out_sql = src_cur.mogrify(f"COPY ({select_sql}) TO STDOUT (FORMAT binary)", params)
+    r, w = os.pipe()
+    reader, writer = os.fdopen(r, "rb"), os.fdopen(w, "wb")
+    sink = writer if max_bytes_per_s is None else _Throttled(writer, max_bytes_per_s)
+    counted = {"bytes": 0, "error": None}
+
+    class _Counting:
+        def write(self, data):
+            counted["bytes"] += len(data)
+            return sink.write(data)
+
+    def produce():
+        try:
+            src_cur.copy_expert(out_sql.decode(), _Counting())
+        except BaseException as e:  # surfaced after the consumer finishes
+            counted["error"] = e
+        finally:
+            try:
+                writer.close()
+            except OSError:
+                pass
+
+    t = threading.Thread(target=produce, name="migrate-copy-out", daemon=True)
+    t.start()
+    try:
+        dst_cur.copy_expert(dst_sql, reader)
+    finally:
+        # a failed target closes the pipe, which stops the producer with EPIPE
+        reader.close()
+        t.join()
+    if counted["error"] is not None:
+        raise counted["error"]
+    return counted["bytes"]
+
+
+class TenantMigration:
+    def __init__(
+        self,
+        router,
+        source,
+        target,
+        room_ids,
+        migration_id=None,
+        max_bytes_per_s=None,
+        delete_batch=5_000,
+        delete_rows_per_s=None,
+        diff_batch=10_000,
+        catch_up_rows=100,
+        max_catch_up=10,
+        settle_seconds=3 * PIN_POLL_SECONDS,
+        log=print,
+    ):
+        self.router = router
+        self.source = router._index(source)
+        self.target = router._index(target)
+        if self.source == self.target:
+            raise ValueError("source and target are the same cluster")
+        self.room_ids = sorted(set(room_ids))
+        if not self.room_ids:
+            raise ValueError("no rooms to migrate")
+        self.migration_id = migration_id or (
+            f"{router.names[self.source]}->{router.names[self.target]}:"
+            f"{self.room_ids[0]}-{self.room_ids[-1]}x{len(self.room_ids)}"
+        )
+        self.max_bytes_per_s = max_bytes_per_s
+        self.delete_batch = delete_batch
+        self.delete_rows_per_s = delete_rows_per_s
+        self.diff_batch = diff_batch
+        self.catch_up_rows = catch_up_rows
+        self.max_catch_up = max_catch_up
+        self.settle_seconds = settle_seconds
+        self.log = log
+        self.src_pool = get_pool(router.dsns[self.source])
+        self.dst_pool = get_pool(router.dsns[self.target])
+
+    # ---------- state ----------
+
+    def _state(self, dst_cur):
+        dst_cur.execute(MIGRATION_DDL)
+        dst_cur.execute(
+            "SELECT phase, watermark, rows_copied FROM tenant_migrations WHERE migration_id = %s;",
+            (self.migration_id,),
+        )
+        row = dst_cur.fetchone()
+        if row is None:
+            dst_cur.execute(
+                "INSERT INTO tenant_migrations (migration_id, room_ids, source, target, phase) "
+                "VALUES (%s, %s, %s, %s, 'copy');",
+                (
+                    self.migration_id,
+                    self.room_ids,
+                    self.router.names[self.source],
+                    self.router.names[self.target],
+                ),
+            )
+            return "copy", None, 0
+        return row
+
+    def _save(self, dst_cur, phase, watermark=None, rows=0, flipped=False):
+        dst_cur.execute(
+            f"""
+            UPDATE tenant_migrations
+               SET phase = %s, watermark = coalesce(%s, watermark),
+                   rows_copied = rows_copied + %s, updated_at = CURRENT_TIMESTAMP
+                   {", flipped_at = CURRENT_TIMESTAMP" if flipped else ""}
+             WHERE migration_id = %s;
+            """,
+            (phase, watermark, rows, self.migration_id),
+        )
+        dst_cur.connection.commit()
+
+    # ---------- copy ----------
+
+    def _copy_pass(self, src, dst, since, pairs=None):
+        """Upsert the rooms' rows (changed at/after `since`).
+
+        With `pairs` ({table: [(room_id, id)]}) only those rows, and only
+        the tables listed, are copied.
+
+        A target row is only overwritten by a version with the same or a
+        newer updated_at, so writes that already reach the target survive.
+        """
+        rows = nbytes = 0
+        for table in TABLE_ORDER:
+            if pairs is not None and not pairs.get(table):
+                continue
+            cols = COLUMNS[table]
+            names = ", ".join(cols)
+            pk = PRIMARY_KEYS[table]
+            stage = f"_migrate_{table}"
+            dst.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {stage} "
+                f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;"
+            )
+            where = f"{KEY_COLUMN[table]} = ANY(%s)"
+            params = [self.room_ids]
+            if since is not None:
+                where += " AND updated_at >= %s"
+                params.append(since)
+            if pairs is not None:
+                # ids are only unique per room, so match the whole (room_id, id) pair
+                where += (
+                    f" AND ({KEY_COLUMN[table]}, id) IN "
+                    "(SELECT * FROM unnest(%s::bigint[], %s::bigint[]))"
+                )
+                params += [[k for k, _ in pairs[table]], [i for _, i in pairs[table]]]
+            nbytes += pipe_copy(
+                src,
+                dst,
+                f"SELECT {names} FROM {table} WHERE {where}",
+                params,
+                f"COPY {stage} ({names}) FROM STDIN (FORMAT binary)",
+                self.max_bytes_per_s,
+            )
+            updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in cols if c not in pk)
+            dst.execute(
+                f"INSERT INTO {table} ({names}) SELECT {names} FROM {stage} "
+                f"ON CONFLICT ({', '.join(pk)}) DO UPDATE SET {updates} "
+                f"WHERE {table}.updated_at IS NULL OR {table}.updated_at <= EXCLUDED.updated_at;"
+            )
+            rows += dst.rowcount
+        src.connection.rollback()
+        return rows, nbytes
+
+    def _source_now(self, src):
+        src.execute("SELECT now();")
+        now = src.fetchone()[0]
+        src.connection.rollback()
+        return now
+
+    def _catch_up(self, src, dst, watermark, phase):
+        for _ in range(self.max_catch_up):
+            started = self._source_now(src)
+            rows, nbytes = self._copy_pass(src, dst, watermark)
+            watermark = started
+            self._save(dst, phase, watermark, rows)
+            self.log(f"[{self.migration_id}] catch-up: {rows:,} rows ({nbytes:,} bytes)")
+            if rows <= self.catch_up_rows:
+                break
+        return watermark
+
+    def _versions(self, cur, table, after, upto=None, limit=None):
+        """[(room_id, id, updated_at)] of the rooms' rows in `table`, in (room_id, id) order.
+
+        Keyset page: (room_id, id) > `after`, and <= `upto` / at most `limit` rows.
+        """
+        key = KEY_COLUMN[table]
+        sql = (
+            f"SELECT {key}, id, updated_at FROM {table} "
+            f"WHERE {key} = ANY(%s) AND ({key}, id) > (%s, %s)"
+        )
+        params = [self.room_ids, *after]
+        if upto is not None:
+            sql += f" AND ({key}, id) <= (%s, %s)"
+            params += upto
+        sql += f" ORDER BY {key}, id"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        cur.execute(sql + ";", params)
+        rows = cur.fetchall()
+        cur.connection.rollback()
+        return rows
+
+    def _sync(self, src, dst):
+        """Full diff: copy every source row the target lacks or holds an older version of.
+
+        Both sides are compared `diff_batch` source rows at a time, so client
+        memory stays bounded whatever the rooms hold; each batch's stale rows
+        are copied and committed before the next batch is read.
+        """
+        rows = nbytes = 0
+        for table in TABLE_ORDER:
+            last = (-(1 << 63), -(1 << 63))
+            while True:
+                ours = self._versions(src, table, last, limit=self.diff_batch)
+                if not ours:
+                    break
+                page_end = tuple(ours[-1][:2])
+                theirs = {(k, i): ts for k, i, ts in self._versions(dst, table, last, page_end)}
+                stale = [
+                    (k, i)
+                    for k, i, ts in ours
+                    if (k, i) not in theirs or _newer(ts, theirs[(k, i)])
+                ]
+                if stale:
+                    n, b = self._copy_pass(src, dst, None, {table: stale})
+                    dst.connection.commit()
+                    rows, nbytes = rows + n, nbytes + b
+                last = page_end
+                if len(ours) < self.diff_batch:
+                    break
+        return rows, nbytes
+
+    def _final_sync(self, src, dst, phase):
+        for _ in range(self.max_catch_up):
+            rows, nbytes = self._sync(src, dst)
+            self._save(dst, phase, rows=rows)
+            self.log(f"[{self.migration_id}] diff: {rows:,} rows ({nbytes:,} bytes)")
+            if not rows:
+                return
+        raise MigrationError(
+            f"source rows still changing after {self.max_catch_up} diff passes; "
+            "are writers without PinWatcher still routing to the source?"
+        )
+
+    # ---------- verify / cleanup ----------
+
+    def _counts(self, cur):
+        counts = {}
+        for table in TABLE_ORDER:
+            cur.execute(
+                f"SELECT count(*) FROM {table} WHERE {KEY_COLUMN[table]} = ANY(%s);",
+                (self.room_ids,),
+            )
+            counts[table] = cur.fetchone()[0]
+        cur.connection.rollback()
+        return counts
+
+    def _verify(self, src, dst):
+        before, after = self._counts(src), self._counts(dst)
+        # the target may already hold new writes, but never fewer rows than the source
+        short = {t: (before[t], after[t]) for t in TABLE_ORDER if after[t] < before[t]}
+        if short:
+            raise MigrationError(f"target is missing rows (source, target): {short}")
+        return after
+
+    def _delete_source(self, src, dst):
+        """Delete the source rows the target holds at the same or a newer updated_at."""
+        deleted = 0
+        for table in reversed(TABLE_ORDER):
+            key = KEY_COLUMN[table]
+            for rid in self.room_ids:
+                last = -(1 << 63)
+                while True:
+                    t0 = time.monotonic()
+                    dst.execute(
+                        f"SELECT id, updated_at FROM {table} WHERE {key} = %s AND id > %s "
+                        "ORDER BY id LIMIT %s;",
+                        (rid, last, self.delete_batch),
+                    )
+                    copied = dst.fetchall()
+                    dst.connection.rollback()
+                    if not copied:
+                        break
+                    last = copied[-1][0]
+                    # one room at a time keeps every batch a single-shard statement
+                    src.execute(
+                        f"DELETE FROM {table} t WHERE t.{key} = %s AND EXISTS ("
+                        "SELECT 1 FROM unnest(%s::bigint[], %s::timestamptz[]) AS c(id, ts) "
+                        "WHERE c.id = t.id AND (t.updated_at IS NULL OR t.updated_at <= c.ts));",
+                        (rid, [i for i, _ in copied], [ts for _, ts in copied]),
+                    )
+                    n = src.rowcount
+                    src.connection.commit()
+                    deleted += n
+                    if self.delete_rows_per_s and n:
+                        pause = n / self.delete_rows_per_s - (time.monotonic() - t0)
+                        if pause > 0:
+                            time.sleep(pause)
+                    if len(copied) < self.delete_batch:
+                        break
+        return deleted
+
+    # ---------- driver ----------
+
+    def run(self):
+        """Run (or resume) the migration; returns {"phase", "rows_copied", "counts", "deleted"}."""
+        result = {"counts": None, "deleted": 0}
+        with self.src_pool.connection() as sconn, self.dst_pool.connection() as dconn:
+            with sconn.cursor() as src, dconn.cursor() as dst:
+                phase, watermark, _ = self._state(dst)
+                dconn.commit()
+                if phase != "copy":
+                    self.log(f"[{self.migration_id}] resuming at phase {phase}")
+
+                if phase == "copy":
+                    started = self._source_now(src)
+                    rows, nbytes = self._copy_pass(src, dst, None)
+                    watermark, phase = started, "catch_up"
+                    self._save(dst, phase, watermark, rows)
+                    self.log(f"[{self.migration_id}] copied {rows:,} rows ({nbytes:,} bytes)")
+
+                if phase == "catch_up":
+                    self._catch_up(src, dst, watermark, phase)
+                    phase = "flipped"
+                    self._save(dst, phase, flipped=True)
+
+                if phase == "flipped":
+                    # the flip is committed: writers may already be on the target, so
+                    # from here on a failure leaves it pinned and a re-run resumes here
+                    for rid in self.room_ids:
+                        self.router.pin(rid, self.target)
+                    # let PinWatchers see the flip and writes routed before it land
+                    time.sleep(self.settle_seconds)
+                    self._final_sync(src, dst, phase)
+                    result["counts"] = self._verify(src, dst)
+                    phase = "verified"
+                    self._save(dst, phase)
+                    self.log(f"[{self.migration_id}] verified: {result['counts']}")
+
+                if phase == "verified":
+                    for rid in self.room_ids:
+                        self.router.pin(rid, self.target)
+                    for _ in range(self.max_catch_up):
+                        result["deleted"] += self._delete_source(src, dst)
+                        left = {t: n for t, n in self._counts(src).items() if n}
+                        if not left:
+                            break
+                        # written to the source by a writer that had not seen the flip
+                        self.log(f"[{self.migration_id}] source rows left after delete: {left}")
+                        self._final_sync(src, dst, phase)
+                    else:
+                        raise MigrationError(
+                            f"source rows not on the target were left in place: {left}"
+                        )
+                    phase = "done"
+                    self._save(dst, phase)
+                    self.log(f"[{self.migration_id}] deleted {result['deleted']:,} source rows")
+
+                dst.execute(
+                    "SELECT rows_copied FROM tenant_migrations WHERE migration_id = %s;",
+                    (self.migration_id,),
+                )
+                result["rows_copied"] = dst.fetchone()[0]
+                dconn.rollback()
+        result["phase"] = phase
+        return result
+
+
+def main(argv):
+    from citus_sharding.tenant_router import TenantRouter
+
+    p = argparse.ArgumentParser(
+        prog="python -m citus_sharding.migrate",
+        description="Move rooms between active-active clusters without downtime.",
+    )
+    p.add_argument("--dsns", default=os.getenv("CITUS_DSNS", ""), help="'dsn1;dsn2;...'")
+    p.add_argument("--from", dest="source", required=True, help="source cluster name or index")
+    p.add_argument("--to", dest="target", required=True, help="target cluster name or index")
+    p.add_argument("--room", type=int, action="append", default=[], help="room id (repeatable)")
+    p.add_argument("--hash-range", type=int, nargs=2, metavar=("LO", "HI"))
+    p.add_argument("--id", dest="migration_id", help="migration id (to resume a run)")
+    p.add_argument("--max-mb-per-s", type=float, help="copy throughput cap")
+    p.add_argument("--delete-rows-per-s", type=float, help="source delete throughput cap")
+    args = p.parse_args(argv)
+
+    dsns = [d.strip() for d in args.dsns.split(";") if d.strip()]
+    if len(dsns) < 2:
+        p.error("need at least two clusters (--dsns or CITUS_DSNS)")
+    router = TenantRouter(dsns)
+    load_pins(router)
+
+    def cluster(value):
+        return int(value) if value.isdigit() else value
+
+    source, target = cluster(args.source), cluster(args.target)
+    rooms = list(args.room)
+    if args.hash_range:
+        with get_pool(router.dsns[router._index(source)]).connection() as conn:
+            with conn.cursor() as cur:
+                rooms += rooms_in_hash_range(cur, *args.hash_range)
+    if not rooms:
+        p.error("nothing to migrate (--room or --hash-range)")
+    migration = TenantMigration(
+        router,
+        source,
+        target,
+        rooms,
+        migration_id=args.migration_id,
+        max_bytes_per_s=args.max_mb_per_s * 1e6 if args.max_mb_per_s else None,
+        delete_rows_per_s=args.delete_rows_per_s,
+    )
+    result = migration.run()
+    print(f"{migration.migration_id}: {result['phase']}, {result['rows_copied']:,} rows copied")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
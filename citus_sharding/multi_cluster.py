@@ -0,0 +1,80 @@
+"""Run one job per cluster concurrently, each on its own connection.
+
+Every cluster gets its own pooled connection and transaction, so a failing or
+slow cluster never rolls back or holds up the commit of the others.
+"""
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from citus_sharding.pool import get_pool
+
+
+def _run_one(label, dsn, job, connect_timeout, metrics, stream=None):
+    t0 = time.perf_counter()
+    result = {"cluster": label, "ok": False, "error": None, "stats": {}}
+    try:
+        pool = get_pool(dsn, min_size=0, connect_timeout=connect_timeout)
+        # the pool rolls back (or evicts, on connection errors) if the job raises
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                result["stats"] = job(cur) or {}
+            conn.commit()
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}".strip()
+        result["traceback"] = traceback.format_exc()
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    result["seconds"] = time.perf_counter() - t0
+    if metrics is not None:
+        metrics.observe("phase_seconds", result["seconds"], phase="cluster_job", cluster=label)
+        if not result["ok"]:
+            metrics.inc("failures_total", cluster=label)
+    result["rows"] = sum(s.get("rows", 0) for s in result["stats"].values())
+    return result
+
+
+def run_clusters(jobs, concurrency=None, connect_timeout=10, metrics=None):
+    """Run `jobs` = [(label, dsn, job), ...] where job(cur) -> {table: stats}.
+
+    A job may carry a fourth element, the chunk stream it reads: it is
+    closed when the job ends, however it ends, so a cluster that fails
+    before reading its fan_out() stream (connect, bootstrap) does not stall
+    the producer feeding the other clusters.
+    `concurrency` caps how many clusters are driven at once (default: all).
+    With `metrics`, each job's duration and failures are recorded per cluster.
+    Returns (results, wall_seconds); results are in the order of `jobs`.
+    """
+    jobs = list(jobs)
+    workers = max(1, min(concurrency or len(jobs), len(jobs)))
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cluster") as pool:
+        futures = [
+            pool.submit(_run_one, label, dsn, job, connect_timeout, metrics, *rest)
+            for label, dsn, job, *rest in jobs
+        ]
+        results = [f.result() for f in futures]
+    return results, time.perf_counter() - t0
+
+
+def format_report(results, wall_seconds):
+    lines = []
+    for r in results:
+        if r["ok"]:
+            rate = r["rows"] / r["seconds"] if r["seconds"] > 0 else 0.0
+            lines.append(
+                f"{r['cluster']}: {r['rows']:,} rows in {r['seconds']:.2f}s ({rate:,.0f} rows/s)"
+            )
+        else:
+            lines.append(f"{r['cluster']}: FAILED after {r['seconds']:.2f}s - {r['error']}")
+    total = sum(r["rows"] for r in results if r["ok"])
+    ok = sum(1 for r in results if r["ok"])
+    rate = total / wall_seconds if wall_seconds > 0 else 0.0
+    lines.append(
+        f"All clusters: {total:,} rows in {wall_seconds:.2f}s wall ({rate:,.0f} rows/s), "
+        f"{ok}/{len(results)} succeeded"
+    )
+    return "\n".join(lines)
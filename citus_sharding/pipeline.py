@@ -0,0 +1,266 @@
+"""Bounded-memory row pipelines for the loaders.
+
+Rows are produced lazily in chunks of `chunk_rooms` rooms (each chunk is a
+datagen column batch holding the rooms plus their members and messages), so
+peak memory is O(chunk) instead of O(dataset). prefetch() / fan_out() run the
+producer on a background thread behind a bounded queue, so generating the
+next chunk overlaps with COPYing the current one.
+"""
+import queue
+import threading
+from collections import deque
+
+from citus_sharding.copy_loader import BATCH, column_rows, copy_columns
+from citus_sharding.datagen import ChatDataGen, fixed
+
+TABLE_ORDER = ("rooms", "room_members", "messages")
+# Distribution column (room id) of each table
+KEY_COLUMN = {"rooms": "id", "room_members": "room_id", "messages": "room_id"}
+
+_DONE = object()
+
+
+def room_chunks(
+    n_rooms, seed, chunk_rooms=BATCH, now=None, members=None, messages=None, ids=None
+):
+    """Yield column batches ({table: {column: [values]}}) for `chunk_rooms` rooms at a time.
+
+    members / messages are datagen count distributions (default 2 and 1 per room);
+    `ids` is an optional ids.IdAllocator for member / message ids.
+    """
+    gen = ChatDataGen(
+        seed,
+        members=members or fixed(2),
+        messages=messages or fixed(1),
+        now=now,
+        ids=ids,
+    )
+    return gen.chunks(n_rooms, chunk_rooms)
+
+
+def split_chunk(chunk, route):
+    """Split one column batch by route(room_id) -> {bucket: column batch}."""
+    out = {}
+    memo = {}
+    for table, cols in chunk.items():
+        positions = {}
+        for i, key in enumerate(cols[KEY_COLUMN[table]]):
+            b = memo.get(key)
+            if b is None:
+                b = memo[key] = route(key)
+            positions.setdefault(b, []).append(i)
+        for b, idx in positions.items():
+            part = out.setdefault(b, {})
+            part[table] = {c: [vals[i] for i in idx] for c, vals in cols.items()}
+    return out
+
+
+def by_shard_group(chunks, router):
+    """Re-chunk so every chunk holds a single shard group (see ShardRouter)."""
+    for chunk in chunks:
+        for _, part in sorted(split_chunk(chunk, router.group_index).items()):
+            yield part
+
+
+def _produce(iterable, queues, route, abandoned):
+    def put(i, item):
+        while not abandoned[i]:
+            try:
+                queues[i].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    try:
+        for chunk in iterable:
+            if route is None:
+                put(0, chunk)
+            else:
+                for b, part in split_chunk(chunk, route).items():
+                    put(b, part)
+            if all(abandoned):
+                return
+    except BaseException as e:  # hand the producer's error to every consumer
+        for i in range(len(queues)):
+            put(i, e)
+        return
+    finally:
+        # run the source's cleanup (e.g. a generator holding a connection) here
+        close = getattr(iterable, "close", None)
+        if close is not None:
+            close()
+    for i in range(len(queues)):
+        put(i, _DONE)
+
+
+class _Stream:
+    """One fan_out() output stream.
+
+    close(), an error from the producer, or dropping the stream marks it
+    abandoned, even if it was never iterated, so the producer stops
+    feeding it instead of waiting on its full queue.
+    """
+
+    def __init__(self, q, abandoned, i):
+        self._q = q
+        self._abandoned = abandoned
+        self._i = i
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        item = self._q.get()
+        if item is _DONE:
+            self.close()
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self.close()
+            raise item
+        return item
+
+    def close(self):
+        self._closed = True
+        self._abandoned[self._i] = True
+
+    def __del__(self):
+        self.close()
+
+
+def prefetch(iterable, depth=4):
+    """Iterate `iterable` on a background thread, at most `depth` items ahead."""
+    return fan_out(iterable, None, 1, depth)[0]
+
+
+def fan_out(iterable, route, n, depth=4):
+    """Split a chunk stream into `n` bounded streams by route(room_id) -> 0..n-1.
+
+    All `n` streams must be consumed at the same time: the single producer
+    blocks on the first full queue, so reading the streams one after another
+    deadlocks (use split_streams(..., concurrent=False) for that). Consumers
+    that stop early (close(), error, or never started and dropped) are
+    skipped, so one dead consumer does not stall the others.
+    """
+    queues = [queue.Queue(maxsize=depth) for _ in range(n)]
+    abandoned = [False] * n
+    threading.Thread(
+        target=_produce,
+        args=(iterable, queues, route, abandoned),
+        name="row-producer",
+        daemon=True,
+    ).start()
+    return [_Stream(q, abandoned, i) for i, q in enumerate(queues)]
+
+
+def partition(chunks, route, bucket):
+    """Only the rows of `chunks` with route(room_id) == bucket, chunk by chunk."""
+    try:
+        for chunk in chunks:
+            part = split_chunk(chunk, route).get(bucket)
+            if part:
+                yield part
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def split_streams(make_chunks, route, n, concurrent=True, depth=4):
+    """`n` chunk streams by route(room_id); make_chunks() returns a fresh chunk iterator.
+
+    concurrent=True feeds every stream from one producer (fan_out), which
+    needs all streams read at once. Otherwise each stream runs its own
+    producer over its own make_chunks() and keeps only its bucket, so the
+    streams can be read in any order (at the cost of generating n times).
+    """
+    if concurrent:
+        return fan_out(make_chunks(), route, n, depth)
+    return [prefetch(partition(make_chunks(), route, i), depth) for i in range(n)]
+
+
+def concat_columns(parts):
+    """Concatenate column batches of one table into a single batch."""
+    if len(parts) == 1:
+        return parts[0]
+    return {c: [v for p in parts for v in p[c]] for c in parts[0]}
+
+
+def slice_columns(cols, start, stop):
+    return {c: vals[start:stop] for c, vals in cols.items()}
+
+
+def _add(totals, table, st):
+    tot = totals[table]
+    tot["rows"] += st["rows"]
+    tot["bytes"] += st["bytes"]
+    tot["seconds"] += st["seconds"]
+
+
+def copy_chunks(cur, chunks, fmt="text", batcher=None, metrics=None):
+    """COPY every column batch table by table.
+
+    Returns per-table totals: {table: {"rows", "bytes", "seconds", "rows_per_s"}}.
+
+    With a batching.AdaptiveBatcher, rows are re-batched per table into COPYs
+    of batcher.next_size(table) rows, independent of the generator's chunking.
+    Every COPY is recorded in `metrics` (a metrics.Metrics) when given.
+    """
+    totals = {t: {"rows": 0, "bytes": 0, "seconds": 0.0} for t in TABLE_ORDER}
+    # not yet copied: whole batches, the first one read from offset[table] on
+    pending = {t: deque() for t in TABLE_ORDER}
+    offset = dict.fromkeys(TABLE_ORDER, 0)
+    pending_rows = dict.fromkeys(TABLE_ORDER, 0)
+
+    def record(table, st):
+        _add(totals, table, st)
+        if metrics is not None:
+            metrics.observe_batch(table, st["rows"], st["bytes"], st["seconds"])
+
+    def flush(table, size):
+        # only the rows being copied are sliced and joined, so each pending
+        # row is touched once however many flushes it waits through
+        parts, queued, need = [], pending[table], min(size, pending_rows[table])
+        while need:
+            cols, start = queued[0], offset[table]
+            n = column_rows(cols, table)
+            stop = min(n, start + need)
+            parts.append(cols if start == 0 and stop == n else slice_columns(cols, start, stop))
+            need -= stop - start
+            if stop == n:
+                queued.popleft()
+                offset[table] = 0
+            else:
+                offset[table] = stop
+        st = copy_columns(cur, table, concat_columns(parts), fmt)
+        batcher.observe(table, st["rows"], st["bytes"], st["seconds"])
+        record(table, st)
+        pending_rows[table] -= st["rows"]
+
+    try:
+        for chunk in chunks:
+            for table in TABLE_ORDER:
+                cols = chunk.get(table)
+                if not cols or not column_rows(cols, table):
+                    continue
+                if batcher is None:
+                    record(table, copy_columns(cur, table, cols, fmt))
+                    continue
+                pending[table].append(cols)
+                pending_rows[table] += column_rows(cols, table)
+                while pending_rows[table] >= batcher.next_size(table):
+                    flush(table, batcher.next_size(table))
+        if batcher is not None:
+            for table in TABLE_ORDER:
+                while pending_rows[table]:
+                    flush(table, batcher.next_size(table))
+    finally:
+        # let a fan_out() producer stop feeding us if we bailed out early
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    for tot in totals.values():
+        tot["rows_per_s"] = tot["rows"] / tot["seconds"] if tot["seconds"] > 0 else 0.0
+    return totals
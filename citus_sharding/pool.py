@@ -0,0 +1,271 @@
+"""Per-cluster psycopg2 connection pools.
+
+One ConnectionPool per DSN (get_pool() keeps a process-wide registry, so
+CITUS_DSN_A, CITUS_DSN_B and the HAProxy CITUS_DSN each get their own). Pools
+cap open connections at max_size, keep min_size warm, ping a connection on
+checkout when it has been idle for more than `validate_idle` seconds (outside
+the pool lock, bounded by `validate_timeout` via statement_timeout), retire
+connections older than `max_lifetime`, and drop every idle connection after a
+connection-level error (a Patroni failover kills all sessions at once).
+
+stats() exposes checkout counts, wait time and utilization.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE,
+    TRANSACTION_STATUS_UNKNOWN,
+)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection became available within the checkout timeout."""
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        dsn,
+        min_size=1,
+        max_size=10,
+        max_lifetime=1800.0,
+        validate_idle=5.0,
+        validate_timeout=2.0,
+        timeout=30.0,
+        **connect_kwargs,
+    ):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("need 1 <= max_size and min_size <= max_size")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.validate_idle = validate_idle
+        self.validate_timeout = validate_timeout
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, returned_at, generation)]
+        self._in_use = {}  # id(conn) -> (created_at, generation)
+        self._generation = 0
+        self._closed = False
+        self._counters = {
+            "created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "timeouts": 0,
+            "evicted_broken": 0,
+            "evicted_lifetime": 0,
+            "failed_validation": 0,
+            "invalidations": 0,
+        }
+        for _ in range(min_size):
+            conn = self._new_conn()
+            self._idle.append((conn, time.monotonic(), time.monotonic(), self._generation))
+
+    def _new_conn(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        self._counters["created"] += 1
+        return conn
+
+    def _usable(self, conn, created, generation, now):
+        if conn.closed or generation != self._generation:
+            self._counters["evicted_broken"] += 1
+            return False
+        if now - created > self.max_lifetime:
+            self._counters["evicted_lifetime"] += 1
+            return False
+        return True
+
+    def _ping(self, conn):
+        # called without the pool lock; statement_timeout bounds a stuck server
+        # (pass tcp_user_timeout / keepalives in connect_kwargs for a dead network)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SET LOCAL statement_timeout = %s; SELECT 1;",
+                    (int(self.validate_timeout * 1000),),
+                )
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a live connection, waiting up to `timeout` seconds if the pool is full."""
+        timeout = self.timeout if timeout is None else timeout
+        t0 = time.monotonic()
+        waited = False
+        while True:
+            stale = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.InterfaceError("pool is closed")
+                    now = time.monotonic()
+                    while self._idle:
+                        conn, created, returned, gen = self._idle.pop()
+                        if not self._usable(conn, created, gen, now):
+                            _close_quietly(conn)
+                            continue
+                        if now - returned <= self.validate_idle:
+                            self._checked_out(conn, created, gen, t0, waited)
+                            return conn
+                        # idle too long: keep its slot while it is pinged below
+                        self._in_use[id(conn)] = (created, gen)
+                        stale = conn
+                        break
+                    if stale is not None or len(self._in_use) < self.max_size:
+                        break
+                    remaining = timeout - (now - t0)
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"no connection available after {timeout:.1f}s "
+                            f"({len(self._in_use)}/{self.max_size} in use)"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+                if stale is None:
+                    # reserve the slot before connecting outside the lock
+                    placeholder = object()
+                    self._in_use[id(placeholder)] = (now, self._generation)
+                    gen = self._generation
+            if stale is not None:
+                ok = self._ping(stale)
+                with self._cond:
+                    if ok and gen == self._generation and not self._closed:
+                        self._checked_out(stale, created, gen, t0, waited)
+                        return stale
+                    del self._in_use[id(stale)]
+                    self._counters["failed_validation" if not ok else "evicted_broken"] += 1
+                    self._cond.notify()
+                _close_quietly(stale)
+                continue
+            try:
+                conn = self._new_conn()
+            except BaseException:
+                with self._cond:
+                    del self._in_use[id(placeholder)]
+                    self._cond.notify()
+                raise
+            with self._cond:
+                del self._in_use[id(placeholder)]
+                self._checked_out(conn, time.monotonic(), gen, t0, waited)
+            return conn
+
+    def _checked_out(self, conn, created, gen, t0, waited):
+        self._in_use[id(conn)] = (created, gen)
+        c = self._counters
+        c["checkouts"] += 1
+        if waited:
+            w = time.monotonic() - t0
+            c["waits"] += 1
+            c["wait_seconds"] += w
+            c["max_wait_seconds"] = max(c["max_wait_seconds"], w)
+
+    def putconn(self, conn, broken=False):
+        """Return a connection; broken=True (or a dead/unknown-state one) closes it."""
+        with self._cond:
+            created, gen = self._in_use.pop(id(conn), (time.monotonic(), -1))
+            keep = not (broken or self._closed or conn.closed or gen != self._generation)
+            if keep:
+                status = conn.get_transaction_status()
+                if status == TRANSACTION_STATUS_UNKNOWN:
+                    keep = False
+                elif status != TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        keep = False
+            if keep:
+                self._idle.append((conn, created, time.monotonic(), gen))
+            else:
+                self._counters["evicted_broken"] += 1
+                _close_quietly(conn)
+            self._cond.notify()
+
+    def invalidate(self):
+        """Drop all idle connections; in-use ones are closed when returned."""
+        with self._cond:
+            self._generation += 1
+            self._counters["invalidations"] += 1
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, *_ in idle:
+            _close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """with pool.connection() as conn: ... (commit is up to the caller)."""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # session-level failure: likely failover, so nothing idle is trustworthy
+            self.putconn(conn, broken=True)
+            self.invalidate()
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._counters)
+            out["idle"] = len(self._idle)
+            out["in_use"] = len(self._in_use)
+            out["size"] = out["idle"] + out["in_use"]
+            out["max_size"] = self.max_size
+            out["utilization"] = out["in_use"] / self.max_size
+            return out
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, *_ in idle:
+            _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn, **kwargs):
+    """Process-wide pool for `dsn` (kwargs only apply when it is first created)."""
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = _pools[dsn] = ConnectionPool(dsn, **kwargs)
+        return pool
+
+
+def all_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {dsn: p.stats() for dsn, p in pools.items()}
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for p in pools:
+        p.close()
@@ -0,0 +1,213 @@
+"""Read/write splitting between the Patroni leader and its hot standbys.
+
+HAProxy exposes the leader on :5000 (postgres_write) and every standby that
+is within the replication-lag limit on :5001 (postgres_read). A
+ReadWriteRouter holds both DSNs; each client session gets a Session that
+sends writes to the leader and read-only statements to the standbys, with
+read-your-writes: after a session writes, its reads stay on the leader for
+`sticky_seconds`, and after that go to a standby only once the standby has
+replayed the WAL position of the session's last write. If the read endpoint
+is down (no healthy standby), reads fall back to the leader.
+
+is_read_only() is deliberately conservative: anything it is unsure about is
+treated as a write and goes to the leader. A read may only call functions on
+the SAFE_FUNCTIONS allow-list (a SELECT can call anything: nextval,
+pg_advisory_lock, set_config, citus_add_node, ...), must be a single
+statement, and may not use quoted or schema-qualified (other than
+pg_catalog) function names. For any other read that is safe on a standby,
+use Session.read() directly.
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+from citus_sharding.pool import get_pool
+
+READ_VERBS = ("SELECT", "WITH", "SHOW", "EXPLAIN", "VALUES", "TABLE")
+
+_LEADING_COMMENTS = re.compile(r"^(\s*(--[^\n]*\n|/\*.*?\*/))*\s*", re.S)
+# Functions a standby can run without side effects
+SAFE_FUNCTIONS = frozenset(
+    """
+    count sum min max avg bool_and bool_or every array_agg string_agg json_agg jsonb_agg
+    json_object_agg jsonb_object_agg stddev stddev_pop stddev_samp variance var_pop
+    var_samp percentile_cont percentile_disc mode
+    row_number rank dense_rank percent_rank cume_dist ntile lag lead first_value
+    last_value nth_value
+    coalesce nullif greatest least abs round floor ceil ceiling trunc mod power sqrt
+    lower upper length char_length octet_length substring substr trim btrim ltrim rtrim
+    concat concat_ws replace split_part left right position strpos starts_with format
+    md5 regexp_replace regexp_match regexp_matches to_char to_number to_date
+    to_timestamp date_trunc date_part extract age make_interval now statement_timestamp
+    clock_timestamp timezone unnest generate_series array_length cardinality
+    array_position array_to_string string_to_array to_json to_jsonb json_build_object
+    jsonb_build_object json_build_array jsonb_build_array jsonb_extract_path_text
+    jsonb_array_length hashint8 hashtext pg_last_wal_replay_lsn
+    """.split()
+)
+# Keywords and type names that come before a "(" without being a function call
+_NOT_CALLS = frozenset(
+    """
+    select from where join lateral on using and or not in exists any all some as with
+    values explain over filter within group by order partition having union intersect
+    except case when then else row array cast is between like ilike distinct limit
+    offset recursive materialized numeric decimal varchar char character timestamp
+    timestamptz time interval bit
+    """.split()
+)
+_CALL = re.compile(r'([\w$."]+)\s*\(')
+_WRITE_WORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CREATE|ALTER|DROP|GRANT|REVOKE|COPY|CALL"
+    r"|VACUUM|ANALYZE|REINDEX|CLUSTER|LOCK|REFRESH|COMMENT|INTO|NEXTVAL|SETVAL"
+    r"|FOR\s+(NO\s+KEY\s+)?UPDATE|FOR\s+(KEY\s+)?SHARE)\b",
+    re.I,
+)
+
+
+def _safe_call(name):
+    if '"' in name:
+        return False
+    schema, _, func = name.lower().rpartition(".")
+    if schema:
+        return schema == "pg_catalog" and func in SAFE_FUNCTIONS
+    return func in SAFE_FUNCTIONS or func in _NOT_CALLS
+
+
+def is_read_only(sql):
+    """True if `sql` can safely run on a standby."""
+    body = _LEADING_COMMENTS.sub("", sql, count=1).lstrip("(")
+    words = body.split(None, 1)
+    if not words or words[0].upper().rstrip(";") not in READ_VERBS:
+        return False
+    if ";" in body.rstrip().rstrip(";"):
+        return False  # more than one statement
+    if _WRITE_WORDS.search(body):
+        return False
+    return all(_safe_call(name) for name in _CALL.findall(body))
+
+
+class ReadWriteRouter:
+    def __init__(self, write_dsn, read_dsn=None, sticky_seconds=1.0, connect_timeout=5):
+        self.write_dsn = write_dsn
+        self.read_dsn = read_dsn
+        self.sticky_seconds = sticky_seconds
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._counters = {
+            "writes": 0,
+            "reads_standby": 0,
+            "reads_leader": 0,
+            "sticky": 0,
+            "behind": 0,
+            "fallbacks": 0,
+        }
+
+    def session(self):
+        return Session(self)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _pool(self, dsn):
+        return get_pool(dsn, min_size=0, connect_timeout=self.connect_timeout)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class Session:
+    """One client's view: use it from a single thread."""
+
+    def __init__(self, router):
+        self.router = router
+        self._lsn = None  # leader WAL position after this session's last write
+        self._written_at = 0.0
+
+    def observe_write(self, cur):
+        """Record a write done on `cur` (a leader connection outside this session)."""
+        cur.execute("SELECT pg_current_wal_lsn()::text;")
+        self._lsn = cur.fetchone()[0]
+        self._written_at = time.monotonic()
+
+    @contextmanager
+    def write(self):
+        """Cursor on the leader; commits on success and records the WAL position."""
+        with self.router._pool(self.router.write_dsn).connection() as conn:
+            with conn.cursor() as cur:
+                yield cur
+                conn.commit()
+                self.observe_write(cur)
+            conn.rollback()
+        self.router._count("writes")
+
+    def _standby_conn(self):
+        """A standby connection that has caught up with this session, or None."""
+        r = self.router
+        if r.read_dsn is None:
+            return None
+        if self._lsn is not None and time.monotonic() - self._written_at < r.sticky_seconds:
+            r._count("sticky")
+            return None
+        pool = r._pool(r.read_dsn)
+        try:
+            conn = pool.getconn()
+        except psycopg2.OperationalError:
+            r._count("fallbacks")
+            return None
+        if self._lsn is None:
+            return conn
+        try:
+            with conn.cursor() as cur:
+                # NULL replay position means HAProxy handed us a primary
+                cur.execute(
+                    "SELECT coalesce(pg_last_wal_replay_lsn() >= %s::pg_lsn, true);",
+                    (self._lsn,),
+                )
+                caught_up = cur.fetchone()[0]
+            conn.rollback()
+        except psycopg2.OperationalError:
+            pool.putconn(conn, broken=True)
+            r._count("fallbacks")
+            return None
+        if not caught_up:
+            pool.putconn(conn)
+            r._count("behind")
+            return None
+        self._lsn = None
+        return conn
+
+    @contextmanager
+    def read(self):
+        """Cursor on a caught-up standby, else on the leader."""
+        conn = self._standby_conn()
+        if conn is None:
+            self.router._count("reads_leader")
+            with self.router._pool(self.router.write_dsn).connection() as leader:
+                with leader.cursor() as cur:
+                    yield cur
+            return
+        self.router._count("reads_standby")
+        pool = self.router._pool(self.router.read_dsn)
+        try:
+            with conn.cursor() as cur:
+                yield cur
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pool.putconn(conn, broken=True)
+            pool.invalidate()
+            raise
+        except BaseException:
+            pool.putconn(conn)
+            raise
+        pool.putconn(conn)
+
+    def execute(self, sql, params=None):
+        """Run one statement where it belongs; rows for queries, rowcount otherwise."""
+        ctx = self.read() if is_read_only(sql) else self.write()
+        with ctx as cur:
+            cur.execute(sql, params)
+            return cur.fetchall() if cur.description is not None else cur.rowcount
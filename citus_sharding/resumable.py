@@ -0,0 +1,250 @@
+"""Failover-tolerant, resumable loading through the Patroni/HAProxy endpoint.
+
+HAProxy kills client sessions when the Patroni leader changes
+(on-marked-down shutdown-sessions), so one long load transaction loses
+everything on a switchover. ResumableLoader instead commits every generated
+chunk in its own transaction, together with a row in load_checkpoints that
+records the last committed chunk per table. When the connection drops, it
+reconnects with exponential backoff (HAProxy sends it to the new leader),
+reads the checkpoint and carries on from the next chunk.
+
+Chunks must be reproducible (datagen is seeded), so a restart regenerates
+and skips the chunks that are already committed. Rows go through a temp
+staging table and INSERT ... ON CONFLICT DO NOTHING on the tables' primary
+keys, so replaying a chunk whose commit outcome was lost is harmless.
+
+load_checkpoints is a plain coordinator table: Patroni replicates it with
+the rest of the coordinator, and it commits atomically with the chunk. A
+finished load is marked completed, so running it again is reported as
+already complete rather than silently loading nothing; whoever TRUNCATEs
+the tables should clear_checkpoint() in the same transaction.
+"""
+import random
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from citus_sharding.copy_loader import COLUMNS, column_rows, copy_columns
+from citus_sharding.pipeline import TABLE_ORDER
+
+CHECKPOINT_DDL = """
+CREATE TABLE IF NOT EXISTS load_checkpoints (
+  load_id TEXT NOT NULL,
+  table_name TEXT NOT NULL,
+  last_batch BIGINT NOT NULL,
+  rows BIGINT NOT NULL DEFAULT 0,
+  completed BOOLEAN NOT NULL DEFAULT false,
+  updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (load_id, table_name)
+);
+"""
+
+RETRYABLE = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def read_checkpoint(cur, load_id):
+    """{table: (last_batch, rows, completed)} for `load_id`; {} if nothing was committed yet.
+
+    A checkpoint that counted rows into a table that is empty now (TRUNCATEd
+    behind the loader's back) is stale: it is deleted and {} returned, so the
+    load starts over instead of skipping every chunk.
+    """
+    cur.execute("SELECT to_regclass('load_checkpoints') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return {}
+    cur.execute(
+        "SELECT table_name, last_batch, rows, completed FROM load_checkpoints "
+        "WHERE load_id = %s;",
+        (load_id,),
+    )
+    ckpt = {t: (int(b), int(r), bool(c)) for t, b, r, c in cur.fetchall()}
+    for table, (_, rows, _) in ckpt.items():
+        if rows and table in TABLE_ORDER:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table});")
+            if not cur.fetchone()[0]:
+                clear_checkpoint(cur, load_id)
+                return {}
+    return ckpt
+
+
+def checkpoint_complete(ckpt):
+    """True if a read_checkpoint() result belongs to a finished load."""
+    return bool(ckpt) and all(c for _, _, c in ckpt.values())
+
+
+def clear_checkpoint(cur, load_id=None):
+    """Forget `load_id`'s checkpoint (every load's when None), e.g. after a TRUNCATE."""
+    cur.execute("SELECT to_regclass('load_checkpoints') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return
+    if load_id is None:
+        cur.execute("DELETE FROM load_checkpoints;")
+    else:
+        cur.execute("DELETE FROM load_checkpoints WHERE load_id = %s;", (load_id,))
+
+
+class ResumableLoader:
+    def __init__(
+        self,
+        dsn,
+        load_id,
+        fmt="text",
+        max_retries=30,
+        backoff_initial=0.5,
+        backoff_max=15.0,
+        connect_timeout=5,
+        log=print,
+        metrics=None,
+        cache=None,
+    ):
+        self.dsn = dsn
+        self.load_id = load_id
+        self.fmt = fmt
+        self.max_retries = max_retries
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.log = log
+        self.metrics = metrics
+        self.cache = cache
+        self.reconnects = 0
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+        with conn.cursor() as cur:
+            # HAProxy can briefly route to a node that is still a standby
+            cur.execute("SELECT pg_is_in_recovery();")
+            if cur.fetchone()[0]:
+                conn.close()
+                raise psycopg2.OperationalError("connected to a standby; leader not ready")
+            cur.execute(CHECKPOINT_DDL)
+            for table in TABLE_ORDER:
+                cur.execute(
+                    f"CREATE TEMP TABLE IF NOT EXISTS _stage_{table} "
+                    f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;"
+                )
+        conn.commit()
+        return conn
+
+    def _write_chunk(self, conn, index, chunk, totals):
+        counts = {}
+        with conn.cursor() as cur:
+            for table in TABLE_ORDER:
+                cols = chunk.get(table)
+                if not cols or not column_rows(cols, table):
+                    continue
+                stage = f"_stage_{table}"
+                st = copy_columns(cur, table, cols, self.fmt, stage)
+                if self.metrics is not None:
+                    self.metrics.observe_batch(table, st["rows"], st["bytes"], st["seconds"])
+                names = ", ".join(COLUMNS[table])
+                cur.execute(
+                    f"INSERT INTO {table} ({names}) SELECT {names} FROM {stage} "
+                    "ON CONFLICT DO NOTHING;"
+                )
+                counts[table] = cur.rowcount
+            execute_values(
+                cur,
+                """
+              INSERT INTO load_checkpoints (load_id, table_name, last_batch, rows) VALUES %s
+              ON CONFLICT (load_id, table_name) DO UPDATE
+                SET last_batch = EXCLUDED.last_batch,
+                    rows = load_checkpoints.rows + EXCLUDED.rows,
+                    updated_at = CURRENT_TIMESTAMP
+            """,
+                [(self.load_id, t, index, counts.get(t, 0)) for t in TABLE_ORDER],
+            )
+        if self.metrics is None:
+            conn.commit()
+        else:
+            with self.metrics.phase("commit"):
+                conn.commit()
+        for t, n in counts.items():
+            totals[t] += n
+
+    def _mark_complete(self, conn):
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+              INSERT INTO load_checkpoints (load_id, table_name, last_batch, completed)
+              VALUES %s
+              ON CONFLICT (load_id, table_name) DO UPDATE
+                SET completed = true, updated_at = CURRENT_TIMESTAMP
+            """,
+                [(self.load_id, t, -1, True) for t in TABLE_ORDER],
+            )
+        conn.commit()
+
+    def run(self, make_chunks):
+        """Load the chunks from make_chunks() (called again after every reconnect).
+
+        Returns {"tables": {table: rows inserted by this run}, "resumed_from",
+        "reconnects", "batches", "already_complete"}; a load_id that already
+        finished loads nothing and comes back with already_complete=True.
+        """
+        totals = dict.fromkeys(TABLE_ORDER, 0)
+        failures = 0
+        resumed_from = None
+        batches = 0
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    ckpt = read_checkpoint(cur, self.load_id)
+                conn.commit()
+                if checkpoint_complete(ckpt) and resumed_from is None:
+                    conn.close()
+                    self.log(
+                        f"Load {self.load_id!r} is already complete "
+                        f"({sum(r for _, r, _ in ckpt.values()):,} rows); nothing to load"
+                    )
+                    return {
+                        "tables": totals,
+                        "resumed_from": None,
+                        "reconnects": self.reconnects,
+                        "batches": 0,
+                        "already_complete": True,
+                    }
+                # every table is checkpointed in the same transaction
+                done = min((b for b, _, _ in ckpt.values()), default=-1)
+                if resumed_from is None:
+                    resumed_from = done + 1
+                if ckpt:
+                    self.log(f"Resuming load {self.load_id!r} after batch {done}")
+                for index, chunk in enumerate(make_chunks()):
+                    if index <= done:
+                        continue
+                    self._write_chunk(conn, index, chunk, totals)
+                    if self.cache is not None:
+                        self.cache.apply(chunk)
+                    batches += 1
+                    failures = 0
+                self._mark_complete(conn)
+                conn.close()
+                return {
+                    "tables": totals,
+                    "resumed_from": resumed_from,
+                    "reconnects": self.reconnects,
+                    "batches": batches,
+                    "already_complete": False,
+                }
+            except RETRYABLE as e:
+                if conn is not None and not conn.closed:
+                    conn.close()
+                failures += 1
+                if failures > self.max_retries:
+                    raise
+                self.reconnects += 1
+                if self.metrics is not None:
+                    self.metrics.inc("retries_total", op="load")
+                    self.metrics.inc("reconnects_total")
+                delay = min(self.backoff_max, self.backoff_initial * 2 ** (failures - 1))
+                delay *= random.uniform(0.5, 1.0)
+                self.log(
+                    f"Connection lost ({type(e).__name__}: {str(e).strip()}); "
+                    f"retry {failures}/{self.max_retries} in {delay:.1f}s"
+                )
+                time.sleep(delay)
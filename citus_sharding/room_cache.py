@@ -0,0 +1,253 @@
+"""Read-through cache for hot rooms: room row, member ids, last N messages.
+
+RoomCache sits in front of rooms / room_members / messages. Misses run one
+query (routed to the room's cluster or through a read/write Session) and
+store the result in a backend; concurrent misses on the same key are
+coalesced into a single query. Recent messages are kept per room as a
+newest-first buffer of at most `recent` rows.
+
+apply(chunk) takes the column batches the loaders write ({table: {column:
+[values]}}): new messages are merged into cached buffers, room and
+membership entries are invalidated. ShardWriter and ResumableLoader call it
+after each commit when given a cache.
+
+MemoryBackend is a bounded LRU with TTL. Any object with get(key) ->
+value-or-MISSING, set(key, value), delete(key) and stats() can replace it.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from citus_sharding.copy_loader import COLUMNS
+from citus_sharding.pool import get_pool
+
+MISSING = object()
+
+MESSAGE_COLUMNS = COLUMNS["messages"]
+_CREATED_AT = MESSAGE_COLUMNS.index("created_at")
+
+
+def _sizeof(value):
+    """Rough deep size in bytes of tuples / lists / scalars."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(_sizeof(v) for v in value)
+    return size
+
+
+class MemoryBackend:
+    """In-process LRU with a per-entry TTL and an entry limit."""
+
+    def __init__(self, max_entries=10_000, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                return MISSING
+            self._data.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value):
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def _drop(self, key):
+        self._bytes -= self._data.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RoomCache:
+    def __init__(self, execute, backend=None, recent=50):
+        """`execute(room_id, sql, params) -> rows` runs a read for one room."""
+        self.execute = execute
+        self.backend = backend or MemoryBackend()
+        self.recent = recent
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._epoch = 0  # bumped on every invalidation; stale loads are not stored
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+
+    @classmethod
+    def for_router(cls, router, **kwargs):
+        """Read each room from its cluster in a tenant_router.TenantRouter."""
+
+        def execute(room_id, sql, params):
+            with get_pool(router.dsn_for(room_id)).connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    rows = cur.fetchall()
+                conn.rollback()
+            return rows
+
+        return cls(execute, **kwargs)
+
+    @classmethod
+    def for_session(cls, session, **kwargs):
+        """Read through a read_write.Session (standbys, with read-your-writes)."""
+        return cls(lambda room_id, sql, params: session.execute(sql, params), **kwargs)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _get(self, key, load):
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self._count("hits")
+            return value
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                epoch = self._epoch
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = load()
+            with self._lock:
+                fresh = epoch == self._epoch
+            if fresh:
+                self.backend.set(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    # ---------- reads ----------
+
+    def room(self, room_id):
+        """(id, room_type, created_at, updated_at) or None."""
+
+        def load():
+            rows = self.execute(
+                room_id,
+                f"SELECT {', '.join(COLUMNS['rooms'])} FROM rooms WHERE id = %s;",
+                (room_id,),
+            )
+            return tuple(rows[0]) if rows else None
+
+        return self._get(("room", room_id), load)
+
+    def members(self, room_id):
+        """Sorted member ids of the room."""
+
+        def load():
+            rows = self.execute(
+                room_id,
+                "SELECT member_id FROM room_members WHERE room_id = %s ORDER BY member_id;",
+                (room_id,),
+            )
+            return tuple(m for m, in rows)
+
+        return self._get(("members", room_id), load)
+
+    def recent_messages(self, room_id, n=None):
+        """Up to n (default `recent`) newest messages, newest first, as MESSAGE_COLUMNS tuples."""
+        n = self.recent if n is None else min(n, self.recent)
+
+        def load():
+            rows = self.execute(
+                room_id,
+                f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages WHERE room_id = %s "
+                "ORDER BY created_at DESC, id DESC LIMIT %s;",
+                (room_id, self.recent),
+            )
+            return tuple(tuple(r) for r in rows)
+
+        return self._get(("messages", room_id), load)[:n]
+
+    # ---------- writes ----------
+
+    def invalidate_room(self, room_id):
+        with self._lock:
+            self._epoch += 1
+            self._counters["invalidations"] += 1
+        for kind in ("room", "members", "messages"):
+            self.backend.delete((kind, room_id))
+
+    def apply(self, chunk):
+        """Reflect a committed column batch: merge new messages, invalidate the rest."""
+        with self._lock:
+            self._epoch += 1
+        stale = set(chunk.get("rooms", {}).get("id", ()))
+        stale.update(chunk.get("room_members", {}).get("room_id", ()))
+        for room_id in stale:
+            self.backend.delete(("room", room_id))
+            self.backend.delete(("members", room_id))
+        if stale:
+            self._count("invalidations", len(stale))
+
+        cols = chunk.get("messages")
+        if not cols or not cols.get("room_id"):
+            return
+        new = defaultdict(list)
+        for row in zip(*(cols[c] for c in MESSAGE_COLUMNS)):
+            new[row[1]].append(row)
+        for room_id, rows in new.items():
+            key = ("messages", room_id)
+            cached = self.backend.get(key)
+            if cached is MISSING:
+                continue  # nothing cached for this room; the next read loads it
+            merged = {r[0]: r for r in cached}
+            merged.update((r[0], r) for r in rows)
+            newest = sorted(merged.values(), key=lambda r: (r[_CREATED_AT], r[0]), reverse=True)
+            self.backend.set(key, tuple(newest[: self.recent]))
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+        lookups = out["hits"] + out["misses"] + out["coalesced"]
+        out["hit_ratio"] = out["hits"] / lookups if lookups else 0.0
+        out.update(self.backend.stats())
+        return out
@@ -0,0 +1,183 @@
+"""Per-shard row/byte statistics without scanning the distributed tables.
+
+Three modes, all driven from the coordinator connection:
+
+  estimate  shard sizes from citus_shards + per-placement pg_class.reltuples
+  exact     count(*) on every shard relation (rooms_<shardid>, ...) directly,
+            fanned out to the workers in parallel by master_run_on_worker()
+  cached    re-reads shard sizes only and recounts just the shards whose size
+            changed since the previous snapshot (falls back to exact)
+
+Snapshots are plain dicts:
+  {"mode", "taken_at",
+   "shards": {(table, shardid): {"rows", "bytes", "placements", "skew"}},
+   "tables": {table: {"rows", "bytes", "skew"}},
+   "nodes":  {"node:port": {"rows", "bytes", "shards", "skew"}}}
+skew is value / mean of its peers (1.0 = perfectly even); table and node skew
+are the max of their members.
+"""
+import time
+
+from citus_sharding.catalog import TABLES, fetch_placements
+
+MODES = ("estimate", "exact", "cached")
+
+_TABLE_NAMES = [t for t, _ in TABLES]
+
+
+def _run_on_placements(cur, jobs):
+    """Run [(node, port, command)] on the workers in parallel; returns [(ok, result)]."""
+    if not jobs:
+        return []
+    cur.execute(
+        "SELECT success, result "
+        "FROM master_run_on_worker(%s::text[], %s::int[], %s::text[], true);",
+        (
+            [n for n, _, _ in jobs],
+            [p for _, p, _ in jobs],
+            [c for _, _, c in jobs],
+        ),
+    )
+    return cur.fetchall()
+
+
+def _tagged(results):
+    """Parse 'shardid:value' results into {shardid: int(value)}."""
+    out = {}
+    for ok, res in results:
+        if not ok or not res or ":" not in res:
+            continue
+        sid, val = res.split(":", 1)
+        try:
+            out[int(sid)] = int(float(val))
+        except ValueError:
+            continue
+    return out
+
+
+def fetch_shard_sizes(cur):
+    """{(table, shardid): bytes} from citus_shards (largest placement wins)."""
+    cur.execute(
+        """
+        SELECT table_name::text, shardid, max(shard_size)
+        FROM citus_shards
+        WHERE table_name IN ('rooms'::regclass,'room_members'::regclass,'messages'::regclass)
+        GROUP BY 1, 2;
+    """
+    )
+    return {(tbl, int(sid)): int(size or 0) for tbl, sid, size in cur.fetchall()}
+
+
+def fetch_reltuples(cur, placements):
+    """{(table, shardid): estimated rows} from pg_class on each shard's first placement."""
+    jobs, keys = [], {}
+    for (tbl, sid), places in placements.items():
+        if not places:
+            continue
+        node, port = places[0]
+        jobs.append(
+            (
+                node,
+                port,
+                f"SELECT '{sid}:' || reltuples::bigint FROM pg_class "
+                f"WHERE oid = '{tbl}_{sid}'::regclass",
+            )
+        )
+        keys[sid] = tbl
+    results = _tagged(_run_on_placements(cur, jobs))
+    # reltuples is -1 until the shard has been vacuumed/analyzed
+    return {(keys[sid], sid): max(v, 0) for sid, v in results.items()}
+
+
+def count_shards(cur, placements, shards=None):
+    """{(table, shardid): count(*)} for `shards` (default: all), one placement each."""
+    jobs, keys = [], {}
+    for key in shards if shards is not None else placements:
+        tbl, sid = key
+        places = placements.get(key)
+        if not places:
+            continue
+        node, port = places[0]
+        jobs.append((node, port, f"SELECT '{sid}:' || count(*) FROM {tbl}_{sid}"))
+        keys[sid] = tbl
+    results = _tagged(_run_on_placements(cur, jobs))
+    return {(keys[sid], sid): v for sid, v in results.items()}
+
+
+def _skew(values):
+    vals = list(values)
+    mean = sum(vals) / len(vals) if vals else 0
+    return [v / mean if mean else 1.0 for v in vals]
+
+
+def build_snapshot(mode, rows, sizes, placements):
+    shards = {}
+    for key, places in placements.items():
+        shards[key] = {
+            "rows": rows.get(key, 0),
+            "bytes": sizes.get(key, 0),
+            "placements": list(places),
+        }
+
+    tables = {}
+    for table in _TABLE_NAMES:
+        keys = sorted(k for k in shards if k[0] == table)
+        for k, s in zip(keys, _skew(shards[k]["rows"] for k in keys)):
+            shards[k]["skew"] = s
+        tables[table] = {
+            "rows": sum(shards[k]["rows"] for k in keys),
+            "bytes": sum(shards[k]["bytes"] for k in keys),
+            "skew": max((shards[k]["skew"] for k in keys), default=1.0),
+        }
+
+    nodes = {}
+    for (tbl, sid), s in shards.items():
+        for n, p in s["placements"]:
+            node = nodes.setdefault(f"{n}:{p}", {"rows": 0, "bytes": 0, "shards": 0})
+            node["rows"] += s["rows"]
+            node["bytes"] += s["bytes"]
+            node["shards"] += 1
+    for node, sk in zip(nodes.values(), _skew(n["rows"] for n in nodes.values())):
+        node["skew"] = sk
+
+    return {
+        "mode": mode,
+        "taken_at": time.time(),
+        "shards": shards,
+        "tables": tables,
+        "nodes": nodes,
+    }
+
+
+class ShardStats:
+    """Collects snapshots for one cluster and remembers the last one for `cached` mode."""
+
+    def __init__(self):
+        self.last = None
+
+    def collect(self, cur, mode="estimate", placements=None):
+        """Take a snapshot; `placements` (as from fetch_placements()) saves a catalog query."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown stats mode {mode!r}; expected one of {MODES}")
+        if placements is None:
+            placements = fetch_placements(cur)
+        sizes = fetch_shard_sizes(cur)
+
+        if mode == "estimate":
+            rows = fetch_reltuples(cur, placements)
+        elif mode == "exact" or self.last is None or self.last["mode"] == "estimate":
+            rows = count_shards(cur, placements)
+        else:
+            prev = self.last["shards"]
+            changed = [
+                key
+                for key in placements
+                if key not in prev
+                or prev[key]["bytes"] != sizes.get(key, 0)
+                or prev[key]["placements"] != placements[key]
+            ]
+            rows = {k: s["rows"] for k, s in prev.items() if k in placements}
+            rows.update(count_shards(cur, placements, changed))
+
+        self.last = build_snapshot(mode, rows, sizes, placements)
+        return self.last
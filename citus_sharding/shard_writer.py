@@ -0,0 +1,188 @@
+"""Shard-aware parallel writer.
+
+rooms, room_members and messages are colocated on room_id, so every shard
+group can be loaded independently. ShardWriter splits incoming column batches
+by shard group (client-side, see hash_router) and feeds a pool of lanes; each
+lane owns its connection(s) and commits its own transactions.
+
+direct=True skips the coordinator: each shard group is COPYed straight into
+the worker shard tables (rooms_<shardid>, ...) on every placement listed in
+pg_dist_placement. Use it only for bulk loads into tables nothing else writes
+to: placements are written one after another, not atomically, so a failed
+lane can leave the replicas of its shard groups out of sync (re-run the load
+after TRUNCATE, or repair with citus_copy_shard_placement).
+"""
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+from citus_sharding.copy_loader import copy_columns, column_rows
+from citus_sharding.pipeline import TABLE_ORDER, fan_out, split_chunk
+from citus_sharding.pool import get_pool
+
+
+def _empty_totals():
+    return {t: {"rows": 0, "bytes": 0, "seconds": 0.0} for t in TABLE_ORDER}
+
+
+class ShardWriter:
+    """Write column batches with `connections` parallel lanes, one per group of shards.
+
+    `router` is a hash_router.ShardRouter for the target cluster. In direct
+    mode `node_dsns` can map (nodename, nodeport) from pg_dist_node to a DSN
+    reachable from this host; by default the coordinator DSN is reused with
+    host/port swapped for the node's.
+    """
+
+    def __init__(
+        self,
+        dsn,
+        router,
+        connections=4,
+        fmt="text",
+        direct=False,
+        node_dsns=None,
+        depth=4,
+        metrics=None,
+        cache=None,
+    ):
+        self.dsn = dsn
+        self.router = router
+        self.lanes = max(1, min(connections, len(router)))
+        self.fmt = fmt
+        self.direct = direct
+        self.node_dsns = dict(node_dsns or {})
+        self.depth = depth
+        self.metrics = metrics
+        self.cache = cache
+
+    def _node_dsn(self, node, port):
+        dsn = self.node_dsns.get((node, port))
+        return dsn or make_dsn(self.dsn, host=node, port=port)
+
+    def _targets(self, group):
+        """[(dsn, {table: relation})] to COPY one shard group into."""
+        if not self.direct:
+            return [(self.dsn, {t: t for t in TABLE_ORDER})]
+        relations = {t: f"{t}_{self.router.shard_ids[t][group]}" for t in TABLE_ORDER}
+        placements = self.router.placements_of_group(group)
+        if not placements:
+            raise LookupError(f"shard group {group + 1} has no placements")
+        return [(self._node_dsn(n, p), relations) for n, p in placements]
+
+    def _connect(self, conns, dsn):
+        conn = conns.get(dsn)
+        if conn is None:
+            pool = get_pool(dsn, min_size=0, max_size=max(10, self.lanes))
+            conn = conns[dsn] = pool.getconn()
+            if self.direct:
+                with conn.cursor() as cur:
+                    # Citus 11+ refuses writes to shard relations by default
+                    cur.execute("SET citus.enable_manual_changes_to_shards TO on;")
+                conn.commit()
+        return conn
+
+    def _release(self, dsn, conn):
+        broken = conn.closed != 0
+        if self.direct and not broken:
+            try:
+                conn.rollback()
+                with conn.cursor() as cur:
+                    cur.execute("RESET citus.enable_manual_changes_to_shards;")
+                conn.commit()
+            except psycopg2.Error:
+                broken = True
+        get_pool(dsn).putconn(conn, broken=broken)
+
+    def _copy(self, conn, part, relations, totals, metrics=None):
+        with conn.cursor() as cur:
+            for table in TABLE_ORDER:
+                cols = part.get(table)
+                if not cols or not column_rows(cols, table):
+                    continue
+                st = copy_columns(cur, table, cols, self.fmt, relations[table])
+                tot = totals[table]
+                tot["rows"] += st["rows"]
+                tot["bytes"] += st["bytes"]
+                tot["seconds"] += st["seconds"]
+                if metrics is not None:
+                    metrics.observe_batch(table, st["rows"], st["bytes"], st["seconds"])
+        if metrics is None:
+            conn.commit()
+        else:
+            with metrics.phase("commit"):
+                conn.commit()
+
+    def _run_lane(self, stream, result):
+        conns = {}
+        totals = result["stats"]
+        metrics = None if self.metrics is None else self.metrics.bind(lane=result["lane"])
+        t0 = time.perf_counter()
+        try:
+            for part in stream:
+                if self.direct:
+                    groups = split_chunk(part, self.router.group_index).items()
+                else:
+                    groups = [(None, part)]
+                for group, sub in groups:
+                    for k, (dsn, relations) in enumerate(self._targets(group)):
+                        # placements of a group get the same rows; count them once
+                        if k == 0:
+                            counted, recorded = totals, metrics
+                        else:
+                            counted, recorded = _empty_totals(), None
+                        self._copy(self._connect(conns, dsn), sub, relations, counted, recorded)
+                    if self.cache is not None:
+                        # committed on every placement: refresh cached rooms
+                        self.cache.apply(sub)
+                result["batches"] += 1
+            result["ok"] = True
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}".strip()
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            for dsn, conn in conns.items():
+                self._release(dsn, conn)
+            result["seconds"] = time.perf_counter() - t0
+
+    def write(self, chunks):
+        """Load a stream of column batches; returns {"lanes": [...], "tables": {...}, "seconds"}.
+
+        Lanes that fail stop on their own; the others keep going and commit.
+        """
+        router, lanes = self.router, self.lanes
+        streams = fan_out(
+            chunks, lambda rid: router.group_index(rid) % lanes, lanes, self.depth
+        )
+        results = [
+            {"lane": i, "ok": False, "error": None, "batches": 0, "stats": _empty_totals()}
+            for i in range(lanes)
+        ]
+        t0 = time.perf_counter()
+        threads = [
+            threading.Thread(
+                target=self._run_lane,
+                args=(streams[i], results[i]),
+                name=f"shard-writer-{i}",
+            )
+            for i in range(lanes)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+
+        tables = _empty_totals()
+        for r in results:
+            for table, st in r["stats"].items():
+                for k in ("rows", "bytes"):
+                    tables[table][k] += st[k]
+        for st in tables.values():
+            st["seconds"] = wall
+            st["rows_per_s"] = st["rows"] / wall if wall > 0 else 0.0
+        return {"lanes": results, "tables": tables, "seconds": wall}
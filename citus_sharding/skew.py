@@ -0,0 +1,264 @@
+"""Offline shard skew analysis and hash-distribution simulation.
+
+Simulates how Citus would lay out a hash-distributed, colocated table set
+for any shard count, worker count and replication factor, without touching
+a cluster: shard i covers Citus's i-th equal slice of the int32 hash space
+(as create_distributed_table() computes it), keys are hashed with hashint8
+(hash_router.hash_int8), and placements go round-robin over the workers
+(shard i on workers i, i+1, ... i+rf-1 mod n, like Citus's round-robin
+placement policy). Every placement of a shard stores its rows and takes
+every write to it.
+
+Keys come from a CSV sample (room_id[,rows[,bytes[,writes]]]), e.g. exported
+with
+
+    \\copy (SELECT room_id, count(*) FROM messages GROUP BY 1) TO 'keys.csv' CSV
+
+or from a synthetic datagen distribution. The report gives per-shard and
+per-node rows, bytes and writes, the max/mean imbalance, and a greedy list of
+shard-group moves that lowers the hottest node's load for the fewest bytes
+moved.
+
+Usage:
+    python -m citus_sharding.skew --shards 3 6 12 --workers 3 --rf 2 --keys keys.csv
+    python -m citus_sharding.skew --rooms 100000 --messages zipf:1.1:5000
+"""
+import argparse
+import csv
+import sys
+from bisect import bisect_right
+
+from citus_sharding.datagen import ChatDataGen, fixed, hot_rooms, uniform, zipf
+from citus_sharding.hash_router import hash_int8
+
+INT32_MIN = -(1 << 31)
+INT32_MAX = (1 << 31) - 1
+HASH_TOKEN_COUNT = 1 << 32
+
+# Rough on-disk bytes per row (heap tuple + index entries) for synthetic keys
+ROW_BYTES = {"rooms": 80, "room_members": 120, "messages": 260}
+
+METRICS = ("rows", "bytes", "writes")
+
+
+def citus_ranges(shard_count):
+    """[(shardminvalue, shardmaxvalue)] as Citus assigns them for `shard_count` shards."""
+    if shard_count < 1:
+        raise ValueError(f"shard count must be at least 1, got {shard_count}")
+    step = HASH_TOKEN_COUNT // shard_count
+    ranges = []
+    for i in range(shard_count):
+        lo = INT32_MIN + i * step
+        hi = INT32_MAX if i == shard_count - 1 else lo + step - 1
+        ranges.append((lo, hi))
+    return ranges
+
+
+def round_robin_placements(shard_count, workers, rf):
+    """[[node index, ...] per shard]: shard i on nodes i .. i+rf-1 (mod workers)."""
+    if not 1 <= rf <= workers:
+        raise ValueError(f"replication factor {rf} needs 1..{workers} workers")
+    return [[(i % workers + r) % workers for r in range(rf)] for i in range(shard_count)]
+
+
+def load_keys_csv(path):
+    """[(key, rows, bytes, writes)] from a CSV of room_id[,rows[,bytes[,writes]]]."""
+    keys = []
+    with open(path, newline="") as f:
+        for rec in csv.reader(f):
+            if not rec or not rec[0].strip().lstrip("-").isdigit():
+                continue  # header or blank line
+            key = int(rec[0])
+            rows = float(rec[1]) if len(rec) > 1 and rec[1] else 1.0
+            nbytes = float(rec[2]) if len(rec) > 2 and rec[2] else rows * ROW_BYTES["messages"]
+            writes = float(rec[3]) if len(rec) > 3 and rec[3] else rows
+            keys.append((key, rows, nbytes, writes))
+    return keys
+
+
+def parse_distribution(spec):
+    """'fixed:N', 'uniform:LO:HI', 'zipf:ALPHA:MAX' or 'hot:N:FRACTION:COUNT'."""
+    name, *args = spec.split(":")
+    try:
+        if name == "fixed":
+            return fixed(int(args[0]))
+        if name == "uniform":
+            return uniform(int(args[0]), int(args[1]))
+        if name == "zipf":
+            return zipf(float(args[0]), int(args[1]))
+        if name == "hot":
+            return hot_rooms(fixed(int(args[0])), float(args[1]), int(args[2]))
+    except (IndexError, ValueError):
+        pass
+    raise ValueError(f"bad distribution {spec!r}")
+
+
+def synthetic_keys(n_rooms, seed=42, members=None, messages=None):
+    """[(key, rows, bytes, writes)] for rooms drawn like datagen.ChatDataGen draws them."""
+    gen = ChatDataGen(seed)
+    members = members or fixed(2)
+    messages = messages or fixed(1)
+    keys = []
+    left = n_rooms
+    while left:
+        k = min(left, 100_000)
+        left -= k
+        rids = gen.room_ids(k)
+        for rid, m, msg in zip(rids, members(gen.rng, k), messages(gen.rng, k)):
+            rows = 1 + m + msg
+            nbytes = ROW_BYTES["rooms"] + m * ROW_BYTES["room_members"] + msg * ROW_BYTES["messages"]
+            keys.append((rid, rows, nbytes, rows))
+    return keys
+
+
+def simulate(keys, shard_count, workers, rf):
+    """Lay `keys` out over a simulated cluster; returns per-shard and per-node totals."""
+    ranges = citus_ranges(shard_count)
+    mins = [lo for lo, _ in ranges]
+    placements = round_robin_placements(shard_count, workers, rf)
+    shards = [{**dict.fromkeys(METRICS, 0.0), "keys": 0} for _ in range(shard_count)]
+    for key, rows, nbytes, writes in keys:
+        s = shards[bisect_right(mins, hash_int8(key)) - 1]
+        s["keys"] += 1
+        s["rows"] += rows
+        s["bytes"] += nbytes
+        s["writes"] += writes
+    sim = {
+        "shard_count": shard_count,
+        "workers": workers,
+        "rf": rf,
+        "ranges": ranges,
+        "shards": shards,
+        "placements": placements,
+    }
+    _node_totals(sim)
+    return sim
+
+
+def _node_totals(sim):
+    nodes = [{**dict.fromkeys(METRICS, 0.0), "shards": 0} for _ in range(sim["workers"])]
+    for shard, where in zip(sim["shards"], sim["placements"]):
+        for n in where:
+            nodes[n]["shards"] += 1
+            for m in METRICS:
+                nodes[n][m] += shard[m]
+    sim["nodes"] = nodes
+    sim["imbalance"] = {m: imbalance([n[m] for n in nodes]) for m in METRICS}
+
+
+def imbalance(values):
+    """max / mean (1.0 = perfectly even)."""
+    mean = sum(values) / len(values) if values else 0.0
+    return max(values) / mean if mean > 0 else 1.0
+
+
+def suggest_moves(sim, metric="bytes", target=1.05, max_moves=10):
+    """Greedy shard-group moves off the hottest node, best load reduction per byte first.
+
+    Returns [{"shard", "source", "target", "bytes", "imbalance"}] (node
+    indexes, imbalance after the move). `sim` is left unchanged.
+    """
+    shards = sim["shards"]
+    placements = [list(p) for p in sim["placements"]]
+    loads = [n[metric] for n in sim["nodes"]]
+    moves = []
+    while len(moves) < max_moves and imbalance(loads) > target:
+        peak = max(loads)
+        src = loads.index(peak)
+        best = None
+        for i, where in enumerate(placements):
+            if src not in where or shards[i]["bytes"] <= 0:
+                continue
+            w = shards[i][metric]
+            for dst in range(len(loads)):
+                if dst in where:
+                    continue
+                after = loads[:]
+                after[src] -= w
+                after[dst] += w
+                gain = peak - max(after)
+                if gain <= 0:
+                    continue
+                score = gain / shards[i]["bytes"]
+                if best is None or score > best[0]:
+                    best = (score, i, dst, after)
+        if best is None:
+            break
+        _, i, dst, loads = best
+        placements[i][placements[i].index(src)] = dst
+        moves.append({
+            "shard": i,
+            "source": src,
+            "target": dst,
+            "bytes": shards[i]["bytes"],
+            "imbalance": imbalance(loads),
+        })
+    return moves
+
+
+def _human(n):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(n) < 1024 or unit == "TB":
+            return f"{n:,.1f} {unit}"
+        n /= 1024
+
+
+def format_simulation(sim, moves=()):
+    lines = [
+        f"shard_count={sim['shard_count']} workers={sim['workers']} rf={sim['rf']}: "
+        + ", ".join(f"{m} imbalance {v:.2f}x" for m, v in sim["imbalance"].items())
+    ]
+    for i, n in enumerate(sim["nodes"]):
+        lines.append(
+            f"  worker{i + 1}: {n['shards']} placements, {n['rows']:,.0f} rows, "
+            f"{_human(n['bytes'])}, {n['writes']:,.0f} writes"
+        )
+    for mv in moves:
+        lines.append(
+            f"  move shard group {mv['shard'] + 1}: worker{mv['source'] + 1} -> "
+            f"worker{mv['target'] + 1} ({_human(mv['bytes'])}), "
+            f"imbalance {mv['imbalance']:.2f}x after"
+        )
+    return "\n".join(lines)
+
+
+def main(argv):
+    p = argparse.ArgumentParser(
+        prog="python -m citus_sharding.skew",
+        description="Simulate Citus hash distribution offline and report skew.",
+    )
+    p.add_argument("--shards", type=int, nargs="+", default=[3], help="candidate shard counts")
+    p.add_argument("--workers", type=int, default=3)
+    p.add_argument("--rf", type=int, default=2, help="shard replication factor")
+    p.add_argument("--keys", help="CSV key sample: room_id[,rows[,bytes[,writes]]]")
+    p.add_argument("--rooms", type=int, default=100_000, help="synthetic rooms (without --keys)")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--members", default="fixed:2", help="members per room distribution")
+    p.add_argument("--messages", default="fixed:1", help="messages per room distribution")
+    p.add_argument("--balance", choices=METRICS, default="bytes", help="metric to even out")
+    p.add_argument("--target", type=float, default=1.05, help="stop moving at this imbalance")
+    p.add_argument("--max-moves", type=int, default=10)
+    args = p.parse_args(argv)
+
+    try:
+        if args.keys:
+            keys = load_keys_csv(args.keys)
+        else:
+            keys = synthetic_keys(
+                args.rooms,
+                args.seed,
+                parse_distribution(args.members),
+                parse_distribution(args.messages),
+            )
+        sims = [simulate(keys, n, args.workers, args.rf) for n in args.shards]
+    except (OSError, ValueError) as e:
+        p.error(str(e))
+    print(f"{len(keys):,} keys")
+    for sim in sims:
+        moves = suggest_moves(sim, args.balance, args.target, args.max_moves)
+        print(format_simulation(sim, moves))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,110 @@
+"""Tenant (room) -> cluster routing for the active-active deployment.
+
+Rooms are spread over N independent Citus clusters with jump consistent
+hashing (Lamping & Veach), so growing from N to N+1 clusters moves only
+~1/(N+1) of the rooms. Individual rooms can be pinned to a cluster through an
+override table (e.g. after a tenant migration); lookups go through an LRU
+cache so hot rooms resolve with a single dict hit.
+"""
+from collections import defaultdict
+from functools import lru_cache
+from string import ascii_uppercase
+
+_M64 = 0xFFFFFFFFFFFFFFFF
+_JUMP_MUL = 2862933555777941757
+
+
+def jump_hash(key, num_buckets):
+    """Bucket in [0, num_buckets) for a 64-bit integer key."""
+    key &= _M64
+    b, j = -1, 0
+    while j < num_buckets:
+        b = j
+        key = (key * _JUMP_MUL + 1) & _M64
+        j = int((b + 1) * (2147483648.0 / ((key >> 33) + 1)))
+    return b
+
+
+class TenantRouter:
+    """Route room ids to one of N clusters.
+
+    route() returns the cluster index; dsns[i] / names[i] describe it.
+    Cluster order matters: only append new clusters to the end of `dsns`,
+    otherwise the jump hash reassigns far more than 1/N of the rooms.
+    """
+
+    def __init__(self, dsns, names=None, overrides=None, cache_size=1 << 16):
+        if not dsns:
+            raise ValueError("TenantRouter needs at least one cluster DSN")
+        self.dsns = list(dsns)
+        if names is None:
+            names = [
+                f"Cluster {ascii_uppercase[i]}" if i < 26 else f"Cluster {i + 1}"
+                for i in range(len(self.dsns))
+            ]
+        if len(names) != len(self.dsns):
+            raise ValueError("names and dsns must have the same length")
+        self.names = list(names)
+        self._overrides = {}
+        for room_id, cluster in (overrides or {}).items():
+            self._overrides[room_id] = self._index(cluster)
+
+        n = len(self.dsns)
+        pinned = self._overrides
+
+        def resolve(room_id):
+            c = pinned.get(room_id)
+            return jump_hash(room_id, n) if c is None else c
+
+        self._resolve = lru_cache(maxsize=cache_size)(resolve)
+
+    def __len__(self):
+        return len(self.dsns)
+
+    def _index(self, cluster):
+        if isinstance(cluster, str):
+            return self.names.index(cluster)
+        if not 0 <= cluster < len(self.dsns):
+            raise IndexError(f"cluster index {cluster} out of range")
+        return cluster
+
+    # ---------- overrides ----------
+
+    def pin(self, room_id, cluster):
+        """Force `room_id` onto `cluster` (index or name)."""
+        self._overrides[room_id] = self._index(cluster)
+        self._resolve.cache_clear()
+
+    def unpin(self, room_id):
+        if self._overrides.pop(room_id, None) is not None:
+            self._resolve.cache_clear()
+
+    def overrides(self):
+        return dict(self._overrides)
+
+    def cache_info(self):
+        return self._resolve.cache_info()
+
+    # ---------- routing ----------
+
+    def route(self, room_id):
+        return self._resolve(room_id)
+
+    def dsn_for(self, room_id):
+        return self.dsns[self._resolve(room_id)]
+
+    def route_many(self, room_ids):
+        """{cluster_index: [room_ids]} preserving input order per cluster."""
+        resolve = self._resolve
+        out = defaultdict(list)
+        for rid in room_ids:
+            out[resolve(rid)].append(rid)
+        return dict(out)
+
+    def route_rows(self, rows, key_index):
+        """Group row tuples by the cluster of row[key_index] -> {cluster_index: [rows]}."""
+        resolve = self._resolve
+        out = defaultdict(list)
+        for row in rows:
+            out[resolve(row[key_index])].append(row)
+        return dict(out)
@@ -0,0 +1,95 @@
+import os
+import struct
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.copy_loader import (
+    BINARY_HEADER,
+    BINARY_TRAILER,
+    COLUMNS,
+    CopyStream,
+    encode_blocks,
+)
+
+TS = datetime(2024, 3, 1, 12, 30, 15, 250_000, tzinfo=timezone.utc)
+
+
+def message(**overrides):
+    row = {
+        "id": 1, "room_id": 42, "message_type": 2, "text": "hi", "is_by_partner": True,
+        "local_timestamp": TS, "server_timestamp": TS, "status": 1, "is_deleted": False,
+        "action": None, "parent_message_id": None, "created_at": TS, "updated_at": TS,
+    }
+    row.update(overrides)
+    return {c: [row[c]] for c in COLUMNS["messages"]}
+
+
+def text(columns, table="messages"):
+    return b"".join(encode_blocks(table, columns, "text")).decode()
+
+
+def test_text_escapes_and_nulls():
+    line = text(message(text="a\tb\\c\nd\re"))
+    fields = line[:-1].split("\t")
+    assert line.endswith("\n") and len(fields) == len(COLUMNS["messages"])
+    assert fields[3] == "a\\tb\\\\c\\nd\\re"
+    assert fields[4] == "t" and fields[8] == "f"
+    assert fields[9] == fields[10] == "\\N"
+
+
+def test_text_timestamps():
+    naive = TS.replace(tzinfo=None)
+    cet = TS.astimezone(timezone(timedelta(hours=1)))
+    fields = text(message(local_timestamp=naive, server_timestamp=cet))[:-1].split("\t")
+    # naive datetimes are UTC; aware ones keep their offset
+    assert fields[5] == "2024-03-01T12:30:15.250000+00:00"
+    assert fields[6] == "2024-03-01T13:30:15.250000+01:00"
+
+
+def test_text_rows_span_blocks():
+    cols = {
+        "id": list(range(5)),
+        "room_type": [1] * 5,
+        "created_at": [TS] * 5,
+        "updated_at": [None] * 5,
+    }
+    blocks = list(encode_blocks("rooms", cols, "text", block_rows=2))
+    assert len(blocks) == 3
+    lines = b"".join(blocks).decode().splitlines()
+    assert [ln.split("\t")[0] for ln in lines] == ["0", "1", "2", "3", "4"]
+    assert all(ln.endswith("\t\\N") for ln in lines)
+
+
+def test_binary_layout():
+    data = b"".join(encode_blocks("messages", message(), "binary"))
+    assert data.startswith(BINARY_HEADER) and data.endswith(BINARY_TRAILER)
+    body = data[len(BINARY_HEADER) : -len(BINARY_TRAILER)]
+    (fields,) = struct.unpack_from("!h", body)
+    assert fields == len(COLUMNS["messages"])
+    pos, values = 2, []
+    for _ in range(fields):
+        (n,) = struct.unpack_from("!i", body, pos)
+        pos += 4
+        values.append(None if n == -1 else body[pos : pos + n])
+        pos += max(n, 0)
+    assert pos == len(body)
+    assert struct.unpack("!q", values[0]) == (1,)
+    assert struct.unpack("!h", values[2]) == (2,)
+    assert values[3] == b"hi"
+    assert values[4] == b"\x01" and values[8] == b"\x00"
+    assert values[9] is None and values[10] is None
+    # microseconds since 2000-01-01 UTC, naive timestamps as UTC
+    micros = (TS - datetime(2000, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1)
+    assert struct.unpack("!q", values[5]) == (micros,)
+    naive = b"".join(encode_blocks("messages", message(created_at=TS.replace(tzinfo=None)), "binary"))
+    assert naive == data
+
+
+def test_copy_stream_reads_across_blocks():
+    stream = CopyStream([b"abc", b"", b"defg", b"h"])
+    assert stream.read(2) == b"ab"
+    assert stream.read(4) == b"cdef"
+    assert stream.read() == b"gh"
+    assert stream.read(10) == b""
+    assert stream.bytes == 8
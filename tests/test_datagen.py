@@ -0,0 +1,47 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.datagen import ID_SPACE, ChatDataGen, uniform, zipf
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def dataset(seed, **kwargs):
+    gen = ChatDataGen(seed, now=NOW, **kwargs)
+    return list(gen.chunks(2_000, 300))
+
+
+def test_same_seed_same_dataset():
+    kwargs = {"members": uniform(1, 4), "messages": zipf(1.2, 50)}
+    assert dataset(7, **kwargs) == dataset(7, **kwargs)
+    assert dataset(7, **kwargs) != dataset(8, **kwargs)
+
+
+def test_room_ids_are_unique_and_in_range():
+    gen = ChatDataGen(3, now=NOW)
+    ids = gen.room_ids(50_000) + gen.room_ids(50_000)
+    assert len(set(ids)) == len(ids)
+    assert all(1 <= i <= ID_SPACE for i in ids)
+    # chunking does not change the ids
+    assert [r for c in dataset(3) for r in c["rooms"]["id"]] == ChatDataGen(3).room_ids(2_000)
+
+
+def test_row_ids_are_unique_per_room():
+    chunks = dataset(5, members=uniform(0, 5), messages=uniform(0, 5))
+    for table in ("room_members", "messages"):
+        keys = [
+            key
+            for c in chunks
+            for key in zip(c[table]["room_id"], c[table]["id"])
+        ]
+        assert len(set(keys)) == len(keys)
+        rooms = {r for c in chunks for r in c["rooms"]["id"]}
+        assert {k for k, _ in keys} <= rooms
+
+
+def test_columns_have_one_value_per_row():
+    for chunk in dataset(1, members=uniform(0, 3), messages=uniform(0, 3)):
+        for table, cols in chunk.items():
+            assert len({len(v) for v in cols.values()}) == 1, table
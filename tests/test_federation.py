@@ -0,0 +1,87 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+pytest.importorskip("psycopg2")
+from citus_sharding import federation
+from citus_sharding.federation import Federation
+
+# Rows each fake cluster returns, already sorted descending
+ROWS = {"a": [(5, "a"), (3, "a"), (1, "a")], "b": [(4, "b"), (2, "b")]}
+
+
+class _Cursor:
+    def __init__(self, dsn):
+        self.rows = list(ROWS[dsn])
+        self.itersize = 2000
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, n):
+        rows, self.rows = self.rows[:n], self.rows[n:]
+        return rows
+
+
+class _Conn:
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    def cursor(self, name=None):
+        return _Cursor(self.dsn)
+
+    def rollback(self):
+        pass
+
+
+class _Pool:
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    @contextmanager
+    def connection(self, timeout=None):
+        if self.dsn == "dead":
+            raise OSError("connection refused")
+        yield _Conn(self.dsn)
+
+
+@pytest.fixture
+def fed(monkeypatch):
+    monkeypatch.setattr(federation, "get_pool", lambda dsn, **kw: _Pool(dsn))
+    return Federation(["a", "dead", "b"], ["A", "Dead", "B"])
+
+
+def test_unreachable_cluster_fails_the_call_by_default(fed):
+    with pytest.raises(OSError):
+        fed.gather("SELECT 1")
+
+
+def test_gather_and_aggregate_skip_failed_clusters(fed):
+    failed = {}
+    assert fed.gather("SELECT 1", failed=failed) == [("A", ROWS["a"]), ("B", ROWS["b"])]
+    assert failed == {"Dead": "OSError: connection refused"}
+
+    failed = {}
+    totals = fed.aggregate("SELECT 1", kinds=("max", "min"), failed=failed)
+    assert totals == {(): [5, "a"]}
+    assert list(failed) == ["Dead"]
+
+
+def test_merge_skips_failed_clusters(fed):
+    failed = {}
+    rows = list(fed.merge("SELECT 1", key=lambda r: r[0], reverse=True, limit=4, failed=failed))
+    assert rows == [(5, "a"), (4, "b"), (3, "a"), (2, "b")]
+    assert failed == {"Dead": "OSError: connection refused"}
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.hash_router import ShardRouter, hash_int8
+from citus_sharding.skew import citus_ranges
+
+
+def router(shard_count, tables=("rooms", "messages")):
+    ranges, placements = {}, {}
+    for t, table in enumerate(tables):
+        for i, bounds in enumerate(citus_ranges(shard_count)):
+            sid = 102008 + t * shard_count + i
+            ranges[(table, sid)] = bounds
+            placements[(table, sid)] = [(f"worker{i % 2 + 1}", 5432)]
+    return ShardRouter(ranges, placements, list(tables))
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    # SELECT hashint8(value) on PostgreSQL
+    [(0, -272711505), (1, -1905060026), (2, 1134484726)],
+)
+def test_hash_int8_matches_postgres(value, expected):
+    assert hash_int8(value) == expected
+
+
+def test_hash_int8_folds_the_high_half():
+    # hashint8 xors the high 32 bits into the low ones (inverted for negatives)
+    assert hash_int8(1 << 32) == hash_int8(1)
+    assert hash_int8(-1) == hash_int8((1 << 32) - 1)
+    assert all(-(1 << 31) <= hash_int8(v) < 1 << 31 for v in (-(1 << 63), (1 << 63) - 1, 42))
+
+
+def test_group_index_bisects_the_shard_ranges():
+    r = router(4)
+    bounds = citus_ranges(4)
+    for key in range(1, 2_000):
+        i = r.group_index(key)
+        lo, hi = bounds[i]
+        assert lo <= hash_int8(key) <= hi
+    assert r.group_index(1) == 0  # hash -1905060026
+    assert r.group_index(0) == 1  # hash -272711505
+    assert r.group_index(2) == 3  # hash 1134484726
+    keys = list(range(500))
+    assert r.group_indexes(keys) == [r.group_index(k) for k in keys]
+
+
+def test_shards_of_one_group_share_the_index():
+    r = router(4)
+    assert r.shard_for(2, "rooms") == 102011
+    assert r.shard_for(2, "messages") == 102015
+    assert r.group_for_shard(102015) == 3
+    assert r.placements_for(2, "messages") == (("worker2", 5432),)
+    assert sorted(k for ks in r.bucket(range(100)).values() for k in ks) == list(range(100))
+
+
+def test_uncovered_hash_raises():
+    ranges = {("rooms", 1): (-(1 << 31), -1)}
+    r = ShardRouter(ranges, {}, ["rooms"])
+    assert r.group_index(1) == 0
+    with pytest.raises(LookupError):
+        r.group_index(2)
+
+
+def test_tables_must_be_colocated():
+    ranges = {("rooms", 1): (-(1 << 31), (1 << 31) - 1), ("messages", 2): (0, (1 << 31) - 1)}
+    with pytest.raises(ValueError):
+        ShardRouter(ranges, {}, ["rooms", "messages"])
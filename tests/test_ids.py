@@ -0,0 +1,80 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.ids import (
+    EPOCH_MS,
+    SEQUENCE_SIZE,
+    ClockRegressionError,
+    IdAllocator,
+    min_id_at,
+    parse_id,
+)
+
+START_MS = EPOCH_MS + 86_400_000  # one day after the epoch
+
+
+class Clock:
+    def __init__(self, ms=START_MS):
+        self.ms = ms
+
+    def __call__(self):
+        return self.ms
+
+
+def test_bit_layout():
+    ids = IdAllocator(5, 63, clock=Clock())
+    value = ids.next_id()
+    assert value == (86_400_000 << 22) | (5 << 18) | (63 << 12)
+    assert parse_id(value) == {
+        "timestamp": datetime.fromtimestamp(START_MS / 1000.0, timezone.utc),
+        "cluster": 5,
+        "worker": 63,
+        "sequence": 0,
+    }
+    assert parse_id(ids.next_id())["sequence"] == 1
+    assert min_id_at(parse_id(value)["timestamp"]) <= value < min_id_at(
+        datetime.fromtimestamp((START_MS + 1) / 1000.0, timezone.utc)
+    )
+
+
+@pytest.mark.parametrize("cluster, worker", [(16, 0), (-1, 0), (0, 64)])
+def test_slot_out_of_range(cluster, worker):
+    with pytest.raises(ValueError):
+        IdAllocator(cluster, worker)
+
+
+def test_ids_increase_and_roll_over_the_sequence():
+    clock = Clock()
+    ids = IdAllocator(1, 2, clock=clock)
+    taken = ids.take(SEQUENCE_SIZE + 10)
+    clock.ms += 5
+    taken += [ids.next_id() for _ in range(10)]
+    assert taken == sorted(set(taken))
+    # the 4097th id borrows the next millisecond
+    assert parse_id(taken[SEQUENCE_SIZE])["sequence"] == 0
+    assert parse_id(taken[SEQUENCE_SIZE])["timestamp"] > parse_id(taken[0])["timestamp"]
+    ranges = ids.allocate(3)
+    assert len(ranges) == 1 and len(ranges[0]) == 3 and ranges[0][0] > taken[-1]
+
+
+def test_small_clock_regression_keeps_ids_increasing():
+    clock = Clock()
+    ids = IdAllocator(0, 0, clock=clock, max_backwards_ms=100)
+    first = ids.next_id()
+    clock.ms -= 50
+    second = ids.next_id()
+    assert second > first and ids.regressions == 1
+    assert parse_id(second)["timestamp"] == parse_id(first)["timestamp"]
+
+
+def test_large_clock_regression_raises():
+    clock = Clock()
+    ids = IdAllocator(0, 0, clock=clock, max_backwards_ms=100)
+    ids.next_id()
+    clock.ms -= 101
+    with pytest.raises(ClockRegressionError):
+        ids.next_id()
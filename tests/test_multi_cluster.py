@@ -0,0 +1,56 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+pytest.importorskip("psycopg2")
+from citus_sharding import multi_cluster
+from citus_sharding.pipeline import room_chunks, split_streams
+from citus_sharding.tenant_router import jump_hash
+
+
+class _Cursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Conn:
+    def cursor(self):
+        return _Cursor()
+
+    def commit(self):
+        pass
+
+
+class _Pool:
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    @contextmanager
+    def connection(self):
+        if self.dsn == "dead":
+            raise OSError("connection refused")
+        yield _Conn()
+
+
+def test_failed_cluster_does_not_stall_the_others(monkeypatch):
+    monkeypatch.setattr(multi_cluster, "get_pool", lambda dsn, **kw: _Pool(dsn))
+    route = lambda room_id: jump_hash(room_id, 2)
+    # depth=1: the dead cluster's queue fills after one chunk
+    streams = split_streams(lambda: room_chunks(200, 1, chunk_rooms=5), route, 2, depth=1)
+
+    def load(stream):
+        return lambda cur: {"rooms": {"rows": sum(len(c["rooms"]["id"]) for c in stream)}}
+
+    results, _ = multi_cluster.run_clusters(
+        [("A", "ok", load(streams[0]), streams[0]), ("B", "dead", load(streams[1]), streams[1])],
+        connect_timeout=1,
+    )
+    expected = sum(1 for c in room_chunks(200, 1, chunk_rooms=5) for r in c["rooms"]["id"] if route(r) == 0)
+    assert results[0]["ok"] and results[0]["rows"] == expected
+    assert not results[1]["ok"] and "connection refused" in results[1]["error"]
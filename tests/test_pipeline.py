@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.pipeline import copy_chunks, room_chunks, split_streams
+from citus_sharding.tenant_router import jump_hash
+
+
+def route(room_id):
+    return jump_hash(room_id, 2)
+
+
+def rooms_of(stream):
+    return sorted(r for chunk in stream for r in chunk["rooms"]["id"])
+
+
+def test_split_streams_sequential_consumption():
+    # Reading stream 0 to the end before touching stream 1 used to hang fan_out()
+    make = lambda: room_chunks(100, 1, chunk_rooms=5)
+    streams = split_streams(make, route, 2, concurrent=False, depth=2)
+    first = rooms_of(streams[0])
+    second = rooms_of(streams[1])
+    expected = rooms_of(make())
+    assert sorted(first + second) == expected
+    assert all(route(r) == 0 for r in first)
+    assert all(route(r) == 1 for r in second)
+
+
+def test_split_streams_concurrent_matches_sequential():
+    make = lambda: room_chunks(100, 1, chunk_rooms=5)
+    shared = split_streams(make, route, 2, concurrent=True, depth=64)
+    # depth covers the whole stream, so reading in order cannot block here
+    got = [rooms_of(shared[0]), rooms_of(shared[1])]
+    separate = split_streams(make, route, 2, concurrent=False)
+    assert got == [rooms_of(s) for s in separate]
+
+
+def test_fan_out_stream_closed_before_first_next():
+    # A stream closed without ever being iterated must not stall the others
+    streams = split_streams(lambda: room_chunks(200, 1, chunk_rooms=5), route, 2, depth=1)
+    streams[1].close()
+    got = []
+    t = threading.Thread(target=lambda: got.append(rooms_of(streams[0])), daemon=True)
+    t.start()
+    t.join(timeout=10)
+    assert not t.is_alive(), "stream 0 blocked on the abandoned stream's full queue"
+    assert got[0] == [r for r in rooms_of(room_chunks(200, 1, chunk_rooms=5)) if route(r) == 0]
+
+
+class _CopyCursor:
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, stream, size=8192):
+        self.copies.append((sql.split()[1], stream.read()))
+
+
+class _FixedBatcher:
+    def next_size(self, table):
+        return 7
+
+    def observe(self, table, rows, nbytes, seconds):
+        pass
+
+
+def test_copy_chunks_rebatches_in_order():
+    cur = _CopyCursor()
+    chunks = list(room_chunks(50, 1, chunk_rooms=3))
+    totals = copy_chunks(cur, iter(chunks), batcher=_FixedBatcher())
+    unbatched = _CopyCursor()
+    copy_chunks(unbatched, iter(chunks))
+    for table in ("rooms", "room_members", "messages"):
+        sizes = [data.count(b"\n") for t, data in cur.copies if t == table]
+        assert sizes[:-1] == [7] * (len(sizes) - 1) and 0 < sizes[-1] <= 7
+        assert totals[table]["rows"] == sum(sizes)
+        assert b"".join(d for t, d in cur.copies if t == table) == b"".join(
+            d for t, d in unbatched.copies if t == table
+        )
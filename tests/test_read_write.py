@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+pytest.importorskip("psycopg2")
+from citus_sharding.read_write import is_read_only
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT * FROM messages WHERE room_id = %s ORDER BY created_at DESC LIMIT 50;",
+        "  -- latest\nselect count(*), max(created_at) FROM messages;",
+        "/* report */ SELECT room_id, count(*) FILTER (WHERE NOT is_deleted) FROM messages "
+        "GROUP BY room_id;",
+        "WITH r AS (SELECT id FROM rooms) SELECT coalesce(sum(1), 0) FROM r;",
+        "SELECT id FROM rooms WHERE id IN (SELECT room_id FROM room_members) AND EXISTS (SELECT 1);",
+        "SELECT row_number() OVER (PARTITION BY room_id ORDER BY id) FROM messages;",
+        "SELECT pg_catalog.now(), x::numeric(10, 2) FROM t;",
+        "(SELECT 1) UNION (SELECT 2)",
+        "SHOW search_path",
+        "TABLE rooms;",
+    ],
+)
+def test_reads_go_to_standby(sql):
+    assert is_read_only(sql)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "INSERT INTO rooms (id) VALUES (1);",
+        "UPDATE rooms SET name = 'x';",
+        "WITH d AS (DELETE FROM rooms RETURNING id) SELECT * FROM d;",
+        "SELECT * INTO copy_of_rooms FROM rooms;",
+        "SELECT * FROM rooms FOR UPDATE;",
+        "SELECT * FROM rooms FOR NO KEY UPDATE SKIP LOCKED;",
+        "SELECT nextval('rooms_id_seq');",
+        "SELECT citus_add_node('worker3', 5432);",
+        "SELECT pg_advisory_lock(42);",
+        "SELECT set_config('search_path', 'public', false);",
+        "SELECT pg_notify('rooms', 'changed');",
+        "SELECT myschema.count(*) FROM rooms;",
+        'SELECT "nextval"(\'rooms_id_seq\');',
+        "SELECT 1; NOTIFY rooms;",
+        "EXPLAIN ANALYZE SELECT * FROM rooms;",
+        "SET search_path TO public;",
+        "",
+    ],
+)
+def test_writes_and_unknown_calls_go_to_leader(sql):
+    assert not is_read_only(sql)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.skew import citus_ranges
+
+
+def test_citus_ranges_match_citus():
+    # pg_dist_shard shardminvalue / shardmaxvalue for shard_count = 4 and 3
+    assert citus_ranges(4) == [
+        (-2147483648, -1073741825),
+        (-1073741824, -1),
+        (0, 1073741823),
+        (1073741824, 2147483647),
+    ]
+    assert citus_ranges(3) == [
+        (-2147483648, -715827884),
+        (-715827883, 715827881),
+        (715827882, 2147483647),
+    ]
+
+
+@pytest.mark.parametrize("shard_count", [1, 7, 32, 1000])
+def test_citus_ranges_cover_int32_without_gaps(shard_count):
+    ranges = citus_ranges(shard_count)
+    assert len(ranges) == shard_count
+    assert ranges[0][0] == -(1 << 31) and ranges[-1][1] == (1 << 31) - 1
+    assert all(hi + 1 == lo for (_, hi), (lo, _) in zip(ranges, ranges[1:]))
+
+
+def test_citus_ranges_rejects_zero_shards():
+    with pytest.raises(ValueError):
+        citus_ranges(0)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from citus_sharding.tenant_router import TenantRouter, jump_hash
+
+ROOMS = range(1, 20_001)
+
+
+def test_jump_hash_is_stable_and_in_range():
+    assert [jump_hash(k, 1) for k in range(100)] == [0] * 100
+    assert all(0 <= jump_hash(k, 5) < 5 for k in ROOMS)
+    assert [jump_hash(k, 7) for k in range(100)] == [jump_hash(k, 7) for k in range(100)]
+
+
+def test_appending_a_cluster_only_moves_rooms_onto_it():
+    for n in (2, 3, 8):
+        before = TenantRouter([f"dsn{i}" for i in range(n)])
+        after = TenantRouter([f"dsn{i}" for i in range(n + 1)])
+        moved = [r for r in ROOMS if before.route(r) != after.route(r)]
+        assert all(after.route(r) == n for r in moved)
+        # about 1/(n+1) of the rooms move
+        assert abs(len(moved) / len(ROOMS) - 1 / (n + 1)) < 0.02
+
+
+def test_pins_override_the_hash():
+    router = TenantRouter(["a", "b"], overrides={7: "Cluster B"})
+    assert router.route(7) == 1
+    other = 1 - jump_hash(8, 2)
+    router.pin(8, other)
+    assert router.route(8) == other and router.dsn_for(8) == router.dsns[other]
+    router.unpin(8)
+    assert router.route(8) == jump_hash(8, 2)
+    grouped = router.route_many(range(100))
+    assert sorted(r for rs in grouped.values() for r in rs) == list(range(100))